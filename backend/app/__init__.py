@@ -3,16 +3,84 @@ from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 
-def create_app():
+from components.content_bundle import BundleStore
+from components.content_repository import ContentRepository
+from components.job_queue import JobQueue
+from components.rate_limiter import RateLimiter, parse_limit, trust_proxies
+from components.result_cache import ResultCache
+from components.submission_store import SubmissionStore
+
+def create_app(config=None):
     load_dotenv()  # load environment variables from .env
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret')
-    
+    # Directory holding the JSON data files, relative to the 'backend' root directory
+    app.config['DATA_DIR'] = os.getenv('DATA_DIR', os.path.join('app', 'data'))
+    if config:
+        app.config.update(config)
+    # SQLite database holding challenge submissions and quiz progress
+    app.config.setdefault('SUBMISSIONS_DB', os.path.join(app.config['DATA_DIR'], 'submissions.sqlite3'))
+    # Compressed segments of old history moved out of the database by `flask archive-history`,
+    # and how many days of history that command keeps live by default
+    app.config.setdefault('ARCHIVE_DIR', os.getenv('ARCHIVE_DIR', os.path.join(app.config['DATA_DIR'], 'archive')))
+    app.config.setdefault('HISTORY_HOT_DAYS', int(os.getenv('HISTORY_HOT_DAYS', '180')))
+    # Compiled content bundles written by `flask build-bundle`
+    app.config.setdefault('BUNDLE_DIR', os.getenv('BUNDLE_DIR', os.path.join(app.config['DATA_DIR'], 'bundles')))
+    # Queue of background grading jobs, and whether validation uses it by default
+    app.config.setdefault('JOBS_DB', os.path.join(app.config['DATA_DIR'], 'jobs.sqlite3'))
+    app.config.setdefault('ASYNC_GRADING', os.getenv('ASYNC_GRADING', 'false').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('GRADING_WORKERS', int(os.getenv('GRADING_WORKERS', '2')))
+    app.config.setdefault('GRADING_QUEUE_DEPTH', int(os.getenv('GRADING_QUEUE_DEPTH', '200')))
+    # Token buckets ("<per minute>/<burst>") per user and per IP
+    app.config.setdefault('RATE_LIMITING', os.getenv('RATE_LIMITING', 'true').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('RATE_LIMIT_DB', os.path.join(app.config['DATA_DIR'], 'ratelimits.sqlite3'))
+    app.config.setdefault('RATE_LIMIT_USER', os.getenv('RATE_LIMIT_USER', '30/10'))
+    app.config.setdefault('RATE_LIMIT_IP', os.getenv('RATE_LIMIT_IP', '300/60'))
+    # Reverse proxies (nginx) in front of the app whose X-Forwarded-For gives the client IP
+    app.config.setdefault('TRUSTED_PROXIES', int(os.getenv('TRUSTED_PROXIES', '0')))
+    # Directory where each worker process shares its metrics for /metrics
+    app.config.setdefault('METRICS_DIR', os.getenv('METRICS_DIR', os.path.join(app.config['DATA_DIR'], 'metrics')))
+
+    app.wsgi_app = trust_proxies(app.wsgi_app, app.config['TRUSTED_PROXIES'])
+
     # Enable CORS for frontend connections
     CORS(app, origins=['http://localhost:3000', 'http://localhost:5173', 'http://localhost:3001'])
 
+    # Curriculum content is loaded once per worker and shared by all requests
+    app.extensions['content'] = ContentRepository(app.config['DATA_DIR'])
+    # Submissions are appended to SQLite; the old JSON files are imported on first use
+    app.extensions['store'] = SubmissionStore(app.config['SUBMISSIONS_DB'], legacy_dir=app.config['DATA_DIR'],
+                                              archive_dir=app.config['ARCHIVE_DIR'])
+    # Compiled bundles never change, so each one is read from disk at most once per worker
+    app.extensions['bundles'] = BundleStore(app.config['BUNDLE_DIR'])
+    # Bounded cache of validation results for repeated submissions
+    app.extensions['result_cache'] = ResultCache()
+    # A few background threads per worker grade queued submissions; the rest keep serving reads
+    app.extensions['jobs'] = JobQueue(app.config['JOBS_DB'], workers=app.config['GRADING_WORKERS'],
+                                      max_depth=app.config['GRADING_QUEUE_DEPTH'])
+    # Request rates shared by all workers through SQLite, so one client cannot flood the grading queue
+    app.extensions['rate_limiter'] = RateLimiter(
+        app.config['RATE_LIMIT_DB'],
+        limits={'user': parse_limit(app.config['RATE_LIMIT_USER']), 'ip': parse_limit(app.config['RATE_LIMIT_IP'])},
+        enabled=app.config['RATE_LIMITING']
+    )
+
     # Import routes and register
-    from .routes import main
+    from .routes import main, run_validation_job
     app.register_blueprint(main)
 
+    # Queued validations run outside any request, so give them this app's context
+    def handle_validation_job(payload):
+        with app.app_context():
+            return run_validation_job(payload)
+    app.extensions['jobs'].register('validate', handle_validation_job)
+
+    # Request timing for the /metrics endpoint
+    from .instrumentation import register_metrics
+    register_metrics(app)
+
+    # Maintenance commands for the `flask` CLI
+    from .commands import register_commands
+    register_commands(app)
+
     return app
@@ -0,0 +1,47 @@
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+
+from components.content_bundle import ContentError, compile_bundle, read_content, write_bundle
+
+
+def register_commands(app):
+    """Register the maintenance commands available through the `flask` CLI."""
+
+    @app.cli.command('rebuild-aggregates')
+    def rebuild_aggregates():
+        """Recompute per-user quiz and challenge aggregates from the raw logs."""
+        counts = current_app.extensions['store'].rebuild_aggregates()
+        for name, count in counts.items():
+            click.echo(f"Rebuilt {name} aggregates from {count} records.")
+
+    @app.cli.command('archive-history')
+    @click.option('--before', default=None, help='Archive records from before this date (YYYY-MM-DD), e.g. the start of the term.')
+    @click.option('--keep-days', default=None, type=int, help='Archive records older than this many days (default: HISTORY_HOT_DAYS).')
+    def archive_history(before, keep_days):
+        """Move old submissions and quiz progress into compressed archive segments."""
+        if before is not None:
+            try:
+                before = date.fromisoformat(before).isoformat()
+            except ValueError:
+                raise click.BadParameter('must be a date like 2025-09-01', param_hint='--before')
+        else:
+            days = keep_days if keep_days is not None else current_app.config['HISTORY_HOT_DAYS']
+            before = (datetime.now() - timedelta(days=days)).isoformat()
+        counts = current_app.extensions['store'].archive_history(before)
+        for table, count in counts.items():
+            click.echo(f"Archived {count} {table} records from before {before}.")
+
+    @app.cli.command('build-bundle')
+    @click.option('--out', default=None, help='Directory to write the bundle to (default: BUNDLE_DIR).')
+    def build_bundle(out):
+        """Validate the content files and compile them into a hashed, minified bundle."""
+        try:
+            document = compile_bundle(read_content(current_app.config['DATA_DIR']))
+        except ContentError as e:
+            for error in e.errors:
+                click.echo(f"  {error}", err=True)
+            raise click.ClickException(f"Content is invalid, no bundle was written ({len(e.errors)} errors).")
+        manifest = write_bundle(document, out or current_app.config['BUNDLE_DIR'])
+        click.echo(f"Wrote {manifest['file']} ({manifest['bytes']} bytes, {manifest['gzip_bytes']} gzipped).")
@@ -0,0 +1,26 @@
+import time
+
+from flask import g, request
+
+from components import metrics
+
+
+def register_metrics(app):
+    """Time every request and share the numbers with the other workers."""
+    metrics.configure(app.config['METRICS_DIR'])
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # Label by route pattern (e.g. /modules/<int:module_id>) to keep the series bounded
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            registry = metrics.get_registry()
+            registry.observe('http_request_duration_seconds', time.perf_counter() - started,
+                             method=request.method, endpoint=endpoint, status=response.status_code)
+            registry.maybe_flush()
+        return response
@@ -1,28 +1,99 @@
-from flask import Blueprint, jsonify, request
-import json
-import os
-import re
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from datetime import datetime
+import json
+
+from components import metrics, preflight
+from components.content_bundle import build_bundle
+from components.content_repository import CONTENT_FILES, SECTION_FILES
+from components.job_queue import QueueFull
+from components.rate_limiter import RateLimited, client_keys
+from components.result_cache import content_hash
+from components.submission_codec import case_set_version
+from components.submission_store import COMPLETION_SCORE, SUBMISSION_FIELDS, SUMMARY_FIELDS
+from components.test_ordering import order_test_cases
 
 # Create a Blueprint which will hold all our application's routes
 main = Blueprint('main', __name__)
 
-# --- Data Loading Helper ---
-def load_data_from_file(filename):
-    """A helper function to load data from a specific JSON file."""
-    # Corrected path to build from the 'backend' root directory
-    data_path = os.path.join('app', 'data', filename)
-    try:
-        with open(data_path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Return an empty list if a file is missing, with a helpful server-side warning
-        print(f"Warning: Data file not found at {data_path}")
-        return []
-    except json.JSONDecodeError:
-        # Return an empty list if a file is malformed, with a helpful server-side warning
-        print(f"Warning: Could not decode JSON from {data_path}. Check for syntax errors.")
-        return []
+# Longest a job status request may be held open (long-poll or event stream)
+MAX_JOB_WAIT_SECONDS = 30
+# Most quiz attempts accepted by one batch submission
+MAX_BATCH_ATTEMPTS = 200
+# Most students in one roster progress request
+MAX_ROSTER_USERS = 500
+# Most results one search may ask for
+MAX_SEARCH_RESULTS = 50
+# Added to the ETag of a gzip body, since it is a different representation than the plain one
+GZIP_ETAG_SUFFIX = '-gz'
+
+# --- Data Access Helpers ---
+def get_content():
+    """Return the shared, indexed curriculum content for this worker."""
+    return current_app.extensions['content']
+
+def get_result_cache():
+    """Return this worker's cache of validation results."""
+    return current_app.extensions['result_cache']
+
+def get_store():
+    """Return the append-only store for submissions and quiz progress."""
+    return current_app.extensions['store']
+
+def get_bundles():
+    """Return the directory of compiled content bundles."""
+    return current_app.extensions['bundles']
+
+def get_jobs():
+    """Return the queue of background grading jobs."""
+    return current_app.extensions['jobs']
+
+def get_rate_limiter():
+    """Return the rate and concurrency limits shared by all workers."""
+    return current_app.extensions['rate_limiter']
+
+def too_many_requests(error):
+    """429 response for a request refused by a QueueFull or RateLimited error."""
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+def has_version(etag):
+    """Whether the client's If-None-Match names this version, in its plain or its gzip form."""
+    return request.if_none_match.contains(etag) or request.if_none_match.contains(etag + GZIP_ETAG_SUFFIX)
+
+def send_prepared(document):
+    """
+    Send a PreparedDocument, answering 304 when the client already has this
+    version and using the precompressed body when gzip is accepted.
+    """
+    gzipped = document.gzip_body is not None and bool(request.accept_encodings['gzip'])
+    if has_version(document.etag):
+        response = Response(status=304)
+    elif gzipped:
+        response = Response(document.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(document.body, mimetype='application/json')
+    response.set_etag(document.etag + GZIP_ETAG_SUFFIX if gzipped else document.etag)
+    # Browsers must revalidate, which costs a near-empty 304 when nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def send_immutable(body, gzip_body, etag):
+    """Send a response whose URL names its exact content, so it can be cached forever."""
+    gzipped = gzip_body is not None and bool(request.accept_encodings['gzip'])
+    if has_version(etag):
+        response = Response(status=304)
+    elif gzipped:
+        response = Response(gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag + GZIP_ETAG_SUFFIX if gzipped else etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
 
 # --- API Endpoints ---
 
@@ -37,36 +108,20 @@ def get_modules():
     Endpoint to get the list of all available modules.
     This returns the main overview of each module from modules.json.
     """
-    modules = load_data_from_file('modules.json')
-    return jsonify(modules)
+    return send_prepared(get_content().modules_document())
 
 @main.route('/modules/<int:module_id>', methods=['GET'])
 def get_module_by_id(module_id):
     """
     Endpoint to get a single, complete module by its ID.
-    This function reads from multiple files and assembles the full module object.
+    The assembled module is serialized once per content version.
     """
-    # Load all the different data sources
-    all_modules = load_data_from_file('modules.json')
-    learn_data = load_data_from_file('learn.json')
-    practice_data = load_data_from_file('practice.json')
-    challenge_data = load_data_from_file('challenges.json')
-    # Corrected filename to 'quiz.json'
-    quizzes_data = load_data_from_file('quiz.json')
-
-    # Find the base module information from modules.json
-    module_info = next((m for m in all_modules if m.get('id') == module_id), None)
+    document = get_content().module_document(module_id)
 
-    if not module_info:
+    if document is None:
         return jsonify({"error": "Module not found"}), 404
 
-    # Find and attach the related data from the other files
-    module_info['learn'] = next((l for l in learn_data if l.get('module_id') == module_id), None)
-    module_info['practice'] = next((p for p in practice_data if p.get('module_id') == module_id), None)
-    module_info['challenge'] = next((c for c in challenge_data if c.get('module_id') == module_id), None)
-    module_info['quizzes'] = [q for q in quizzes_data if q.get('module_id') == module_id]
-
-    return jsonify(module_info)
+    return send_prepared(document)
 
 @main.route('/modules/<int:module_id>/<string:section>', methods=['GET'])
 def get_module_section(module_id, section):
@@ -74,30 +129,90 @@ def get_module_section(module_id, section):
     Endpoint to get a specific section (learn, practice, challenge, or quizzes)
     from a specific module.
     """
-    valid_sections = {
-        'learn': 'learn.json',
-        'practice': 'practice.json',
-        'challenge': 'challenges.json',
-        # Corrected filename to 'quiz.json'
-        'quizzes': 'quiz.json'
-    }
-
-    if section not in valid_sections:
-        return jsonify({"error": f"Invalid section. Please use one of: {', '.join(valid_sections.keys())}"}), 400
-
-    filename = valid_sections[section]
-    all_section_data = load_data_from_file(filename)
+    if section not in SECTION_FILES:
+        return jsonify({"error": f"Invalid section. Please use one of: {', '.join(SECTION_FILES.keys())}"}), 400
 
-    if section == 'quizzes':
-        data = [item for item in all_section_data if item.get('module_id') == module_id]
-    else:
-        data = next((item for item in all_section_data if item.get('module_id') == module_id), None)
+    document = get_content().section_document(section, module_id)
 
-    if data is not None:
-        return jsonify(data)
+    if document is not None:
+        return send_prepared(document)
     else:
         return jsonify({"error": f"No '{section}' data found for module ID {module_id}"}), 404
 
+@main.route('/search', methods=['GET'])
+def search_content():
+    """
+    Full-text search of lessons, practice items, challenges and quiz questions.
+    `q` is the query; its last word also matches as a prefix (search-as-you-type)
+    unless `prefix=false` or the query ends with a space. `limit` defaults to 10
+    (at most MAX_SEARCH_RESULTS). Each result names the module and section to open.
+    """
+    try:
+        limit = parse_limit_arg(10, MAX_SEARCH_RESULTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        query = request.args.get('q', '')
+        prefix = request.args.get('prefix', 'true').lower() in ('1', 'true', 'yes')
+
+        with metrics.timer('search_query_seconds'):
+            matches = get_content().search(query, limit, prefix)
+
+        return jsonify({
+            'query': query,
+            'results': [dict(reference, score=score) for score, reference in matches]
+        })
+
+    except Exception as e:
+        return jsonify({"error": f"Failed to search content: {str(e)}"}), 500
+
+# --- Content Bundle Endpoints ---
+
+def current_bundle():
+    """The bundle of the content currently loaded, compiled once per content version."""
+    content = get_content()
+    return content.document(('bundle',), lambda: build_bundle({f: content.all(f) for f in CONTENT_FILES}))
+
+@main.route('/content/bundle', methods=['GET'])
+def get_bundle_version():
+    """
+    Endpoint to discover the current content bundle. Returns its hash and URL;
+    the bundle itself is then fetched (and cached forever) from that URL.
+    """
+    try:
+        bundle_hash = current_bundle().etag
+        response = jsonify({'hash': bundle_hash, 'url': f'/content/bundle/{bundle_hash}'})
+        # The answer changes whenever the content does, so always revalidate it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve content bundle: {str(e)}"}), 500
+
+@main.route('/content/bundle/<bundle_hash>', methods=['GET'])
+def get_bundle(bundle_hash):
+    """
+    Endpoint to get the whole curriculum (every module with its sections,
+    without solutions or expected outputs) in one immutable response.
+    Bundles built with `flask build-bundle` are served from disk, including
+    older versions; the current content's bundle is always available.
+    """
+    if len(bundle_hash) != 32 or any(c not in '0123456789abcdef' for c in bundle_hash):
+        return jsonify({"error": "Bundle not found"}), 404
+    try:
+        built = get_bundles().get(bundle_hash)
+        if built is not None:
+            return send_immutable(built[0], built[1], bundle_hash)
+        
+        document = current_bundle()
+        if document.etag == bundle_hash:
+            return send_immutable(document.body, document.gzip_body, bundle_hash)
+        return jsonify({"error": "Bundle not found"}), 404
+        
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve content bundle: {str(e)}"}), 500
+
 # --- Quiz Progress Tracking Endpoints ---
 
 @main.route('/quiz-progress', methods=['POST'])
@@ -115,67 +230,110 @@ def submit_quiz_progress():
             if field not in data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
-        quiz_id = data['quiz_id']
-        user_id = data['user_id']
-        answers = data['answers']
-        completion_time = data.get('completion_time', datetime.now().isoformat())
+        progress_record = build_progress_record(data)
         
-        # Load quiz data to validate answers
-        quizzes_data = load_data_from_file('quiz.json')
-        quiz = next((q for q in quizzes_data if q.get('quiz_id') == quiz_id), None)
-        
-        if not quiz:
+        if progress_record is None:
             return jsonify({"error": "Quiz not found"}), 404
         
-        # Calculate score
-        total_questions = len(quiz['questions'])
-        correct_answers = 0
+        # Append the record to the submission store (a single INSERT, safe across workers)
+        progress_id = get_store().add_quiz_progress(progress_record)
         
-        for question in quiz['questions']:
-            question_id = question['question_id']
-            correct_answer = question['answer']
-            user_answer = answers.get(str(question_id))
-            
-            if user_answer == correct_answer:
-                correct_answers += 1
-        
-        score = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
-        
-        # Create progress record
-        progress_record = {
-            'quiz_id': quiz_id,
-            'user_id': user_id,
-            'score': round(score, 2),
-            'correct_answers': correct_answers,
-            'total_questions': total_questions,
-            'answers': answers,
-            'completion_time': completion_time,
-            'timestamp': datetime.now().isoformat()
-        }
+        return jsonify({
+            'message': 'Quiz progress saved successfully',
+            'score': progress_record['score'],
+            'correct_answers': progress_record['correct_answers'],
+            'total_questions': progress_record['total_questions'],
+            'progress_id': progress_id
+        }), 201
         
-        # For now, we'll store in a JSON file (in production, this would be a database)
-        progress_file = os.path.join('app', 'data', 'quiz_progress.json')
+    except Exception as e:
+        return jsonify({"error": f"Failed to save quiz progress: {str(e)}"}), 500
+
+def build_progress_record(data):
+    """
+    Score one quiz attempt against the quiz's precomputed answer key.
+    Returns the progress record to store, or None if the quiz does not exist.
+    """
+    answer_key = get_content().quiz_answer_key(data['quiz_id'])
+    if answer_key is None:
+        return None
+    
+    # Calculate score
+    answers = data['answers']
+    total_questions = len(answer_key)
+    correct_answers = sum(1 for question_id, answer in answer_key.items() if answers.get(question_id) == answer)
+    score = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
+    
+    return {
+        'quiz_id': data['quiz_id'],
+        'user_id': data['user_id'],
+        'score': round(score, 2),
+        'correct_answers': correct_answers,
+        'total_questions': total_questions,
+        'answers': answers,
+        'completion_time': data.get('completion_time', datetime.now().isoformat()),
+        'timestamp': datetime.now().isoformat()
+    }
+
+@main.route('/quiz-progress/batch', methods=['POST'])
+def submit_quiz_progress_batch():
+    """
+    Endpoint to submit many quiz attempts at once, e.g. a tablet syncing a
+    session recorded offline. Expects JSON with an `attempts` list; each
+    attempt has quiz_id, answers, completion_time and a user_id (which may
+    instead be given once at the top level).
+    Valid attempts are scored and saved together in a single write; the
+    response lists the outcome of every attempt in order.
+    """
+    try:
+        data = request.get_json()
         
-        # Load existing progress
-        try:
-            with open(progress_file, 'r') as f:
-                all_progress = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            all_progress = []
+        attempts = data.get('attempts') if isinstance(data, dict) else None
+        if not isinstance(attempts, list) or not attempts:
+            return jsonify({"error": "Missing required field: attempts"}), 400
+        if len(attempts) > MAX_BATCH_ATTEMPTS:
+            return jsonify({"error": f"Too many attempts in one batch (at most {MAX_BATCH_ATTEMPTS})"}), 400
+        
+        results = []
+        records = []
+        for index, attempt in enumerate(attempts):
+            if not isinstance(attempt, dict):
+                results.append({'index': index, 'error': "Attempt must be an object"})
+                continue
+            attempt = dict(attempt)
+            attempt.setdefault('user_id', data.get('user_id'))
+            missing = [field for field in ('quiz_id', 'user_id', 'answers') if attempt.get(field) is None]
+            if missing:
+                results.append({'index': index, 'error': f"Missing required field: {missing[0]}"})
+                continue
+            
+            progress_record = build_progress_record(attempt)
+            if progress_record is None:
+                results.append({'index': index, 'error': "Quiz not found"})
+                continue
+            records.append(progress_record)
+            results.append({
+                'index': index,
+                'quiz_id': progress_record['quiz_id'],
+                'score': progress_record['score'],
+                'correct_answers': progress_record['correct_answers'],
+                'total_questions': progress_record['total_questions']
+            })
         
-        # Add new progress record
-        all_progress.append(progress_record)
+        if not records:
+            return jsonify({"error": "No valid attempts to save", 'results': results}), 400
         
-        # Save updated progress
-        with open(progress_file, 'w') as f:
-            json.dump(all_progress, f, indent=2)
+        # All valid attempts are stored in one transaction
+        progress_ids = iter(get_store().add_quiz_progress_batch(records))
+        for result in results:
+            if 'error' not in result:
+                result['progress_id'] = next(progress_ids)
         
         return jsonify({
             'message': 'Quiz progress saved successfully',
-            'score': round(score, 2),
-            'correct_answers': correct_answers,
-            'total_questions': total_questions,
-            'progress_id': len(all_progress) - 1
+            'saved': len(records),
+            'failed': len(results) - len(records),
+            'results': results
         }), 201
         
     except Exception as e:
@@ -185,29 +343,26 @@ def submit_quiz_progress():
 def get_user_quiz_progress(user_id):
     """
     Endpoint to get all quiz progress for a specific user.
+    Archived attempts are only included with ?include_archived=true; otherwise
+    the X-Archived-Records header says how many were left out.
     """
     try:
-        progress_file = os.path.join('app', 'data', 'quiz_progress.json')
-        
-        # Load progress data
-        try:
-            with open(progress_file, 'r') as f:
-                all_progress = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return jsonify([])
-        
-        # Filter progress for the specific user
-        user_progress = [p for p in all_progress if p.get('user_id') == user_id]
+        store = get_store()
+        include_archived = wants_archived()
+        user_progress = store.quiz_progress(user_id, include_archived=include_archived)
         
         # Add quiz titles for better frontend display
-        quizzes_data = load_data_from_file('quiz.json')
+        content = get_content()
         for progress in user_progress:
-            quiz = next((q for q in quizzes_data if q.get('quiz_id') == progress['quiz_id']), None)
+            quiz = content.quiz(progress['quiz_id'])
             if quiz:
                 progress['quiz_title'] = quiz['title']
                 progress['module_id'] = quiz['module_id']
         
-        return jsonify(user_progress)
+        response = jsonify(user_progress)
+        if not include_archived:
+            add_archived_count(response, store.archived_count('quiz', user_id))
+        return response
         
     except Exception as e:
         return jsonify({"error": f"Failed to retrieve quiz progress: {str(e)}"}), 500
@@ -218,57 +373,102 @@ def get_user_quiz_summary(user_id):
     Endpoint to get a summary of user's quiz performance.
     """
     try:
-        progress_file = os.path.join('app', 'data', 'quiz_progress.json')
-        
-        # Load progress data
-        try:
-            with open(progress_file, 'r') as f:
-                all_progress = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return jsonify({
-                'total_quizzes': 0,
-                'average_score': 0,
-                'total_correct': 0,
-                'total_questions': 0,
-                'completion_rate': 0
-            })
+        # Running aggregates are kept up to date on every quiz submission
+        stats = get_store().quiz_summary(user_id)
+        return jsonify(quiz_summary(stats, len(get_content().quizzes())))
         
-        # Filter progress for the specific user
-        user_progress = [p for p in all_progress if p.get('user_id') == user_id]
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve quiz summary: {str(e)}"}), 500
+
+def quiz_summary(stats, total_available_quizzes):
+    """Summary statistics of one user's quiz aggregates (None if they have no progress)."""
+    if not stats:
+        return {
+            'total_quizzes': 0,
+            'average_score': 0,
+            'total_correct': 0,
+            'total_questions': 0,
+            'completion_rate': 0
+        }
+    
+    # Calculate summary statistics
+    total_quizzes = stats['attempts']
+    average_score = stats['score_sum'] / total_quizzes if total_quizzes > 0 else 0
+    
+    total_correct = stats['correct_sum']
+    total_questions = stats['question_sum']
+    
+    # Total available quizzes for completion rate
+    completion_rate = (total_quizzes / total_available_quizzes) * 100 if total_available_quizzes > 0 else 0
+    
+    return {
+        'total_quizzes': total_quizzes,
+        'average_score': round(average_score, 2),
+        'total_correct': total_correct,
+        'total_questions': total_questions,
+        'completion_rate': round(completion_rate, 2),
+        'total_available_quizzes': total_available_quizzes,
+        'quizzes_completed': stats['quizzes_completed']
+    }
+
+@main.route('/roster/progress', methods=['POST'])
+def get_roster_progress():
+    """
+    Endpoint for teacher dashboards: the progress of a whole class in one request.
+    Expects JSON with a `user_ids` list and optionally a `module_id` or a
+    `challenge_ids` list to limit the challenges reported (default: all).
+    Returns, for every user in order, their quiz summary (as from
+    /quiz-progress/<user_id>/summary) and their attempts and best score on
+    each challenge (null for challenges they haven't tried).
+    """
+    try:
+        data = request.get_json()
         
-        if not user_progress:
-            return jsonify({
-                'total_quizzes': 0,
-                'average_score': 0,
-                'total_correct': 0,
-                'total_questions': 0,
-                'completion_rate': 0
+        user_ids = data.get('user_ids') if isinstance(data, dict) else None
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({"error": "Missing required field: user_ids"}), 400
+        if len(user_ids) > MAX_ROSTER_USERS:
+            return jsonify({"error": f"Too many users in one request (at most {MAX_ROSTER_USERS})"}), 400
+        
+        content = get_content()
+        if data.get('module_id') is not None:
+            if not content.module(data['module_id']):
+                return jsonify({"error": "Module not found"}), 404
+            challenge_ids = [c.get('id') for c in content.module_challenges(data['module_id'])]
+        elif data.get('challenge_ids') is not None:
+            challenge_ids = data['challenge_ids']
+            if not isinstance(challenge_ids, list) or not all(isinstance(i, int) for i in challenge_ids):
+                return jsonify({"error": "challenge_ids must be a list of challenge ids"}), 400
+        else:
+            challenge_ids = [c.get('id') for c in content.all('challenges.json')]
+        
+        quiz_stats, challenge_scores = get_store().roster_progress(user_ids, challenge_ids)
+        total_available_quizzes = len(content.quizzes())
+        
+        users = []
+        for user_id in user_ids:
+            scores = challenge_scores.get(str(user_id), {})
+            challenges = {}
+            for challenge_id in challenge_ids:
+                if challenge_id not in scores:
+                    challenges[challenge_id] = None
+                    continue
+                attempts, best_score = scores[challenge_id]
+                challenges[challenge_id] = {
+                    'attempts': attempts,
+                    'best_score': best_score,
+                    'completed': best_score >= COMPLETION_SCORE
+                }
+            users.append({
+                'user_id': user_id,
+                'quiz_summary': quiz_summary(quiz_stats.get(str(user_id)), total_available_quizzes),
+                'challenges': challenges
             })
         
-        # Calculate summary statistics
-        total_quizzes = len(user_progress)
-        total_score = sum(p['score'] for p in user_progress)
-        average_score = total_score / total_quizzes if total_quizzes > 0 else 0
-        
-        total_correct = sum(p['correct_answers'] for p in user_progress)
-        total_questions = sum(p['total_questions'] for p in user_progress)
-        
-        # Get total available quizzes for completion rate
-        quizzes_data = load_data_from_file('quiz.json')
-        total_available_quizzes = len(quizzes_data)
-        completion_rate = (total_quizzes / total_available_quizzes) * 100 if total_available_quizzes > 0 else 0
-        
-        return jsonify({
-            'total_quizzes': total_quizzes,
-            'average_score': round(average_score, 2),
-            'total_correct': total_correct,
-            'total_questions': total_questions,
-            'completion_rate': round(completion_rate, 2),
-            'total_available_quizzes': total_available_quizzes
-        })
+        return jsonify({'challenge_ids': challenge_ids, 'users': users})
         
     except Exception as e:
-        return jsonify({"error": f"Failed to retrieve quiz summary: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to retrieve roster progress: {str(e)}"}), 500
 
 # --- Challenge Test Cases Integration Endpoints ---
 
@@ -279,9 +479,8 @@ def get_challenge_test_cases(challenge_id):
     Returns the test cases that will be used to validate user submissions.
     """
     try:
-        # Load challenge data
-        challenges_data = load_data_from_file('challenges.json')
-        challenge = next((c for c in challenges_data if c.get('id') == challenge_id), None)
+        # Look up the challenge
+        challenge = get_content().challenge(challenge_id)
         
         if not challenge:
             return jsonify({"error": "Challenge not found"}), 404
@@ -304,11 +503,52 @@ def get_challenge_test_cases(challenge_id):
     except Exception as e:
         return jsonify({"error": f"Failed to retrieve test cases: {str(e)}"}), 500
 
+def check_execution_results(test_cases, matchers, execution_results):
+    """
+    Compare a submission's outputs against a challenge's test cases using the
+    challenge's precompiled matchers. Returns (passed_tests, test_results).
+    """
+    passed_tests = 0
+    test_results = []
+    
+    for i, (test_case, matcher) in enumerate(zip(test_cases, matchers)):
+        test_result = check_test_case(i, test_case, matcher, execution_results)
+        if test_result['passed']:
+            passed_tests += 1
+        test_results.append(test_result)
+    
+    return passed_tests, test_results
+
+def check_test_case(i, test_case, matcher, execution_results):
+    """Check the output of test case `i` and return its test result."""
+    expected_output = test_case.get('expectedOutput', '')
+    actual_output = execution_results.get(f'test_{i}', '')
+    
+    # Exact match first, then the flexible rule compiled for this test case
+    is_passed, missing_parts = matcher.match(actual_output)
+    
+    test_result = {
+        'test_case': i + 1,
+        'input': test_case.get('input', ''),
+        'expected_output': expected_output,
+        'actual_output': actual_output,
+        'passed': is_passed
+    }
+    
+    # Add helpful feedback for failed tests
+    if not is_passed and missing_parts is not None:
+        test_result['missing_parts'] = missing_parts
+    
+    return test_result
+
 @main.route('/challenges/<int:challenge_id>/validate', methods=['POST'])
 def validate_challenge_submission(challenge_id):
     """
     Endpoint to validate a challenge submission against test cases.
     Expects JSON with user_id, code, and execution_results.
+    With `?async=true` the submission is queued instead and the response is
+    202 with a job id; poll /jobs/<job_id> for the result.
+    With `?fail_fast=true` it is only checked for pass/fail (see check_fail_fast).
     """
     try:
         data = request.get_json()
@@ -319,198 +559,414 @@ def validate_challenge_submission(challenge_id):
             if field not in data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
-        user_id = data['user_id']
-        code = data['code']
-        execution_results = data['execution_results']
+        keys = client_keys(data['user_id'], request.remote_addr)
+        # Validation only compares the client's execution results and runs no code,
+        # so it takes no concurrent-execution slot; only the rate applies
+        if request.args.get('fail_fast', '').lower() in ('1', 'true', 'yes'):
+            with get_rate_limiter().admit(keys, concurrent=False):
+                body, status = check_fail_fast(challenge_id, data)
+            return jsonify(body), status
         
-        # Load challenge data
-        challenges_data = load_data_from_file('challenges.json')
-        challenge = next((c for c in challenges_data if c.get('id') == challenge_id), None)
+        if request.args.get('async', str(current_app.config['ASYNC_GRADING'])).lower() in ('1', 'true', 'yes'):
+            with get_rate_limiter().admit(keys, concurrent=False):
+                return enqueue_job('validate', {'challenge_id': challenge_id, 'data': data})
         
-        if not challenge:
-            return jsonify({"error": "Challenge not found"}), 404
+        with get_rate_limiter().admit(keys, concurrent=False):
+            body, status = validate_submission(challenge_id, data)
+        return jsonify(body), status
         
-        # Validate against test cases
-        test_cases = challenge.get('testCases', [])
-        passed_tests = 0
-        total_tests = len(test_cases)
-        test_results = []
+    except RateLimited as e:
+        return too_many_requests(e)
+    except Exception as e:
+        return jsonify({"error": f"Failed to validate challenge submission: {str(e)}"}), 500
+
+def validate_submission(challenge_id, data):
+    """
+    Grade and store one challenge submission. Returns (response body, status code),
+    so the same work can run inside a request or as a background job.
+    """
+    user_id = data['user_id']
+    code = data['code']
+    execution_results = data['execution_results']
+    
+    # Look up the challenge
+    challenge = get_content().challenge(challenge_id)
+    
+    if not challenge:
+        return {"error": "Challenge not found"}, 404
+    
+    # Validate against test cases; identical outputs for the same test cases
+    # are served from the cache instead of being matched again
+    test_cases = challenge.get('testCases', [])
+    total_tests = len(test_cases)
+    outputs = [execution_results.get(f'test_{i}', '') for i in range(total_tests)]
+    content = get_content()
+    cache_key = (challenge_id, content.challenge_version(challenge_id), content_hash(outputs))
+    cache = get_result_cache()
+    cached = cache.get(cache_key)
+    if cached is None:
+        matchers = content.challenge_matchers(challenge_id)
+        with metrics.timer('challenge_validation_seconds', challenge_id=challenge_id):
+            cached = check_execution_results(test_cases, matchers, execution_results)
+        cache.put(cache_key, cached)
+    passed_tests, test_results = cached
+    
+    # Calculate score
+    score = (passed_tests / total_tests) * 100 if total_tests > 0 else 0
+    
+    # Create submission record
+    submission_record = {
+        'challenge_id': challenge_id,
+        'user_id': user_id,
+        'code': code,
+        'score': round(score, 2),
+        'passed_tests': passed_tests,
+        'total_tests': total_tests,
+        'test_results': test_results,
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    # Append the submission to the submission store (a single INSERT, safe across workers)
+    submission_id = get_store().add_challenge_submission(submission_record)
+    
+    response = {
+        'message': 'Challenge submission validated successfully',
+        'score': round(score, 2),
+        'passed_tests': passed_tests,
+        'total_tests': total_tests,
+        'test_results': test_results,
+        'submission_id': submission_id
+    }
+    # The code ran in the browser, but syntax and policy problems are still worth pointing out by line
+    if isinstance(code, str):
+        analysis = preflight.analyze(code)
+        if not analysis.ok:
+            response['problems'] = analysis.problems
+    return response, 201
+
+def check_fail_fast(challenge_id, data):
+    """
+    Quick "does it pass yet?" check. Test cases are tried in the order most
+    likely to fail (the ones this user failed last time, then by failure rate
+    across all submissions) and checking stops at the first failure. Nothing
+    is stored; submit without fail_fast for the full, recorded report.
+    """
+    challenge = get_content().challenge(challenge_id)
+    if not challenge:
+        return {"error": "Challenge not found"}, 404
+    
+    test_cases = challenge.get('testCases', [])
+    matchers = get_content().challenge_matchers(challenge_id)
+    cases_version = case_set_version(
+        challenge_id, [[tc.get('input', ''), tc.get('expectedOutput', '')] for tc in test_cases]
+    )
+    case_stats, previously_failed = get_store().failure_history(challenge_id, data['user_id'], cases_version)
+    
+    checked = 0
+    first_failure = None
+    with metrics.timer('challenge_validation_seconds', challenge_id=challenge_id):
+        for i in order_test_cases(len(test_cases), case_stats, previously_failed):
+            checked += 1
+            test_result = check_test_case(i, test_cases[i], matchers[i], data['execution_results'])
+            if not test_result['passed']:
+                first_failure = test_result
+                break
+    
+    return {
+        'passed': first_failure is None,
+        'checked_tests': checked,
+        'total_tests': len(test_cases),
+        'first_failure': first_failure
+    }, 200
+
+def run_validation_job(payload):
+    """Job handler for queued validations (runs on a background thread)."""
+    try:
+        return validate_submission(payload['challenge_id'], payload['data'])
+    except Exception as e:
+        return {"error": f"Failed to validate challenge submission: {str(e)}"}, 500
+
+# --- Grading Jobs ---
+
+def enqueue_job(kind, payload):
+    """Queue a job and answer 202 with its id, or 429 when the queue is full."""
+    try:
+        job_id = get_jobs().submit(kind, payload)
+    except QueueFull as e:
+        return too_many_requests(e)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'})
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response, 202
+
+@main.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Endpoint to check on a grading job. With `?wait=<seconds>` (at most 30)
+    the request is held until the job finishes or the time runs out.
+    When the job is done, `result` holds the response the synchronous call
+    would have returned and `status_code` its HTTP status.
+    """
+    try:
+        wait = min(max(request.args.get('wait', 0, type=float), 0), MAX_JOB_WAIT_SECONDS)
+        jobs = get_jobs()
+        job = jobs.wait(job_id, wait) if wait else jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
         
-        for i, test_case in enumerate(test_cases):
-            expected_output = test_case.get('expectedOutput', '')
-            actual_output = execution_results.get(f'test_{i}', '')
-            
-            # Normalize outputs for comparison (remove extra whitespace, newlines)
-            expected_normalized = expected_output.strip().replace('\r\n', '\n').replace('\r', '\n')
-            actual_normalized = actual_output.strip().replace('\r\n', '\n').replace('\r', '\n')
-            
-            # Try exact match first
-            is_passed = expected_normalized == actual_normalized
-            
-            # If exact match fails, try flexible validation for educational challenges
-            # Check if key information is present (for challenges where format can vary)
-            if not is_passed:
-                # Extract key words/phrases from expected output
-                expected_lower = expected_normalized.lower()
-                actual_lower = actual_normalized.lower()
-                
-                # For introduction challenges, check for key elements
-                if 'name' in expected_lower or 'age' in expected_lower or 'hobby' in expected_lower:
-                    # Check if user output contains the key information
-                    # Must have ALL three elements to pass (stricter validation)
-                    has_name = 'name' in actual_lower
-                    has_age = 'age' in actual_lower or 'years old' in actual_lower or any(str(i) in actual_lower for i in range(1, 100))
-                    has_hobby = 'hobby' in actual_lower or 'love' in actual_lower or 'favorite' in actual_lower
-                    
-                    # Also check that the output contains actual values (not just keywords)
-                    # For Challenge 1, we expect to see the test input values
-                    has_actual_values = len(actual_normalized) > 20  # Output should be substantial
-                    
-                    # If all key elements are present AND output is substantial, consider it passed
-                    if has_name and has_age and has_hobby and has_actual_values:
-                        is_passed = True
-                    else:
-                        # Add helpful feedback about what's missing
-                        missing_parts = []
-                        if not has_name:
-                            missing_parts.append('name')
-                        if not has_age:
-                            missing_parts.append('age')
-                        if not has_hobby:
-                            missing_parts.append('hobby')
-                        if not has_actual_values:
-                            missing_parts.append('complete output')
-                        
-                        # Store feedback in test result for frontend display
-                        test_case['missing_parts'] = missing_parts
-                
-                # For math challenges, check if numbers match
-                elif any(op in expected_lower for op in ['sum', 'difference', 'product', 'larger']):
-                    # Extract numbers from both outputs
-                    expected_nums = set(re.findall(r'\d+', expected_normalized))
-                    actual_nums = set(re.findall(r'\d+', actual_normalized))
-                    
-                    # If key numbers match (like sum, product results), consider passed
-                    if expected_nums and actual_nums and len(expected_nums.intersection(actual_nums)) >= 2:
-                        is_passed = True
-                
-                # General flexible check: if output contains most key words from expected
-                # This is a fallback for other challenge types - should be stricter
-                else:
-                    # Only apply flexible validation if output is substantial
-                    if len(actual_normalized) < 10:
-                        is_passed = False  # Too short, definitely wrong
-                    else:
-                        # Split into words and check overlap
-                        expected_words = set(re.findall(r'\b\w+\b', expected_normalized.lower()))
-                        actual_words = set(re.findall(r'\b\w+\b', actual_normalized.lower()))
-                        
-                        # Remove common words
-                        common_words = {'the', 'a', 'an', 'is', 'are', 'was', 'were', 'to', 'of', 'and', 'or', 'but', 'in', 'on', 'at', 'for', 'with', 'by', 'my', 'i', 'am'}
-                        expected_words = expected_words - common_words
-                        actual_words = actual_words - common_words
-                        
-                        # Require 80% similarity AND minimum word count (stricter)
-                        if expected_words and actual_words and len(actual_words) >= 3:
-                            overlap = len(expected_words.intersection(actual_words))
-                            similarity = overlap / len(expected_words) if expected_words else 0
-                            if similarity >= 0.8:  # Increased from 0.7 to 0.8
-                                is_passed = True
-            
-            if is_passed:
-                passed_tests += 1
-            
-            test_result = {
-                'test_case': i + 1,
-                'input': test_case.get('input', ''),
-                'expected_output': expected_output,
-                'actual_output': actual_output,
-                'passed': is_passed
-            }
-            
-            # Add helpful feedback for failed tests
-            if not is_passed and 'missing_parts' in test_case:
-                test_result['missing_parts'] = test_case.get('missing_parts', [])
-            
-            test_results.append(test_result)
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve job: {str(e)}"}), 500
+
+@main.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """
+    Endpoint streaming a grading job's state as Server-Sent Events: one
+    'status' event per change (queue position, running) and a final 'done'
+    event with the result. The stream ends after at most 30 seconds.
+    """
+    jobs = get_jobs()
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate():
+        for job in jobs.watch(job_id, MAX_JOB_WAIT_SECONDS):
+            if job is None:
+                return
+            event = 'done' if job['status'] == 'done' else 'status'
+            yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def wants_archived():
+    """Whether a history request asks for archived records too (?include_archived=true)."""
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+def add_archived_count(response, count):
+    """Tell the client how many older records a hot-window-only response left out."""
+    if count:
+        response.headers['X-Archived-Records'] = str(count)
+
+def parse_limit_arg(default, maximum):
+    """
+    The `limit=` query parameter as an int between 1 and `maximum` (`default`
+    when absent); raises ValueError for anything else.
+    """
+    value = request.args.get('limit')
+    if value is None:
+        return default
+    error = f"limit must be a number between 1 and {maximum}"
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(error) from None
+    if not 1 <= limit <= maximum:
+        raise ValueError(error)
+    return limit
+
+def parse_fields(value):
+    """
+    Parse a `fields=` query parameter: 'summary' (no code or test_results) or a
+    comma-separated list of submission fields. Returns None for all fields.
+    """
+    if not value:
+        return None
+    if value == 'summary':
+        return SUMMARY_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in SUBMISSION_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Use 'summary' or any of: {', '.join(SUBMISSION_FIELDS)}")
+    return fields
+
+@main.route('/challenges/<int:challenge_id>/submissions/<user_id>', methods=['GET'])
+def get_user_challenge_submissions(challenge_id, user_id):
+    """
+    Endpoint to get the submissions for a specific challenge by a specific user.
+
+    Optional query parameters:
+      fields=summary or fields=score,timestamp,...  return only those fields
+      limit=N (1-100) and cursor=...                paginate; the response becomes
+                                                    {"submissions": [...], "next_cursor": ...}
+      order=asc|desc                                 by timestamp (default asc)
+      include_archived=true                          without limit/cursor, also return
+                                                    submissions moved to the archive
+    Without limit/cursor the live submissions are returned as a list, and the
+    X-Archived-Records header counts the archived ones left out. Pages read
+    the archive on their own once the cursor reaches it.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        order = request.args.get('order', 'asc')
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        cursor = request.args.get('cursor')
+        paginate = cursor is not None or 'limit' in request.args
+        limit = parse_limit_arg(20, 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        store = get_store()
+        if paginate:
+            user_submissions, next_cursor = store.challenge_submissions_page(
+                challenge_id, user_id, limit, cursor=cursor, descending=(order == 'desc'), fields=fields
+            )
+        else:
+            include_archived = wants_archived()
+            user_submissions = store.challenge_submissions(challenge_id, user_id, fields=fields,
+                                                           include_archived=include_archived)
+            if order == 'desc':
+                user_submissions.reverse()
+        
+        # Add challenge title for better frontend display
+        challenge = get_content().challenge(challenge_id)
+        if challenge:
+            for submission in user_submissions:
+                submission['challenge_title'] = challenge['title']
+                submission['module_id'] = challenge.get('module_id')
         
-        # Calculate score
-        score = (passed_tests / total_tests) * 100 if total_tests > 0 else 0
+        if paginate:
+            return jsonify({'submissions': user_submissions, 'next_cursor': next_cursor})
+        response = jsonify(user_submissions)
+        if not include_archived:
+            add_archived_count(response, store.archived_count('challenge', user_id, challenge_id))
+        return response
         
-        # Create submission record
-        submission_record = {
-            'challenge_id': challenge_id,
-            'user_id': user_id,
-            'code': code,
-            'score': round(score, 2),
-            'passed_tests': passed_tests,
-            'total_tests': total_tests,
-            'test_results': test_results,
-            'timestamp': datetime.now().isoformat()
-        }
+    except ValueError as e:
+        # Malformed cursor
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve challenge submissions: {str(e)}"}), 500
+
+@main.route('/challenges/submissions/<user_id>/overview', methods=['GET'])
+def get_user_challenge_overview(user_id):
+    """
+    Endpoint to get the latest and best submission of every challenge a user
+    has attempted, plus the number of attempts. Submissions are returned as
+    summaries (no code or test_results) unless `fields=` asks for more.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields')) or SUMMARY_FIELDS
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        overview = get_store().challenge_overview(user_id, fields=fields)
         
-        # Store submission in JSON file (in production, this would be a database)
-        submissions_file = os.path.join('app', 'data', 'challenge_submissions.json')
+        # Add challenge titles for better frontend display
+        content = get_content()
+        for entry in overview:
+            challenge = content.challenge(entry['challenge_id'])
+            if challenge:
+                entry['challenge_title'] = challenge['title']
+                entry['module_id'] = challenge.get('module_id')
         
-        # Load existing submissions
-        try:
-            with open(submissions_file, 'r') as f:
-                all_submissions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            all_submissions = []
+        return jsonify(overview)
         
-        # Add new submission
-        all_submissions.append(submission_record)
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve challenge overview: {str(e)}"}), 500
+
+# --- Leaderboards and Completion Statistics ---
+
+@main.route('/challenges/<int:challenge_id>/leaderboard', methods=['GET'])
+def get_challenge_leaderboard(challenge_id):
+    """
+    Endpoint to get the top scores for a challenge, one entry per student.
+    `limit` (1-100, default 10) sets how many entries are returned.
+    """
+    try:
+        limit = parse_limit_arg(10, 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        challenge = get_content().challenge(challenge_id)
         
-        # Save updated submissions
-        with open(submissions_file, 'w') as f:
-            json.dump(all_submissions, f, indent=2)
+        if not challenge:
+            return jsonify({"error": "Challenge not found"}), 404
         
         return jsonify({
-            'message': 'Challenge submission validated successfully',
-            'score': round(score, 2),
-            'passed_tests': passed_tests,
-            'total_tests': total_tests,
-            'test_results': test_results,
-            'submission_id': len(all_submissions) - 1
-        }), 201
+            'challenge_id': challenge_id,
+            'title': challenge.get('title', ''),
+            'leaderboard': get_store().leaderboard(challenge_id, limit)
+        })
         
     except Exception as e:
-        return jsonify({"error": f"Failed to validate challenge submission: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to retrieve leaderboard: {str(e)}"}), 500
 
-@main.route('/challenges/<int:challenge_id>/submissions/<user_id>', methods=['GET'])
-def get_user_challenge_submissions(challenge_id, user_id):
+def module_stats(module_info, challenge_totals, quiz_totals):
+    """Completion statistics of one module from the precomputed class-wide totals."""
+    content = get_content()
+    module_id = module_info['id']
+    challenges = []
+    for challenge in content.module_challenges(module_id):
+        totals = challenge_totals.get(challenge['id'], {})
+        attempted = totals.get('users_attempted', 0)
+        completed = totals.get('users_completed', 0)
+        challenges.append({
+            'challenge_id': challenge['id'],
+            'title': challenge.get('title', ''),
+            'attempts': totals.get('attempts', 0),
+            'users_attempted': attempted,
+            'users_completed': completed,
+            'completion_rate': round(completed / attempted * 100, 2) if attempted else 0
+        })
+    quizzes = []
+    for quiz in content.section('quizzes', module_id):
+        totals = quiz_totals.get(quiz['quiz_id'], {})
+        attempts = totals.get('attempts', 0)
+        quizzes.append({
+            'quiz_id': quiz['quiz_id'],
+            'title': quiz.get('title', ''),
+            'attempts': attempts,
+            'users_completed': totals.get('users_completed', 0),
+            'average_score': round(totals['score_sum'] / attempts, 2) if attempts else 0
+        })
+    return {
+        'module_id': module_id,
+        'name': module_info.get('name', ''),
+        'challenges': challenges,
+        'quizzes': quizzes
+    }
+
+def completion_stats(modules):
+    """Completion statistics for several modules, fetched with one totals query."""
+    content = get_content()
+    challenge_ids = [c['id'] for m in modules for c in content.module_challenges(m['id'])]
+    quiz_ids = [q['quiz_id'] for m in modules for q in content.section('quizzes', m['id'])]
+    challenge_totals, quiz_totals = get_store().completion_totals(challenge_ids, quiz_ids)
+    return [module_stats(m, challenge_totals, quiz_totals) for m in modules]
+
+@main.route('/modules/stats', methods=['GET'])
+def get_all_module_stats():
     """
-    Endpoint to get all submissions for a specific challenge by a specific user.
+    Endpoint to get completion statistics for every module: how many students
+    attempted and completed each challenge, and quiz completions and averages.
     """
     try:
-        submissions_file = os.path.join('app', 'data', 'challenge_submissions.json')
-        
-        # Load submissions data
-        try:
-            with open(submissions_file, 'r') as f:
-                all_submissions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return jsonify([])
+        return jsonify(completion_stats(get_content().modules()))
         
-        # Filter submissions for the specific challenge and user
-        user_submissions = [
-            s for s in all_submissions 
-            if s.get('challenge_id') == challenge_id and s.get('user_id') == user_id
-        ]
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve module statistics: {str(e)}"}), 500
+
+@main.route('/modules/<int:module_id>/stats', methods=['GET'])
+def get_module_stats(module_id):
+    """
+    Endpoint to get the completion statistics of a single module.
+    """
+    try:
+        module_info = get_content().module(module_id)
         
-        # Add challenge title for better frontend display
-        challenges_data = load_data_from_file('challenges.json')
-        challenge = next((c for c in challenges_data if c.get('id') == challenge_id), None)
-        if challenge:
-            for submission in user_submissions:
-                submission['challenge_title'] = challenge['title']
-                submission['module_id'] = challenge.get('module_id')
+        if not module_info:
+            return jsonify({"error": "Module not found"}), 404
         
-        return jsonify(user_submissions)
+        return jsonify(completion_stats([module_info])[0])
         
     except Exception as e:
-        return jsonify({"error": f"Failed to retrieve challenge submissions: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to retrieve module statistics: {str(e)}"}), 500
 
 @main.route('/challenges/<int:challenge_id>/solution', methods=['GET'])
 def get_challenge_solution(challenge_id):
@@ -519,8 +975,7 @@ def get_challenge_solution(challenge_id):
     This will be used by the Solution Module feature.
     """
     try:
-        challenges_data = load_data_from_file('challenges.json')
-        challenge = next((c for c in challenges_data if c.get('id') == challenge_id), None)
+        challenge = get_content().challenge(challenge_id)
         
         if not challenge:
             return jsonify({"error": "Challenge not found"}), 404
@@ -536,3 +991,10 @@ def get_challenge_solution(challenge_id):
     except Exception as e:
         return jsonify({"error": f"Failed to retrieve challenge solution: {str(e)}"}), 500
 
+@main.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Endpoint for Prometheus: request, data file, store and grading timings,
+    summed over every worker process of the server.
+    """
+    return Response(metrics.get_registry().render(), mimetype='text/plain; version=0.0.4')
@@ -1,9 +1,21 @@
-from flask import Flask, request, jsonify
-import io
-import sys
-import contextlib
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
+import os
+
+from components import metrics, preflight
+from components.grader import CASE_WALL_SECONDS, describe_divergence, grade_submission
+from components.job_queue import JobQueue, QueueFull
+from components.profiler import ProfileStats
+from components.rate_limiter import RateLimited, client_keys, limiter_from_env, trust_proxies
+from components.result_cache import ResultCache, content_hash, normalized_code_hash
+from components.sandbox import SandboxError, get_default_pool
+from components.test_ordering import FailureHistory
 
 app = Flask(__name__)
+# Behind nginx, set TRUSTED_PROXIES to the number of proxies so rate limits see the client's IP
+app.wsgi_app = trust_proxies(app.wsgi_app, int(os.getenv("TRUSTED_PROXIES", "0")))
+# Set METRICS_DIR when running several workers so /metrics covers all of them
+metrics.configure(os.getenv("METRICS_DIR"))
 
 # Example test cases — each problem has multiple inputs/outputs
 TEST_CASES = {
@@ -18,10 +30,55 @@ TEST_CASES = {
     ]
 }
 
+# Directory of the SQLite files shared by this server's workers (the main app's data directory)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "data"))
+
+# Graded responses for code that has been seen before (same problem, same test cases, same AST)
+RESULT_CACHE = ResultCache()
+
+# Submissions sent with ?async=true are graded by a few background threads per process;
+# job state is kept in SQLite so any worker can answer a status poll
+JOBS = JobQueue(
+    os.getenv("AUTOGRADER_JOBS_DB", os.path.join(DATA_DIR, "autograder-jobs.sqlite3")),
+    workers=int(os.getenv("GRADING_WORKERS", "2")),
+    max_depth=int(os.getenv("GRADING_QUEUE_DEPTH", "200"))
+)
+# Longest a job status request may be held open (long-poll or event stream)
+MAX_JOB_WAIT_SECONDS = 30
+
+# How often each test case fails, and what each user failed last, for fail-fast ordering
+HISTORY = FailureHistory(
+    os.getenv("AUTOGRADER_HISTORY_DB", os.path.join(DATA_DIR, "autograder-history.sqlite3"))
+)
+
+# Per-test-case step, CPU and memory aggregates of profiled gradings, for spotting costly inputs
+PROFILES = ProfileStats(
+    os.getenv("AUTOGRADER_PROFILE_DB", os.path.join(DATA_DIR, "autograder-profiles.sqlite3"))
+)
+
+# Per-user/per-IP rate limits and a cap on concurrent gradings, shared by all workers through SQLite
+# (the freecode server uses the same default file, so the cap covers both servers)
+LIMITER = limiter_from_env(os.path.join(DATA_DIR, "execution-limits.sqlite3"))
+
+
+def too_many_requests(error):
+    """429 response telling the client when to try again."""
+    response = jsonify({"error": str(error)})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
 
 @app.route("/api/autograde", methods=["POST"])
 def autograde():
-    """Run user's Python code and automatically grade it."""
+    """
+    Run user's Python code and automatically grade it.
+    With ?async=true the submission is queued and answered with 202 and a
+    job id; poll /api/jobs/<job_id> for the result.
+    With ?fail_fast=true only pass/fail is wanted: the cases most likely to
+    fail run first and grading stops at the first failure.
+    With ?profile=true every case is traced and its result has a `profile`;
+    the numbers are also added to the problem's totals at /api/profiles/<problemId>.
+    """
     data = request.get_json()
 
     code = data.get("code")
@@ -30,61 +87,258 @@ def autograde():
     if not code or not problem_id:
         return jsonify({"error": "Missing code or problemId"}), 400
 
+    user_id = data.get("userId")
+    fail_fast = request.args.get("fail_fast", "").lower() in ("1", "true", "yes")
+    profile = request.args.get("profile", "").lower() in ("1", "true", "yes")
+    keys = client_keys(user_id, request.remote_addr)
+    if request.args.get("async", "").lower() in ("1", "true", "yes"):
+        try:
+            # Queued jobs are already bounded by the grading threads, so only the rate applies
+            with LIMITER.admit(keys, concurrent=False):
+                job_id = JOBS.submit("autograde", {"code": code, "problemId": problem_id,
+                                                   "userId": user_id, "failFast": fail_fast,
+                                                   "profile": profile})
+        except (QueueFull, RateLimited) as e:
+            return too_many_requests(e)
+        response = jsonify({"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"})
+        response.headers["Location"] = f"/api/jobs/{job_id}"
+        return response, 202
+
+    cached = None if fail_fast or profile else cached_grade(problem_id, code)
+    try:
+        # A cached answer runs no code, so it takes a token but no execution slot
+        with LIMITER.admit(keys, concurrent=cached is None):
+            body, status = (cached, 200) if cached is not None else grade(problem_id, code, user_id,
+                                                                          fail_fast, profile)
+    except RateLimited as e:
+        return too_many_requests(e)
+    return jsonify(body), status
+
+
+def cached_grade(problem_id, code):
+    """The remembered response for code already graded against this problem's cases, or None."""
+    test_cases = TEST_CASES.get(problem_id)
+    if not test_cases:
+        return None
+    return RESULT_CACHE.get((problem_id, content_hash(test_cases), normalized_code_hash(code)))
+
+
+def grade(problem_id, code, user_id=None, fail_fast=False, profile=False):
+    """
+    Grade one submission; returns (response body, status code).
+    With `fail_fast` the cases this user is most likely to fail run first,
+    grading stops at the first failure and the response only says whether
+    everything passed, with the results of the cases that ran.
+    With `profile` the code always runs (the cache is skipped) and is traced.
+    """
     # Retrieve test cases for the selected problem
     test_cases = TEST_CASES.get(problem_id)
     if not test_cases:
-        return jsonify({"error": "Invalid problemId"}), 404
+        return {"error": "Invalid problemId"}, 404
 
-    results = []
-    passed_count = 0
+    # Re-submissions of already graded code (starter code, copied answers) skip execution
+    # The key includes a hash of the test cases, so edited cases never match old results
+    cases_hash = content_hash(test_cases)
+    cache_key = (problem_id, cases_hash, normalized_code_hash(code))
+    if not fail_fast and not profile:
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            return cached, 200
 
-    for idx, case in enumerate(test_cases):
-        # Redirect stdin and stdout for safe testing
-        stdin = io.StringIO(case["input"])
-        stdout = io.StringIO()
+    history_key = f"{problem_id}:{cases_hash[:16]}"
+    order = HISTORY.order(history_key, user_id, len(test_cases)) if fail_fast else None
 
+    analysis = preflight.analyze(code)
+    ran = True
+    if not analysis.ok:
+        # Code that can't or mustn't run fails every case without taking a runner
+        runs = [{"error": analysis.message(), "wall_ms": 0.0} for _ in test_cases]
+        ran = False
+    else:
+        # Straight-line programs get a shorter budget, so a stuck one is given up on sooner;
+        # tracing makes code many times slower, so profiled runs keep the full budget
+        case_seconds = CASE_WALL_SECONDS if profile else analysis.time_budget(CASE_WALL_SECONDS)
         try:
-            # Execute the user code safely (no file access)
-            with contextlib.redirect_stdout(stdout), contextlib.redirect_stdin(stdin):
-                exec(code, {})
-
-            output = stdout.getvalue()
-
-            if output == case["expected"]:
-                results.append({
-                    "test": idx + 1,
-                    "status": "passed",
-                    "input": case["input"].strip(),
-                    "expected": case["expected"].strip(),
-                    "output": output.strip()
-                })
-                passed_count += 1
-            else:
-                results.append({
-                    "test": idx + 1,
-                    "status": "failed",
-                    "input": case["input"].strip(),
-                    "expected": case["expected"].strip(),
-                    "output": output.strip()
-                })
-
-        except Exception as e:
-            results.append({
-                "test": idx + 1,
-                "status": "error",
-                "error": str(e)
+            # Compile once and run every case in parallel inside a sandboxed worker
+            with metrics.timer("grading_seconds", problem_id=problem_id):
+                runs = get_default_pool().run(
+                    grade_submission, code, test_cases, case_wall_seconds=case_seconds, order=order,
+                    fail_fast=fail_fast, profile=profile, timeout=case_seconds * len(test_cases) + 1
+                )
+        except SandboxError as e:
+            runs = [{"error": str(e), "wall_ms": None, "timed_out": True} for _ in test_cases]
+            ran = False
+
+    results = [None if run is None else case_result(idx, case, run)
+               for idx, (case, run) in enumerate(zip(test_cases, runs))]
+    if ran:
+        # Learn which cases fail most often, for the order of later fail-fast runs
+        HISTORY.record(history_key, user_id, {
+            idx: result["status"] == "passed" for idx, result in enumerate(results) if result is not None
+        })
+        if profile:
+            # A case killed for running out of time has no profile, but still counts as a timeout
+            PROFILES.record(history_key, {
+                idx: run.get("profile") for idx, run in enumerate(runs)
+                if run is not None and ("profile" in run or run.get("timed_out"))
             })
+    metrics.get_registry().maybe_flush()
 
+    if fail_fast:
+        checked = [results[idx] for idx in order if results[idx] is not None]
+        failures = [result for result in checked if result["status"] != "passed"]
+        return {
+            "problemId": problem_id,
+            "totalTests": len(test_cases),
+            "checkedTests": len(checked),
+            "allPassed": not failures,
+            "firstFailure": failures[0] if failures else None,
+            "results": checked
+        }, 200
+
+    passed_count = sum(1 for result in results if result["status"] == "passed")
     score = (passed_count / len(test_cases)) * 100
 
-    return jsonify({
+    response = {
         "problemId": problem_id,
         "totalTests": len(test_cases),
         "passed": passed_count,
         "score": score,
         "results": results
+    }
+    if not analysis.ok:
+        response["problems"] = analysis.problems
+    # Timeouts and busy/crashed runners can depend on server load, so don't remember them
+    if not profile and not any(run.get("timed_out") for run in runs):
+        RESULT_CACHE.put(cache_key, response)
+
+    return response, 200
+
+
+def case_result(idx, case, run):
+    """The response entry for one test case's run."""
+    result = case_outcome(idx, case, run)
+    if "profile" in run:
+        result["profile"] = profile_response(run["profile"])
+    return result
+
+
+def case_outcome(idx, case, run):
+    if "error" in run:
+        return {
+            "test": idx + 1,
+            "status": "error",
+            "error": run["error"],
+            "timeMs": run["wall_ms"]
+        }
+
+    output = run["stdout"]
+
+    if output == case["expected"]:
+        return {
+            "test": idx + 1,
+            "status": "passed",
+            "input": case["input"].strip(),
+            "expected": case["expected"].strip(),
+            "output": output.strip(),
+            "timeMs": run["wall_ms"]
+        }
+
+    # Where the output went wrong; a run stopped at that point reports stoppedEarly
+    return {
+        "test": idx + 1,
+        "status": "failed",
+        "input": case["input"].strip(),
+        "expected": case["expected"].strip(),
+        "output": output.strip(),
+        "divergence": describe_divergence(case["expected"], output),
+        "stoppedEarly": run.get("stopped_early", False),
+        "timeMs": run["wall_ms"]
+    }
+
+
+def profile_response(profile):
+    """A profile from the grader, with this API's key names."""
+    return {
+        "steps": profile["steps"],
+        "wallMs": profile["wall_ms"],
+        "cpuMs": profile["cpu_ms"],
+        "peakMemoryBytes": profile["peak_memory_bytes"],
+        "hotLines": profile["hot_lines"]
+    }
+
+
+JOBS.register("autograde", lambda payload: grade(
+    payload["problemId"], payload["code"], payload.get("userId"), payload.get("failFast", False),
+    payload.get("profile", False)
+))
+
+
+@app.route("/api/profiles/<problem_id>", methods=["GET"])
+def get_problem_profile(problem_id):
+    """
+    Totals of the profiled gradings of a problem's current test cases: per
+    case, how often it ran and timed out, and its average and largest step
+    count, CPU time and peak memory.
+    """
+    test_cases = TEST_CASES.get(problem_id)
+    if not test_cases:
+        return jsonify({"error": "Invalid problemId"}), 404
+
+    history_key = f"{problem_id}:{content_hash(test_cases)[:16]}"
+    return jsonify({
+        "problemId": problem_id,
+        "cases": [{
+            "test": case["test_index"] + 1,
+            "runs": case["runs"],
+            "timeouts": case["timeouts"],
+            "avgSteps": case["avg_steps"],
+            "maxSteps": case["max_steps"],
+            "avgCpuMs": case["avg_cpu_ms"],
+            "maxCpuMs": case["max_cpu_ms"],
+            "maxPeakMemoryBytes": case["max_peak_memory_bytes"]
+        } for case in PROFILES.cases(history_key)]
+    })
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Check on a grading job. With ?wait=<seconds> (at most 30) the request is
+    held until the job finishes or the time runs out. When it is done,
+    `result` is the response /api/autograde would have returned.
+    """
+    wait = min(max(request.args.get("wait", 0, type=float), 0), MAX_JOB_WAIT_SECONDS)
+    job = JOBS.wait(job_id, wait) if wait else JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def get_job_events(job_id):
+    """Stream a grading job's state as Server-Sent Events, ending with a 'done' event."""
+    if JOBS.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate():
+        for job in JOBS.watch(job_id, MAX_JOB_WAIT_SECONDS):
+            if job is None:
+                return
+            event = "done" if job["status"] == "done" else "status"
+            yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     })
 
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Grading timings in the Prometheus text format."""
+    return Response(metrics.get_registry().render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1 @@
+# HTTP-level load benchmarks for the API (usage: "Load benchmarks" in the top-level README.md)
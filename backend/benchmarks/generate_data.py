@@ -0,0 +1,161 @@
+"""
+Generate a synthetic data directory for load benchmarks.
+
+The curriculum in app/data is replicated `--content-scale` times (with fresh
+module, challenge, quiz and question ids) and challenge_submissions.json /
+quiz_progress.json are filled with `--records` synthetic records each.
+
+    python -m benchmarks.generate_data --records 100000 --out benchmarks/data/100k
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+# The curriculum shipped with the backend, wherever the generator is run from
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app', 'data')
+
+
+def _load(filename):
+    with open(os.path.join(SOURCE_DIR, filename), 'r') as f:
+        return json.load(f)
+
+
+def scale_content(scale):
+    """Replicate every content file `scale` times, giving each copy new ids."""
+    modules, learn, practice = _load('modules.json'), _load('learn.json'), _load('practice.json')
+    challenges, quizzes = _load('challenges.json'), _load('quiz.json')
+    module_step = max(m['id'] for m in modules)
+    challenge_step = max(c['id'] for c in challenges)
+    quiz_step = max(q['quiz_id'] for q in quizzes)
+
+    content = {name: [] for name in ('modules.json', 'learn.json', 'practice.json', 'challenges.json', 'quiz.json')}
+    for copy in range(scale):
+        offset = copy * module_step
+        suffix = f" ({copy + 1})" if copy else ''
+        for module in modules:
+            content['modules.json'].append(dict(module, id=module['id'] + offset, name=module['name'] + suffix))
+        for item in learn:
+            content['learn.json'].append(dict(item, module_id=item['module_id'] + offset))
+        for item in practice:
+            content['practice.json'].append(dict(item, module_id=item['module_id'] + offset))
+        for challenge in challenges:
+            content['challenges.json'].append(dict(
+                challenge, id=challenge['id'] + copy * challenge_step, module_id=challenge['module_id'] + offset
+            ))
+        for quiz in quizzes:
+            questions = [
+                dict(question, question_id=question['question_id'] + copy * 1000 * quiz_step)
+                for question in quiz['questions']
+            ]
+            content['quiz.json'].append(dict(
+                quiz, quiz_id=quiz['quiz_id'] + copy * quiz_step,
+                module_id=quiz['module_id'] + offset, questions=questions
+            ))
+    return content
+
+
+def user_ids(count):
+    return [f'student_{i:05d}' for i in range(count)]
+
+
+def synthetic_history(content, records, users, rng):
+    """Yield (submission, progress) record pairs spread over the last school year."""
+    challenges, quizzes = content['challenges.json'], content['quiz.json']
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(records, 1)
+    for i in range(records):
+        timestamp = (start + step * i).isoformat()
+        user = rng.choice(users)
+
+        challenge = rng.choice(challenges)
+        test_cases = challenge.get('testCases', [])
+        passed = rng.randint(0, len(test_cases))
+        results = [
+            {
+                'test_case': n + 1,
+                'input': case.get('input', ''),
+                'expected_output': case.get('expectedOutput', ''),
+                'actual_output': case.get('expectedOutput', '') if n < passed else 'wrong',
+                'passed': n < passed
+            }
+            for n, case in enumerate(test_cases)
+        ]
+        submission = {
+            'challenge_id': challenge['id'],
+            'user_id': user,
+            'code': challenge.get('solution', '') if passed == len(test_cases) else challenge.get('starterCode', ''),
+            'score': round(passed / len(test_cases) * 100, 2) if test_cases else 0,
+            'passed_tests': passed,
+            'total_tests': len(test_cases),
+            'test_results': results,
+            'timestamp': timestamp
+        }
+
+        quiz = rng.choice(quizzes)
+        answers = {
+            str(q['question_id']): q['answer'] if rng.random() < 0.7 else q['options'][0]
+            for q in quiz['questions']
+        }
+        correct = sum(answers[str(q['question_id'])] == q['answer'] for q in quiz['questions'])
+        progress = {
+            'quiz_id': quiz['quiz_id'],
+            'user_id': user,
+            'score': round(correct / len(quiz['questions']) * 100, 2),
+            'correct_answers': correct,
+            'total_questions': len(quiz['questions']),
+            'answers': answers,
+            'completion_time': timestamp,
+            'timestamp': timestamp
+        }
+        yield submission, progress
+
+
+def _write_json_array(path, items):
+    """Stream a JSON array to disk without holding every record in memory."""
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for i, item in enumerate(items):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(item))
+        f.write('\n]\n')
+
+
+def generate(out_dir, records, content_scale=1, users=None, seed=7):
+    """Write a complete data directory; returns the list of user ids used."""
+    os.makedirs(out_dir, exist_ok=True)
+    content = scale_content(content_scale)
+    for filename, data in content.items():
+        with open(os.path.join(out_dir, filename), 'w') as f:
+            json.dump(data, f)
+
+    users = user_ids(users or max(records // 50, 10))
+    # Each file is generated from the same seed in turn, so no record is kept in memory
+    _write_json_array(os.path.join(out_dir, 'challenge_submissions.json'),
+                      (s for s, _ in synthetic_history(content, records, users, random.Random(seed))))
+    _write_json_array(os.path.join(out_dir, 'quiz_progress.json'),
+                      (p for _, p in synthetic_history(content, records, users, random.Random(seed))))
+
+    with open(os.path.join(out_dir, 'users.json'), 'w') as f:
+        json.dump(users, f)
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000,
+                        help='records in each history file (e.g. 1000, 100000, 1000000)')
+    parser.add_argument('--content-scale', type=int, default=1, help='copies of the curriculum to generate')
+    parser.add_argument('--users', type=int, default=None, help='distinct students (default: records / 50)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', required=True, help='directory to write the data files to')
+    args = parser.parse_args()
+
+    generate(args.out, args.records, args.content_scale, args.users, args.seed)
+    print(f"Wrote {args.records} submissions and progress records to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Replay a realistic mix of API calls and report latency percentiles.
+
+By default the app is built in-process (Flask test client) on top of a data
+directory written by `benchmarks.generate_data`; pass `--url` to load a
+running server instead (e.g. gunicorn) with several client threads.
+
+    python -m benchmarks.generate_data --records 100000 --out benchmarks/data/100k
+    python -m benchmarks.run_benchmark --data benchmarks/data/100k --requests 5000
+    python -m benchmarks.run_benchmark --data benchmarks/data/100k --url http://localhost:5000 --threads 8
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# (label, weight) - roughly what the frontend does while students work through a module
+CALL_MIX = [
+    ('GET /modules', 20),
+    ('GET /modules/<id>', 15),
+    ('GET /modules/<id>/<section>', 15),
+    ('POST /quiz-progress', 10),
+    ('POST /challenges/<id>/validate', 10),
+    ('GET /quiz-progress/<user>', 10),
+    ('GET /quiz-progress/<user>/summary', 10),
+    ('GET /challenges/<id>/submissions/<user>', 5),
+    ('GET /challenges/submissions/<user>/overview', 5),
+]
+
+SECTIONS = ['learn', 'practice', 'challenge', 'quizzes']
+
+
+class CallMix:
+    """Builds random (label, method, path, body) calls against the benchmark data."""
+
+    def __init__(self, data_dir, seed=11):
+        self.rng = random.Random(seed)
+        with open(os.path.join(data_dir, 'modules.json'), 'r') as f:
+            self.module_ids = [m['id'] for m in json.load(f)]
+        with open(os.path.join(data_dir, 'challenges.json'), 'r') as f:
+            self.challenges = json.load(f)
+        with open(os.path.join(data_dir, 'quiz.json'), 'r') as f:
+            self.quizzes = json.load(f)
+        with open(os.path.join(data_dir, 'users.json'), 'r') as f:
+            self.users = json.load(f)
+        self.labels = [label for label, _ in CALL_MIX]
+        self.weights = [weight for _, weight in CALL_MIX]
+
+    def next_call(self):
+        rng = self.rng
+        label = rng.choices(self.labels, self.weights)[0]
+        user = rng.choice(self.users)
+        if label == 'GET /modules':
+            return label, 'GET', '/modules', None
+        if label == 'GET /modules/<id>':
+            return label, 'GET', f'/modules/{rng.choice(self.module_ids)}', None
+        if label == 'GET /modules/<id>/<section>':
+            return label, 'GET', f'/modules/{rng.choice(self.module_ids)}/{rng.choice(SECTIONS)}', None
+        if label == 'POST /quiz-progress':
+            quiz = rng.choice(self.quizzes)
+            answers = {
+                str(q['question_id']): q['answer'] if rng.random() < 0.7 else q['options'][0]
+                for q in quiz['questions']
+            }
+            body = {'quiz_id': quiz['quiz_id'], 'user_id': user, 'answers': answers,
+                    'completion_time': datetime.now().isoformat()}
+            return label, 'POST', '/quiz-progress', body
+        if label == 'POST /challenges/<id>/validate':
+            challenge = rng.choice(self.challenges)
+            solved = rng.random() < 0.5
+            results = {
+                f'test_{i}': case.get('expectedOutput', '') if solved else 'not quite'
+                for i, case in enumerate(challenge.get('testCases', []))
+            }
+            body = {'user_id': user, 'code': challenge.get('solution', ''), 'execution_results': results}
+            return label, 'POST', f"/challenges/{challenge['id']}/validate", body
+        if label == 'GET /quiz-progress/<user>':
+            return label, 'GET', f'/quiz-progress/{user}', None
+        if label == 'GET /quiz-progress/<user>/summary':
+            return label, 'GET', f'/quiz-progress/{user}/summary', None
+        if label == 'GET /challenges/<id>/submissions/<user>':
+            challenge = rng.choice(self.challenges)
+            return label, 'GET', f"/challenges/{challenge['id']}/submissions/{user}?limit=20&order=desc", None
+        return label, 'GET', f'/challenges/submissions/{user}/overview', None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """Turn {label: [(ms, status)]} into per-endpoint stats plus an 'ALL' row."""
+    report = {}
+    everything = []
+    for label, values in samples.items():
+        everything.extend(values)
+        report[label] = _stats(values, elapsed)
+    report['ALL'] = _stats(everything, elapsed)
+    return report
+
+
+def _stats(values, elapsed):
+    latencies = sorted(ms for ms, _ in values)
+    return {
+        'count': len(values),
+        # Modules without content legitimately answer 404, so only server errors count
+        'errors': sum(1 for _, status in values if status >= 500),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else 0.0
+    }
+
+
+def print_report(report, title):
+    print(f"\n{title}")
+    print(f"{'endpoint':<44}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for label in [label for label, _ in CALL_MIX if label in report] + ['ALL']:
+        row = report[label]
+        print(f"{label:<44}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['throughput_rps']:>10}")
+
+
+def run_in_process(data_dir, total, warmup):
+    """Replay the mix through the Flask test client against a scratch copy of the data."""
+    from app import create_app
+
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        for filename in os.listdir(data_dir):
+            shutil.copy(os.path.join(data_dir, filename), work_dir)
+
+        # The first store access imports the legacy JSON history into SQLite
+        started = time.perf_counter()
+        # Every simulated user comes from the same address, so the per-IP limit would throttle the run
+        app = create_app({'DATA_DIR': work_dir, 'SUBMISSIONS_DB': os.path.join(work_dir, 'submissions.sqlite3'),
+                          'RATE_LIMITING': False})
+        with app.app_context():
+            app.extensions['store'].quiz_summary('warmup')
+        migration_seconds = time.perf_counter() - started
+
+        client = app.test_client()
+        mix = CallMix(data_dir)
+        for _ in range(warmup):
+            _, method, path, body = mix.next_call()
+            client.open(path, method=method, json=body)
+
+        samples = {}
+        started = time.perf_counter()
+        for _ in range(total):
+            label, method, path, body = mix.next_call()
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            samples.setdefault(label, []).append(((time.perf_counter() - start) * 1000, response.status_code))
+        elapsed = time.perf_counter() - started
+        return summarize(samples, elapsed), migration_seconds
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_against_url(base_url, data_dir, total, warmup, threads):
+    """Replay the mix against a running server from several client threads."""
+    mix = CallMix(data_dir)
+    calls = [mix.next_call() for _ in range(warmup + total)]
+    samples = {}
+    lock = threading.Lock()
+
+    def send(call):
+        label, method, path, body = call
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(base_url.rstrip('/') + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 599
+        return label, (time.perf_counter() - start) * 1000, status
+
+    for call in calls[:warmup]:
+        send(call)
+
+    queue = calls[warmup:]
+    position = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if position[0] >= len(queue):
+                    return
+                call = queue[position[0]]
+                position[0] += 1
+            label, ms, status = send(call)
+            with lock:
+                samples.setdefault(label, []).append((ms, status))
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', required=True, help='data directory written by benchmarks.generate_data')
+    parser.add_argument('--requests', type=int, default=2000, help='measured requests')
+    parser.add_argument('--warmup', type=int, default=200, help='unmeasured requests sent first')
+    parser.add_argument('--url', help='benchmark a running server instead of an in-process app')
+    parser.add_argument('--threads', type=int, default=4, help='client threads when using --url')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args()
+
+    if args.url:
+        report = run_against_url(args.url, args.data, args.requests, args.warmup, args.threads)
+        result = {'mode': 'http', 'url': args.url, 'endpoints': report}
+    else:
+        report, migration_seconds = run_in_process(args.data, args.requests, args.warmup)
+        print(f"Initial import of the JSON history took {migration_seconds:.2f}s")
+        result = {'mode': 'in-process', 'migration_seconds': round(migration_seconds, 3), 'endpoints': report}
+    result.update({'data': args.data, 'requests': args.requests})
+
+    print_report(report, f"{args.requests} requests against {args.data}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
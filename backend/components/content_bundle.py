@@ -0,0 +1,214 @@
+"""
+Compile the curriculum into one versioned, client-safe bundle.
+
+The bundle holds every module with its learn, practice, challenge and quiz
+sections, minus the fields only the server may see (solutions and expected
+outputs). It is named by the hash of its body, so a given URL always serves
+the same bytes and clients can cache it forever.
+"""
+import json
+import os
+
+from .content_repository import CONTENT_FILES, SECTION_FILES
+from .prepared_document import PreparedDocument
+
+# Fields that must never reach the browser
+SERVER_ONLY_CHALLENGE_FIELDS = ('solution', 'explanation')
+SERVER_ONLY_TEST_CASE_FIELDS = ('expectedOutput', 'matchRules')
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class ContentError(Exception):
+    """Raised when the content files do not pass validation."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} content error(s)")
+        self.errors = errors
+
+
+def read_content(data_dir):
+    """Read every content file, raising ContentError if one is missing or malformed."""
+    content, errors = {}, []
+    for filename in CONTENT_FILES:
+        path = os.path.join(data_dir, filename)
+        try:
+            with open(path, 'r') as f:
+                content[filename] = json.load(f)
+        except FileNotFoundError:
+            errors.append(f"{filename}: file not found at {path}")
+        except json.JSONDecodeError as e:
+            errors.append(f"{filename}: invalid JSON ({e})")
+    if errors:
+        raise ContentError(errors)
+    return content
+
+
+def validate_content(content):
+    """Return a list of problems found in the content (empty when it is valid)."""
+    errors = []
+    for filename in CONTENT_FILES:
+        items = content.get(filename)
+        if not isinstance(items, list):
+            errors.append(f"{filename}: expected a list of objects")
+            content = dict(content, **{filename: []})
+        elif not all(isinstance(item, dict) for item in items):
+            errors.append(f"{filename}: every entry must be an object")
+            content = dict(content, **{filename: [item for item in items if isinstance(item, dict)]})
+
+    module_ids = _check_ids(content['modules.json'], 'modules.json', 'id', errors)
+    _check_ids(content['challenges.json'], 'challenges.json', 'id', errors)
+    _check_ids(content['quiz.json'], 'quiz.json', 'quiz_id', errors)
+    for module in content['modules.json']:
+        if not module.get('name'):
+            errors.append(f"modules.json: module {module.get('id')} has no name")
+
+    for filename in SECTION_FILES.values():
+        for index, item in enumerate(content[filename]):
+            if item.get('module_id') not in module_ids:
+                errors.append(f"{filename}[{index}]: unknown module_id {item.get('module_id')!r}")
+
+    for challenge in content['challenges.json']:
+        test_cases = challenge.get('testCases')
+        if not isinstance(test_cases, list) or not test_cases:
+            errors.append(f"challenges.json: challenge {challenge.get('id')} has no testCases")
+            continue
+        for number, test_case in enumerate(test_cases, start=1):
+            if not isinstance(test_case, dict) or 'expectedOutput' not in test_case:
+                errors.append(f"challenges.json: challenge {challenge.get('id')} test case {number} "
+                              "has no expectedOutput")
+
+    question_ids = set()
+    for quiz in content['quiz.json']:
+        questions = quiz.get('questions')
+        if not isinstance(questions, list) or not questions:
+            errors.append(f"quiz.json: quiz {quiz.get('quiz_id')} has no questions")
+            continue
+        for question in questions:
+            question_id = question.get('question_id') if isinstance(question, dict) else None
+            if question_id is None:
+                errors.append(f"quiz.json: quiz {quiz.get('quiz_id')} has a question without question_id")
+                continue
+            if question_id in question_ids:
+                errors.append(f"quiz.json: duplicate question_id {question_id}")
+            question_ids.add(question_id)
+            if question.get('answer') not in (question.get('options') or []):
+                errors.append(f"quiz.json: question {question_id} answer is not one of its options")
+    return errors
+
+
+def _check_ids(items, filename, key, errors):
+    seen = set()
+    for index, item in enumerate(items):
+        value = item.get(key)
+        if value is None:
+            errors.append(f"{filename}[{index}]: missing '{key}'")
+        elif value in seen:
+            errors.append(f"{filename}: duplicate {key} {value!r}")
+        seen.add(value)
+    return seen
+
+
+def _client_challenge(challenge):
+    """A copy of a challenge without its solution or expected outputs."""
+    if challenge is None:
+        return None
+    safe = {k: v for k, v in challenge.items() if k not in SERVER_ONLY_CHALLENGE_FIELDS}
+    safe['testCases'] = [
+        {k: v for k, v in test_case.items() if k not in SERVER_ONLY_TEST_CASE_FIELDS}
+        for test_case in challenge.get('testCases', [])
+        if isinstance(test_case, dict)
+    ]
+    return safe
+
+
+def build_bundle(content):
+    """
+    Assemble the bundle data: every module, in file order, with its sections
+    attached the same way GET /modules/<id> does.
+    """
+    first = {}
+    for section, filename in SECTION_FILES.items():
+        if section == 'quizzes':
+            continue
+        by_module = {}
+        for item in content[filename]:
+            by_module.setdefault(item.get('module_id'), item)
+        first[section] = by_module
+    quizzes = {}
+    for quiz in content['quiz.json']:
+        quizzes.setdefault(quiz.get('module_id'), []).append(quiz)
+
+    modules = []
+    for module in content['modules.json']:
+        module_id = module.get('id')
+        modules.append(dict(
+            module,
+            learn=first['learn'].get(module_id),
+            practice=first['practice'].get(module_id),
+            challenge=_client_challenge(first['challenge'].get(module_id)),
+            quizzes=quizzes.get(module_id, [])
+        ))
+    return {'modules': modules}
+
+
+def compile_bundle(content):
+    """Validate and compile content into a PreparedDocument; its etag is the bundle hash."""
+    errors = validate_content(content)
+    if errors:
+        raise ContentError(errors)
+    return PreparedDocument(build_bundle(content))
+
+
+def write_bundle(document, out_dir):
+    """
+    Write `bundle.<hash>.json` (and its `.gz`) and point manifest.json at it.
+    Returns the manifest. Older bundles are kept so cached URLs stay valid.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    name = f'bundle.{document.etag}.json'
+    _write_atomic(os.path.join(out_dir, name), document.body)
+    if document.gzip_body is not None:
+        _write_atomic(os.path.join(out_dir, name + '.gz'), document.gzip_body)
+    manifest = {
+        'hash': document.etag,
+        'file': name,
+        'bytes': len(document.body),
+        'gzip_bytes': len(document.gzip_body) if document.gzip_body is not None else None
+    }
+    _write_atomic(os.path.join(out_dir, MANIFEST_FILE), json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+def _write_atomic(path, data):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class BundleStore:
+    """Serves compiled bundles from a directory; they never change, so each is read once."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._bundles = {}  # hash -> (body, gzip_body)
+
+    def get(self, bundle_hash):
+        """(body, gzip_body or None) for a built bundle, or None if it does not exist."""
+        cached = self._bundles.get(bundle_hash)
+        if cached is not None:
+            return cached
+        path = os.path.join(self.directory, f'bundle.{bundle_hash}.json')
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            with open(path + '.gz', 'rb') as f:
+                gzip_body = f.read()
+        except FileNotFoundError:
+            gzip_body = None
+        self._bundles[bundle_hash] = (body, gzip_body)
+        return body, gzip_body
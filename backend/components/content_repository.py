@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+
+from . import metrics
+from .output_matcher import compile_challenge
+from .prepared_document import PreparedDocument
+from .result_cache import content_hash
+from .search_index import SearchIndex
+
+# The curriculum files that make up the read-only content of the app
+CONTENT_FILES = ('modules.json', 'learn.json', 'practice.json', 'challenges.json', 'quiz.json')
+
+# Maps a module section name to the file it is stored in
+SECTION_FILES = {
+    'learn': 'learn.json',
+    'practice': 'practice.json',
+    'challenge': 'challenges.json',
+    'quizzes': 'quiz.json'
+}
+
+
+def load_json_file(path):
+    """Load a JSON data file, returning an empty list if it is missing or malformed."""
+    try:
+        filename = os.path.basename(path)
+        with metrics.timer('data_file_read_seconds', file=filename):
+            with open(path, 'rb') as f:
+                raw = f.read()
+            metrics.inc('data_file_read_bytes_total', len(raw), file=filename)
+            return json.loads(raw)
+    except FileNotFoundError:
+        # Return an empty list if a file is missing, with a helpful server-side warning
+        print(f"Warning: Data file not found at {path}")
+        return []
+    except json.JSONDecodeError:
+        # Return an empty list if a file is malformed, with a helpful server-side warning
+        print(f"Warning: Could not decode JSON from {path}. Check for syntax errors.")
+        return []
+
+
+def _file_signature(path):
+    """Return (mtime, size) for a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class ContentRepository:
+    """
+    Read-only, in-memory view of the curriculum files with dict indexes.
+
+    Files are parsed once per worker and only re-parsed when their mtime or
+    size changes on disk. Changes are checked at most once every
+    `check_interval` seconds, so lookups normally do no disk I/O at all.
+
+    The returned objects are shared between requests and must not be mutated;
+    copy them first if a response needs extra fields.
+    """
+
+    def __init__(self, data_dir, check_interval=1.0):
+        self.data_dir = data_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._files = {}  # filename -> (signature, parsed data)
+        self._last_check = None
+        self.version = 0
+
+        self._modules_by_id = {}
+        self._challenges_by_id = {}
+        self._quizzes_by_id = {}
+        self._challenge_versions = {}
+        self._challenge_matchers = {}
+        self._quiz_answer_keys = {}
+        self._challenges_by_module = {}
+        self._sections_by_module = {name: {} for name in SECTION_FILES}
+        self._documents = {}  # (kind, *ids) -> PreparedDocument for the current content
+        # Full-text index of the section files, updated only for the files that changed
+        self._search_index = SearchIndex()
+
+    # --- Loading ---
+
+    def refresh(self, force=False):
+        """Re-read any content file whose mtime/size changed since the last load."""
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return
+
+        with self._lock:
+            changed = []
+            for filename in CONTENT_FILES:
+                path = os.path.join(self.data_dir, filename)
+                signature = _file_signature(path)
+                cached = self._files.get(filename)
+                if cached is not None and cached[0] == signature:
+                    continue
+
+                data = load_json_file(path)
+                self._files[filename] = (signature, data if isinstance(data, list) else [])
+                changed.append(filename)
+
+            if changed:
+                self._build_indexes()
+                for filename in changed:
+                    if filename in SECTION_FILES.values():
+                        self._search_index.update_file(filename, self._data(filename))
+                self.version += 1
+            self._last_check = now
+
+    def _build_indexes(self):
+        """Rebuild the lookup dicts from the currently loaded files."""
+        self._modules_by_id = _index_first(self._data('modules.json'), 'id')
+        self._challenges_by_id = _index_first(self._data('challenges.json'), 'id')
+        self._quizzes_by_id = _index_first(self._data('quiz.json'), 'quiz_id')
+        # Hash of each challenge's test cases, used to key cached grading results
+        self._challenge_versions = {
+            challenge_id: content_hash(challenge.get('testCases', []))
+            for challenge_id, challenge in self._challenges_by_id.items()
+        }
+        # Output matchers are compiled once per content version, not per validation
+        self._challenge_matchers = {
+            challenge_id: compile_challenge(challenge)
+            for challenge_id, challenge in self._challenges_by_id.items()
+        }
+        # Every challenge of a module (the 'challenge' section only holds the first one)
+        self._challenges_by_module = {}
+        for challenge in self._challenges_by_id.values():
+            self._challenges_by_module.setdefault(challenge.get('module_id'), []).append(challenge)
+        # Correct answers keyed by question id (as a string, like submitted answers)
+        self._quiz_answer_keys = {
+            quiz_id: {
+                str(question.get('question_id')): question.get('answer')
+                for question in quiz.get('questions', [])
+            }
+            for quiz_id, quiz in self._quizzes_by_id.items()
+        }
+
+        sections = {}
+        for section, filename in SECTION_FILES.items():
+            if section == 'quizzes':
+                # A module can have several quizzes, so keep all of them in file order
+                by_module = {}
+                for quiz in self._data(filename):
+                    by_module.setdefault(quiz.get('module_id'), []).append(quiz)
+            else:
+                by_module = _index_first(self._data(filename), 'module_id')
+            sections[section] = by_module
+        self._sections_by_module = sections
+        # Prepared response bodies belong to the old content, rebuild them on demand
+        self._documents = {}
+
+    def _data(self, filename):
+        cached = self._files.get(filename)
+        return cached[1] if cached else []
+
+    # --- Lookups ---
+
+    def all(self, filename):
+        """Return the full parsed contents of one content file."""
+        self.refresh()
+        return self._data(filename)
+
+    def modules(self):
+        return self.all('modules.json')
+
+    def quizzes(self):
+        return self.all('quiz.json')
+
+    def module(self, module_id):
+        self.refresh()
+        return self._modules_by_id.get(module_id)
+
+    def challenge(self, challenge_id):
+        self.refresh()
+        return self._challenges_by_id.get(challenge_id)
+
+    def module_challenges(self, module_id):
+        """All challenges that belong to a module, in file order."""
+        self.refresh()
+        return list(self._challenges_by_module.get(module_id, []))
+
+    def challenge_version(self, challenge_id):
+        """Hash of a challenge's test cases; changes whenever they are edited."""
+        self.refresh()
+        return self._challenge_versions.get(challenge_id)
+
+    def challenge_matchers(self, challenge_id):
+        """Precompiled output matchers for a challenge, one per test case."""
+        self.refresh()
+        return self._challenge_matchers.get(challenge_id, [])
+
+    def quiz(self, quiz_id):
+        self.refresh()
+        return self._quizzes_by_id.get(quiz_id)
+
+    def quiz_answer_key(self, quiz_id):
+        """{question_id: correct answer} for a quiz, or None if the quiz does not exist."""
+        self.refresh()
+        return self._quiz_answer_keys.get(quiz_id)
+
+    def search(self, query, limit=10, prefix=True):
+        """Full-text search of lessons, practice items, challenges and quizzes; see SearchIndex.search."""
+        self.refresh()
+        return self._search_index.search(query, limit, prefix)
+
+    def section(self, section, module_id):
+        """
+        Return one section of a module. 'quizzes' returns a (possibly empty)
+        list, every other section returns a single item or None.
+        """
+        self.refresh()
+        found = self._sections_by_module[section].get(module_id)
+        if section == 'quizzes':
+            return list(found or [])
+        return found
+
+    def assemble_module(self, module_id):
+        """A module with its learn, practice, challenge and quizzes attached, or None."""
+        module_info = self.module(module_id)
+        if not module_info:
+            return None
+        # Copy before attaching the related data so the shared content stays untouched
+        module_info = dict(module_info)
+        for section in SECTION_FILES:
+            module_info[section] = self.section(section, module_id)
+        return module_info
+
+    # --- Prepared (pre-serialized) documents ---
+
+    def document(self, key, build):
+        """
+        Return the PreparedDocument for `key`, calling `build()` to produce its
+        data the first time it is needed for the current content version.
+        Returns None when `build()` returns None.
+        """
+        self.refresh()
+        documents = self._documents
+        if key not in documents:
+            data = build()
+            documents[key] = PreparedDocument(data) if data is not None else None
+        return documents[key]
+
+    def modules_document(self):
+        return self.document(('modules',), self.modules)
+
+    def module_document(self, module_id):
+        return self.document(('module', module_id), lambda: self.assemble_module(module_id))
+
+    def section_document(self, section, module_id):
+        return self.document(('section', section, module_id), lambda: self.section(section, module_id))
+
+
+def _index_first(items, key):
+    """Index items by `key`, keeping the first occurrence like a `next(...)` scan would."""
+    index = {}
+    for item in items:
+        if isinstance(item, dict):
+            index.setdefault(item.get(key), item)
+    return index
@@ -0,0 +1,267 @@
+"""
+Compile-once, fork-per-test grading engine.
+
+`grade_submission` runs as a job inside a sandbox worker (see sandbox.py).
+The worker compiles the submission to a code object once and then forks
+one child per test case. Children share the warmed worker's memory
+copy-on-write, run in parallel and report their output through a pipe, so
+grading costs roughly as much as the slowest case instead of the sum of all.
+
+When a test case has an expected output, the child compares stdout with it
+as the program writes, and stops the program shortly after the first
+character that differs, so a wrong answer fails in milliseconds instead of
+running until its time budget is spent.
+"""
+import contextlib
+import io
+import json
+import os
+import select
+import signal
+import sys
+import time
+
+from .preflight import compiled
+from .profiler import ExecutionProfiler
+from .sandbox import (CappedWriter, CPUTimeExceeded, OutputLimitExceeded,
+                      arm_cpu_limit, current_limits)
+
+# Wall-clock budget for each test case, measured from its fork
+CASE_WALL_SECONDS = 2.0
+
+# Characters of output still captured after it diverges from the expected output,
+# so the student sees the rest of the line that went wrong
+MISMATCH_MARGIN_CHARS = 200
+
+
+class OutputMismatch(BaseException):
+    # BaseException so that a student's `except Exception:` cannot swallow it
+    pass
+
+
+class ExpectedOutputWriter(CappedWriter):
+    """
+    A CappedWriter that checks the output against `expected` as it is
+    written. Once they differ (or the output runs past the end of
+    `expected`), at most `margin` more characters are kept and the program
+    is stopped by raising OutputMismatch.
+    """
+
+    def __init__(self, limit, expected, margin=MISMATCH_MARGIN_CHARS):
+        super().__init__(limit)
+        self.expected = expected
+        self.margin = margin
+        self.position = 0        # characters written so far
+        self.diverged_at = None  # index of the first character that differs
+
+    def write(self, s):
+        if not isinstance(s, str):
+            return super().write(s)
+        if self.diverged_at is None:
+            expected_part = self.expected[self.position:self.position + len(s)]
+            if s != expected_part:
+                self.diverged_at = self.position + _common_prefix_length(s, expected_part)
+        if self.diverged_at is not None:
+            room = self.diverged_at + self.margin - self.position
+            if len(s) > room:
+                kept = s[:max(room, 0)]
+                super().write(kept)
+                self.position += len(kept)
+                raise OutputMismatch()
+        written = super().write(s)
+        self.position += len(s)
+        return written
+
+
+def _common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def describe_divergence(expected, actual):
+    """
+    Where `actual` first differs from `expected`, or None if they are equal:
+    the character offset, 1-based line and column, and that line of each
+    (None when the output has no such line).
+    """
+    if actual == expected:
+        return None
+    offset = _common_prefix_length(actual, expected)
+    line = actual.count('\n', 0, offset)
+    column = offset - (actual.rfind('\n', 0, offset) + 1)
+    expected_lines = expected.split('\n')
+    actual_lines = actual.split('\n')
+    return {
+        'offset': offset,
+        'line': line + 1,
+        'column': column + 1,
+        'expected': expected_lines[line] if line < len(expected_lines) else None,
+        'actual': actual_lines[line] if line < len(actual_lines) else None
+    }
+
+
+def compile_submission(code):
+    """Compile student code once; returns (code_object, None) or (None, error message)."""
+    try:
+        return compiled(code), None
+    except (SyntaxError, ValueError) as e:
+        line = getattr(e, 'lineno', None)
+        where = f" (line {line})" if line else ''
+        return None, f"{type(e).__name__}: {getattr(e, 'msg', e)}{where}"
+
+
+def _run_case_in_child(code_object, stdin_text, expected, write_fd, profile_source=None):
+    """
+    Body of a forked child: run one test case and send the outcome to the parent.
+    When `profile_source` (the submission's code) is given, the run is profiled.
+    """
+    limits = current_limits()
+    arm_cpu_limit(limits['cpu_seconds'])
+    if expected is None:
+        stdout = CappedWriter(limits['output_bytes'])
+    else:
+        stdout = ExpectedOutputWriter(limits['output_bytes'], expected)
+    profiler = ExecutionProfiler() if profile_source is not None else None
+    outcome = {}
+    try:
+        sys.stdin = io.StringIO(stdin_text)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+            if profiler is None:
+                exec(code_object, {'__name__': '__main__'})
+            else:
+                profiler.run(code_object, {'__name__': '__main__'})
+    except OutputMismatch:
+        # Not an error: the output is reported and judged wrong as usual
+        outcome['stopped_early'] = True
+    except CPUTimeExceeded:
+        outcome['error'] = "Your program used too much CPU time. Is there a loop that never stops?"
+    except OutputLimitExceeded:
+        outcome['error'] = "Your program printed too much output, so it was stopped."
+    except MemoryError:
+        outcome['error'] = "Your program used too much memory."
+    except BaseException as e:
+        outcome['error'] = str(e)
+    outcome['stdout'] = stdout.getvalue()
+    if profiler is not None:
+        outcome['profile'] = profiler.summary(profile_source)
+
+    data = json.dumps(outcome).encode()
+    view = memoryview(data)
+    while view:
+        written = os.write(write_fd, view)
+        view = view[written:]
+
+
+def _fork_case(code_object, stdin_text, expected, profile_source=None):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: never return into the worker's job loop
+        status = 0
+        try:
+            os.close(read_fd)
+            _run_case_in_child(code_object, stdin_text, expected, write_fd, profile_source)
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def grade_submission(code, test_cases, case_wall_seconds=CASE_WALL_SECONDS, max_parallel=None,
+                     stop_on_mismatch=True, order=None, fail_fast=False, profile=False):
+    """
+    Job: run every test case against one submission.
+
+    Returns one dict per test case, in order, with the captured `stdout`,
+    an `error` message if the case failed to run, and its `wall_ms`/`cpu_ms`.
+    With `stop_on_mismatch`, a case whose `expected` output is given is
+    stopped once its output is known to be wrong; its result then has
+    `stopped_early` set and `stdout` holds the output up to that point.
+
+    Cases are started in `order` (a list of indices; file order by default).
+    With `fail_fast` they run one at a time and grading stops at the first
+    case that errors or doesn't print its `expected` output; the cases that
+    never ran are None in the returned list.
+
+    With `profile` every case is traced and its result gets a `profile`
+    (see profiler.py), except cases killed for running out of time.
+    """
+    code_object, error = compile_submission(code)
+    if code_object is None:
+        return [{'stdout': '', 'error': error, 'wall_ms': 0.0, 'cpu_ms': 0.0} for _ in test_cases]
+
+    max_parallel = 1 if fail_fast else max_parallel or os.cpu_count() or 2
+    results = [None] * len(test_cases)
+    pending = [(index, test_cases[index]) for index in (range(len(test_cases)) if order is None else order)]
+    running = {}  # read fd -> [case index, pid, start time, chunks]
+
+    while pending or running:
+        # Keep up to max_parallel children running at a time
+        while pending and len(running) < max_parallel:
+            index, case = pending.pop(0)
+            expected = case.get('expected') if stop_on_mismatch else None
+            if not isinstance(expected, str):
+                expected = None
+            pid, read_fd = _fork_case(code_object, case.get('input', ''), expected, code if profile else None)
+            running[read_fd] = [index, pid, time.monotonic(), []]
+
+        now = time.monotonic()
+        deadline = min(start + case_wall_seconds for _, _, start, _ in running.values())
+        ready, _, _ = select.select(list(running), [], [], max(deadline - now, 0))
+
+        for fd in ready:
+            chunk = os.read(fd, 65536)
+            if chunk:
+                running[fd][3].append(chunk)
+                continue
+            # EOF: the child finished (or died)
+            index, pid, start, chunks = running.pop(fd)
+            os.close(fd)
+            results[index] = _collect(pid, start, b''.join(chunks))
+            if fail_fast and case_failed(results[index], test_cases[index]):
+                pending.clear()
+
+        # Kill children that have run past their wall-clock budget
+        now = time.monotonic()
+        for fd, (index, pid, start, _) in list(running.items()):
+            if now - start >= case_wall_seconds:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+                running.pop(fd)
+                os.close(fd)
+                result = _collect(pid, start, b'')
+                result['error'] = "Your program took too long to run and was stopped."
+                result['timed_out'] = True
+                results[index] = result
+                if fail_fast:
+                    pending.clear()
+
+    return results
+
+
+def case_failed(result, case):
+    """Whether a case's result is a failure: an error, or output other than the expected one."""
+    expected = case.get('expected')
+    return 'error' in result or (isinstance(expected, str) and result.get('stdout') != expected)
+
+
+def _collect(pid, start, data):
+    """Reap a finished child and turn what it sent into a result dict."""
+    _, _, usage = os.wait4(pid, 0)
+    wall_ms = (time.monotonic() - start) * 1000
+    try:
+        outcome = json.loads(data) if data else None
+    except ValueError:
+        outcome = None
+    if outcome is None:
+        # Nothing (or garbage) came back: the child was killed, e.g. by a hard rlimit
+        outcome = {'stdout': '', 'error': "Your program stopped unexpectedly."}
+    outcome['wall_ms'] = round(wall_ms, 2)
+    outcome['cpu_ms'] = round((usage.ru_utime + usage.ru_stime) * 1000, 2)
+    return outcome
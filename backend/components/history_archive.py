@@ -0,0 +1,85 @@
+"""
+Compressed, time-partitioned archive segments for old submission history.
+
+The submission store keeps a hot window of records in SQLite and moves
+older ones here. A segment is one append-only file per kind of record
+("challenge" or "quiz") and quarter, named like `challenge-2025-Q3.seg`,
+so a school year's history can be moved or dropped as a few files. Each
+write appends chunks: a zlib-compressed JSON list of the rows of one
+(user, challenge or quiz) in that quarter, exactly as they were stored in
+the live table. Chunks are never rewritten. The store indexes them in its
+`archive_chunks` table with their offset, length and the (timestamp, id)
+range they cover, so a read opens only the chunks it needs.
+
+Bytes appended without an index entry, for instance when the process dies
+before its transaction commits, are never read.
+"""
+import json
+import os
+import re
+import zlib
+
+from . import metrics
+
+# Records whose timestamp does not start with a year and month go to one "undated" segment per kind
+UNDATED = 'undated'
+_MONTH = re.compile(r'\d{4}-\d{2}')
+
+ZLIB_LEVEL = 6
+
+
+def period_of(timestamp):
+    """The quarter ('YYYY-Qn') a record is archived under."""
+    if isinstance(timestamp, str) and _MONTH.match(timestamp) and 1 <= int(timestamp[5:7]) <= 12:
+        return f'{timestamp[:4]}-Q{(int(timestamp[5:7]) + 2) // 3}'
+    return UNDATED
+
+
+class HistoryArchive:
+    """Reads and appends the segment files in one directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, kind, period):
+        return os.path.join(self.directory, f'{kind}-{period}.seg')
+
+    def append(self, kind, chunks):
+        """
+        Append chunks to their quarter's segment and sync them to disk.
+        `chunks` is a list of (period, rows); returns (offset, length) for
+        each, in the same order.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        locations = []
+        files = {}
+        try:
+            for period, rows in chunks:
+                f = files.get(period)
+                if f is None:
+                    f = files[period] = open(self.path(kind, period), 'ab')
+                data = zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), ZLIB_LEVEL)
+                offset = f.tell()
+                f.write(data)
+                locations.append((offset, len(data)))
+            # The live rows are deleted once this returns, so the chunks must be on disk first
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files.values():
+                f.close()
+        return locations
+
+    def read(self, kind, period, offset, length):
+        """The rows of one chunk, or [] (with a warning) if its segment is missing or damaged."""
+        try:
+            with open(self.path(kind, period), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            rows = json.loads(zlib.decompress(data))
+        except (OSError, zlib.error, ValueError) as e:
+            print(f"Warning: Could not read archived {kind} history of {period} at {offset}: {e}")
+            return []
+        metrics.inc('archive_read_bytes_total', length)
+        return rows
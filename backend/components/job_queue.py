@@ -0,0 +1,238 @@
+"""
+Bounded, SQLite-backed queue for grading jobs.
+
+A request enqueues a job and is answered right away with its id; a few
+background threads in each web process take jobs from the queue and store
+the result. Because job state lives in SQLite, any worker process can
+answer a status poll, whichever one accepted or ran the job.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import metrics
+from .shared_db import ThreadConnections, process_alive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    status_code INTEGER,
+    owner_pid INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+# Job states; 'done' jobs carry the handler's result and HTTP status code
+QUEUED, RUNNING, DONE = 'queued', 'running', 'done'
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting; `retry_after` is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many submissions are being graded right now, please try again shortly.")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Jobs are (kind, payload) pairs handled by the function registered for
+    their kind. A handler returns (result, status_code) and runs on one of
+    `workers` background threads per process, so grading never occupies more
+    than that many threads however many submissions arrive. At most
+    `max_depth` jobs may be queued or running at once across all processes.
+    """
+
+    def __init__(self, db_path, workers=2, max_depth=200, poll_interval=0.1,
+                 retention_seconds=3600, retry_after=2):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.retry_after = retry_after
+        self._handlers = {}
+        self._connections = ThreadConnections(db_path, SCHEMA)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers_pid = None
+
+    # --- Connections ---
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use."""
+        return self._connections.get()
+
+    # --- Submitting and reading jobs ---
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def submit(self, kind, payload):
+        """Queue a job and return its id; raises QueueFull when the queue is at capacity."""
+        self.start()
+        conn = self.connection()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            depth = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+            ).fetchone()[0]
+            if depth >= self.max_depth:
+                metrics.inc('jobs_rejected_total', kind=kind)
+                raise QueueFull(self.retry_after)
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(payload), now, now)
+            )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """The job as a dict, or None if it does not exist (or has expired)."""
+        row = self.connection().execute(
+            'SELECT id, kind, status, result, status_code, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            'job_id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'created_at': row[5],
+            'updated_at': row[6]
+        }
+        if row[2] == DONE:
+            job['result'] = json.loads(row[3])
+            job['status_code'] = row[4]
+        elif row[2] == QUEUED:
+            job['position'] = self.connection().execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?', (QUEUED, row[5])
+            ).fetchone()[0]
+        return job
+
+    def wait(self, job_id, timeout):
+        """Long-poll: return the job once it is done, or its current state after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        for job in self.watch(job_id, timeout):
+            if job is None or job['status'] == DONE or time.monotonic() >= deadline:
+                return job
+        return self.get(job_id)
+
+    def watch(self, job_id, timeout):
+        """Yield the job whenever its state changes, until it is done or `timeout` passes."""
+        self.start()
+        deadline = time.monotonic() + timeout
+        last_seen = None
+        while True:
+            job = self.get(job_id)
+            state = None if job is None else (job['status'], job.get('position'))
+            if state != last_seen:
+                last_seen = state
+                yield job
+            if job is None or job['status'] == DONE or time.monotonic() >= deadline:
+                return
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+    def depth(self):
+        """Number of jobs queued or running, across all processes."""
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+        ).fetchone()[0]
+
+    # --- Background workers ---
+
+    def start(self):
+        """Start this process's worker threads (once per process)."""
+        pid = os.getpid()
+        if self._workers_pid == pid:
+            return
+        with self._lock:
+            if self._workers_pid == pid:
+                return
+            self._workers_pid = pid
+            self._requeue_orphans()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work_loop, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+
+    def _requeue_orphans(self):
+        """Put back jobs that were running in a process that has since died."""
+        conn = self.connection()
+        for job_id, owner_pid in conn.execute(
+            'SELECT id, owner_pid FROM jobs WHERE status = ?', (RUNNING,)
+        ).fetchall():
+            if not process_alive(owner_pid):
+                conn.execute(
+                    'UPDATE jobs SET status = ?, owner_pid = NULL, updated_at = ? WHERE id = ? AND status = ?',
+                    (QUEUED, time.time(), job_id, RUNNING)
+                )
+
+    def _claim(self):
+        """Atomically take the oldest queued job, or return None."""
+        rows = self.connection().execute(
+            'UPDATE jobs SET status = ?, owner_pid = ?, updated_at = ? '
+            'WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) '
+            'RETURNING id, kind, payload',
+            (RUNNING, os.getpid(), time.time(), QUEUED)
+        ).fetchall()
+        # fetchall() runs the statement to completion, which commits and releases the write lock
+        return rows[0] if rows else None
+
+    def _finish(self, job_id, result, status_code):
+        self.connection().execute(
+            'UPDATE jobs SET status = ?, result = ?, status_code = ?, updated_at = ? WHERE id = ?',
+            (DONE, json.dumps(result), status_code, time.time(), job_id)
+        )
+
+    def _work_loop(self):
+        last_cleanup = 0.0
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    if time.monotonic() - last_cleanup > 60:
+                        last_cleanup = time.monotonic()
+                        self._delete_expired()
+                    # Woken early by submissions from this process; other processes' are found by polling
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self._run(*job)
+            except sqlite3.Error as e:
+                print(f"Warning: job queue error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _run(self, job_id, kind, payload):
+        handler = self._handlers.get(kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{kind}'")
+            result, status_code = handler(json.loads(payload))
+        except Exception as e:
+            result, status_code = {"error": f"Grading job failed: {str(e)}"}, 500
+        metrics.observe('job_run_seconds', time.perf_counter() - started, kind=kind)
+        self._finish(job_id, result, status_code)
+
+    def _delete_expired(self):
+        self.connection().execute(
+            'DELETE FROM jobs WHERE status = ? AND updated_at < ?',
+            (DONE, time.time() - self.retention_seconds)
+        )
+
@@ -0,0 +1,233 @@
+"""
+Process-local metrics with cross-worker aggregation, exported in the
+Prometheus text format.
+
+Every process records counters and histograms in memory. When a directory
+is configured, each process periodically writes a snapshot to
+`metrics-<pid>.json` in it, and a scrape merges the snapshots of all
+processes, so `/metrics` reports totals for every gunicorn worker no matter
+which worker answers. Without a directory only the current process is
+reported.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+from .shared_db import process_alive
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help); only these metrics are recorded and exported
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Time spent answering HTTP requests.'),
+    'data_file_read_seconds': ('histogram', 'Time spent reading and parsing JSON data files.'),
+    'data_file_read_bytes_total': ('counter', 'Bytes read from JSON data files.'),
+    'store_write_seconds': ('histogram', 'Time spent in submission store write transactions.'),
+    'store_write_bytes_total': ('counter', 'Bytes of records written to the submission store.'),
+    'store_read_seconds': ('histogram', 'Time spent in submission store queries.'),
+    'archive_read_bytes_total': ('counter', 'Compressed bytes of archived history read back.'),
+    'challenge_validation_seconds': ('histogram', 'Time spent matching challenge outputs, per challenge.'),
+    'search_query_seconds': ('histogram', 'Time spent answering full-text content searches.'),
+    'code_execution_seconds': ('histogram', 'Time spent running student code in the sandbox.'),
+    'grading_seconds': ('histogram', 'Time spent grading a submission, per problem.'),
+    'job_run_seconds': ('histogram', 'Time spent running background grading jobs.'),
+    'jobs_rejected_total': ('counter', 'Grading jobs refused because the queue was full.'),
+    'requests_throttled_total': ('counter', 'Code execution requests refused by a rate or concurrency limit.'),
+}
+
+
+class MetricsRegistry:
+    """Counters and histograms of one process."""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._last_flush = time.monotonic()
+
+    # --- Recording ---
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0] * (len(DEFAULT_BUCKETS) + 2)
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    # --- Cross-process snapshots ---
+
+    def snapshot(self):
+        """JSON-serializable copy of everything recorded by this process."""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self._histograms.items()]
+            }
+
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f'metrics-{pid or self.pid}.json')
+
+    def flush(self):
+        """Write this process's snapshot where the other workers can read it."""
+        self._last_flush = time.monotonic()
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path()
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        # Readers never see a half-written file
+        os.replace(temp_path, path)
+
+    def maybe_flush(self):
+        """Flush if the last snapshot is older than `flush_interval`."""
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def prune_dead_processes(self):
+        """Remove snapshots left behind by processes that no longer exist."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                pid = int(filename[len('metrics-'):-len('.json')])
+            except ValueError:
+                continue
+            if pid != self.pid and not process_alive(pid):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def collect(self):
+        """Merge the snapshots of every process (this one read live, not from disk)."""
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = os.path.basename(self._path())
+            for filename in os.listdir(self.directory):
+                if filename == own or not (filename.startswith('metrics-') and filename.endswith('.json')):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename), 'r') as f:
+                        snapshots.append(json.load(f))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get('counters', []):
+                key = (name, _label_key(dict(labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot.get('histograms', []):
+                key = (name, _label_key(dict(labels)))
+                merged = histograms.get(key)
+                histograms[key] = list(values) if merged is None else [a + b for a, b in zip(merged, values)]
+        return counters, histograms
+
+    # --- Export ---
+
+    def render(self):
+        """All metrics of all processes in the Prometheus text exposition format."""
+        self.flush()
+        # Workers that have exited (restarted or recycled by gunicorn) are not reported forever
+        self.prune_dead_processes()
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                # Buckets are recorded cumulatively, as Prometheus expects
+                for bound, count in zip(DEFAULT_BUCKETS, values):
+                    le = (('le', _format_value(bound)),)
+                    lines.append(f'{name}_bucket{_format_labels(labels + le)} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {values[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {values[-2]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(values[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+_directory = None
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def configure(directory):
+    """Set where processes share their snapshots, and drop those of dead processes."""
+    global _directory
+    _directory = directory
+    registry = get_registry()
+    registry.directory = directory
+    registry.prune_dead_processes()
+    return registry
+
+
+def get_registry():
+    """The metrics registry of this process (forked children start from zero)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None or _registry.pid != os.getpid():
+            _registry = MetricsRegistry(_directory)
+        return _registry
+
+
+def inc(name, value=1, **labels):
+    get_registry().inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    get_registry().observe(name, value, **labels)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Observe the duration of a block (or, used as a decorator, of every call)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
@@ -0,0 +1,138 @@
+"""
+Precompiled output matchers for challenge validation.
+
+Every test case gets a CaseMatcher when the content loads. The expected side
+(normalized text, numbers, significant words) is computed once, so
+validating a submission only has to tokenize the student's output.
+
+A test case can pick its rule explicitly with a `matchRules` object in
+challenges.json; otherwise the rule is inferred from the expected output:
+
+    {"type": "exact"}
+    {"type": "keywords", "groups": [{"label": "name", "any": ["name"]},
+                                    {"label": "age", "any": ["age"], "pattern": "[1-9]"}],
+     "min_length": 21, "length_label": "complete output"}
+    {"type": "numbers", "min_common": 2}
+    {"type": "similarity", "threshold": 0.8, "min_words": 3, "min_length": 10}
+"""
+import re
+
+NUMBER_RE = re.compile(r'\d+')
+WORD_RE = re.compile(r'\b\w+\b')
+
+# Words that carry no meaning when comparing sentences
+COMMON_WORDS = frozenset({
+    'the', 'a', 'an', 'is', 'are', 'was', 'were', 'to', 'of', 'and', 'or', 'but',
+    'in', 'on', 'at', 'for', 'with', 'by', 'my', 'i', 'am'
+})
+
+# Rule used for introduction challenges (name, age and hobby must all be present)
+INTRODUCTION_RULE = {
+    'type': 'keywords',
+    'groups': [
+        {'label': 'name', 'any': ['name']},
+        # Any age written as a number counts, e.g. "I am 10"
+        {'label': 'age', 'any': ['age', 'years old'], 'pattern': '[1-9]'},
+        {'label': 'hobby', 'any': ['hobby', 'love', 'favorite']}
+    ],
+    'min_length': 21,
+    'length_label': 'complete output'
+}
+NUMBERS_RULE = {'type': 'numbers', 'min_common': 2}
+SIMILARITY_RULE = {'type': 'similarity', 'threshold': 0.8, 'min_words': 3, 'min_length': 10}
+
+
+def normalize_output(text):
+    """Remove surrounding whitespace and unify line endings."""
+    return text.strip().replace('\r\n', '\n').replace('\r', '\n')
+
+
+def infer_rule(expected_normalized):
+    """Pick the flexible rule for a test case from its expected output."""
+    expected_lower = expected_normalized.lower()
+    if 'name' in expected_lower or 'age' in expected_lower or 'hobby' in expected_lower:
+        return INTRODUCTION_RULE
+    if any(op in expected_lower for op in ['sum', 'difference', 'product', 'larger']):
+        return NUMBERS_RULE
+    return SIMILARITY_RULE
+
+
+def _significant_words(text_lower):
+    return set(WORD_RE.findall(text_lower)) - COMMON_WORDS
+
+
+class CaseMatcher:
+    """Checks actual outputs against one test case's expected output."""
+
+    def __init__(self, expected_output, rules=None):
+        self.expected = normalize_output(expected_output)
+        rule = dict(rules or infer_rule(self.expected))
+        self.kind = rule.get('type', 'similarity')
+        self.min_length = rule.get('min_length', 0)
+
+        if self.kind == 'keywords':
+            self.groups = [
+                (group['label'], tuple(group.get('any', [])),
+                 re.compile(group['pattern']) if group.get('pattern') else None)
+                for group in rule.get('groups', [])
+            ]
+            self.length_label = rule.get('length_label', 'complete output')
+        elif self.kind == 'numbers':
+            self.expected_numbers = frozenset(NUMBER_RE.findall(self.expected))
+            self.min_common = rule.get('min_common', 2)
+        elif self.kind == 'similarity':
+            self.expected_words = frozenset(_significant_words(self.expected.lower()))
+            self.threshold = rule.get('threshold', 0.8)
+            self.min_words = rule.get('min_words', 3)
+
+    def match(self, actual_output):
+        """
+        Returns (is_passed, missing_parts). `missing_parts` lists what a
+        keyword rule could not find, and is None for every other rule.
+        """
+        actual = normalize_output(actual_output)
+
+        # Try exact match first
+        if actual == self.expected:
+            return True, None
+
+        if self.kind == 'keywords':
+            actual_lower = actual.lower()
+            missing_parts = [
+                label for label, keywords, pattern in self.groups
+                if not (any(k in actual_lower for k in keywords) or (pattern and pattern.search(actual_lower)))
+            ]
+            # The output should also be substantial, not just the keywords
+            if len(actual) < self.min_length:
+                missing_parts.append(self.length_label)
+            if not missing_parts:
+                return True, None
+            return False, missing_parts
+
+        if self.kind == 'numbers':
+            # If key numbers match (like sum, product results), consider passed
+            actual_numbers = set(NUMBER_RE.findall(actual))
+            passed = bool(self.expected_numbers and actual_numbers
+                          and len(self.expected_numbers & actual_numbers) >= self.min_common)
+            return passed, None
+
+        if self.kind == 'similarity':
+            # Only apply flexible validation if output is substantial
+            if len(actual) < self.min_length:
+                return False, None
+            actual_words = _significant_words(actual.lower())
+            if self.expected_words and actual_words and len(actual_words) >= self.min_words:
+                overlap = len(self.expected_words & actual_words)
+                return overlap / len(self.expected_words) >= self.threshold, None
+            return False, None
+
+        # 'exact' (or an unknown rule type) only accepts the exact output
+        return False, None
+
+
+def compile_challenge(challenge):
+    """Build one matcher per test case of a challenge, in test case order."""
+    return [
+        CaseMatcher(test_case.get('expectedOutput', ''), test_case.get('matchRules'))
+        for test_case in challenge.get('testCases', [])
+    ]
@@ -0,0 +1,287 @@
+"""
+Static pre-flight check of student code, done before it is sent to a runner.
+
+`analyze` parses a submission once and returns its problems, and whether
+it is bounded:
+- Problems are syntax errors, imports or calls this site does not allow,
+  and `while True:` loops that can never stop. They are reported with line
+  numbers and wording meant for kids, and such code never takes a runner.
+- A bounded program has no while loops or recursion and only loops of a
+  known, small length, so the executor gives it a shorter time budget.
+
+Results are cached per process by a hash of the source, so repeated
+submissions (starter code, "Run" pressed again) are not parsed twice, and
+`compiled` does the same for the code objects runners execute. This check
+only catches honest mistakes early. The sandbox is still what keeps a
+determined program contained.
+"""
+import ast
+import hashlib
+
+from .result_cache import ResultCache
+
+# Modules that give a program access to the server rather than to Python
+FORBIDDEN_MODULES = frozenset({
+    'builtins', 'ctypes', 'glob', 'http', 'importlib', 'marshal', 'multiprocessing', 'os',
+    'pathlib', 'pickle', 'pty', 'resource', 'shutil', 'signal', 'socket', 'subprocess',
+    'sysconfig', 'tempfile', 'threading', 'urllib'
+})
+FORBIDDEN_CALLS = frozenset({'__import__', 'breakpoint', 'compile', 'eval', 'exec', 'open'})
+# Attributes used to climb out of a restricted namespace
+FORBIDDEN_ATTRIBUTES = frozenset({
+    '__bases__', '__builtins__', '__code__', '__globals__', '__mro__', '__subclasses__'
+})
+
+# Programs without while loops or recursion whose for loops all have a known length,
+# totalling at most this many iterations, are given a shorter time budget
+BOUNDED_ITERATIONS = 100000
+BOUNDED_PROGRAM_SECONDS = 1.0
+
+_analyses = ResultCache(max_entries=1024)
+_code_objects = ResultCache(max_entries=1024)
+
+
+class Preflight:
+    """The outcome of `analyze`: `problems` (empty when the code may run) and whether it is `bounded`."""
+
+    def __init__(self, problems, bounded=False):
+        self.problems = problems
+        self.bounded = bounded
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def message(self):
+        """All problems as one kid-friendly message, one per line."""
+        return '\n'.join(problem['message'] for problem in self.problems)
+
+    def time_budget(self, default):
+        """Seconds the executor should allow: less than `default` for code that must finish quickly."""
+        if self.bounded:
+            return min(default, BOUNDED_PROGRAM_SECONDS)
+        return default
+
+
+def source_hash(code):
+    return hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def analyze(code):
+    """Check `code` without running it; returns a (cached) Preflight."""
+    key = source_hash(code)
+    cached = _analyses.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:
+        result = Preflight([_syntax_problem(e)])
+    else:
+        visitor = _Checker()
+        visitor.visit(tree)
+        if not visitor.problems:
+            try:
+                # Only to find errors; the runner compiles the code again in its own process
+                compile(code, '<string>', 'exec')
+            except (SyntaxError, ValueError) as e:
+                # e.g. `return` outside a function, which only the compiler notices
+                visitor.problems.append(_syntax_problem(e))
+        visitor.problems.sort(key=lambda problem: (problem['line'] or 0, problem['column'] or 0))
+        result = Preflight(visitor.problems, visitor.bounded())
+    _analyses.put(key, result)
+    return result
+
+
+def compiled(code):
+    """The code object for `code`, compiled once per process; raises SyntaxError like compile()."""
+    key = source_hash(code)
+    code_object = _code_objects.get(key)
+    if code_object is None:
+        code_object = compile(code, '<string>', 'exec')
+        _code_objects.put(key, code_object)
+    return code_object
+
+
+def _problem(kind, node, message):
+    line = getattr(node, 'lineno', None)
+    column = getattr(node, 'col_offset', None)
+    return {
+        'kind': kind,
+        'line': line,
+        'column': column + 1 if column is not None else None,
+        'message': f"Line {line}: {message}" if line else message
+    }
+
+
+def _syntax_problem(error):
+    line = getattr(error, 'lineno', None)
+    column = getattr(error, 'offset', None)
+    detail = getattr(error, 'msg', None) or str(error)
+    message = f"Python couldn't understand this line ({detail})."
+    if isinstance(error, IndentationError):
+        message = f"The spaces at the start of this line don't line up ({detail})."
+    return {
+        'kind': 'syntax',
+        'line': line,
+        'column': column,
+        'message': f"Line {line}: {message}" if line else message
+    }
+
+
+def _is_always_true(test):
+    return isinstance(test, ast.Constant) and bool(test.value)
+
+
+def _loop_length(iterable):
+    """Number of iterations of `for ... in iterable`, or None if it can't be known statically."""
+    if isinstance(iterable, (ast.List, ast.Tuple, ast.Set)):
+        return len(iterable.elts)
+    if isinstance(iterable, ast.Constant) and isinstance(iterable.value, (str, bytes)):
+        return len(iterable.value)
+    if (isinstance(iterable, ast.Call) and isinstance(iterable.func, ast.Name)
+            and iterable.func.id == 'range' and not iterable.keywords and 1 <= len(iterable.args) <= 3):
+        args = [arg.value if isinstance(arg, ast.Constant) and type(arg.value) is int else None
+                for arg in iterable.args]
+        if None not in args and (len(args) < 3 or args[2] != 0):
+            return len(range(*args))
+    return None
+
+
+class _Checker(ast.NodeVisitor):
+    """Collects problems and loop bounds in one walk of the tree."""
+
+    def __init__(self):
+        self.problems = []
+        self.while_loops = 0
+        self.recursive_functions = []
+        self.max_iterations = 1     # largest product of nested known loop lengths
+        self.unknown_loops = False
+        self._multipliers = [1]     # known iterations of the enclosing loops, or None
+        self._functions = []        # names of the enclosing function definitions
+
+    def bounded(self):
+        return (not self.while_loops and not self.recursive_functions and not self.unknown_loops
+                and self.max_iterations <= BOUNDED_ITERATIONS)
+
+    # --- Imports and calls ---
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._check_module(node, alias.name, f"import {alias.name}")
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.module and not node.level:
+            self._check_module(node, node.module, f"from {node.module} import ...")
+        self.generic_visit(node)
+
+    def _check_module(self, node, module, statement):
+        top_level = module.split('.')[0]
+        if top_level in FORBIDDEN_MODULES:
+            self.problems.append(_problem(
+                'policy', node,
+                f"`{statement}` isn't allowed here. Programs on this site can't use the {top_level} module."
+            ))
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name):
+            name = node.func.id
+            if name in FORBIDDEN_CALLS:
+                self.problems.append(_problem('policy', node, f"`{name}()` isn't allowed here."))
+            elif name == 'range':
+                # Also catches sum(range(10**9)) and friends, which loop without a loop statement
+                length = _loop_length(node)
+                if length is None or length > BOUNDED_ITERATIONS:
+                    self.unknown_loops = True
+            if name in self._functions[-1:] and name not in self.recursive_functions:
+                self.recursive_functions.append(name)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if node.attr in FORBIDDEN_ATTRIBUTES:
+            self.problems.append(_problem('policy', node, f"`.{node.attr}` isn't allowed here."))
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id in FORBIDDEN_ATTRIBUTES:
+            self.problems.append(_problem('policy', node, f"`{node.id}` isn't allowed here."))
+
+    # --- Loops and functions ---
+
+    def visit_For(self, node):
+        self._visit_loop(node, _loop_length(node.iter))
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node):
+        self.while_loops += 1
+        if _is_always_true(node.test) and not _can_leave(node):
+            self.problems.append(_problem(
+                'unbounded', node,
+                "This `while True:` loop never stops, because nothing inside it can end it. "
+                "Add a `break` so your program can finish."
+            ))
+        self._visit_loop(node, None)
+
+    def visit_comprehension(self, node):
+        if _loop_length(node.iter) is None:
+            self.unknown_loops = True
+        self.generic_visit(node)
+
+    def _visit_loop(self, node, length):
+        # A loop in a function runs again on every call, so its total is unknown too
+        if length is None or self._functions:
+            self.unknown_loops = True
+        self._multipliers.append(length)
+        known = [m for m in self._multipliers if m is not None]
+        iterations = 1
+        for multiplier in known:
+            iterations *= multiplier
+        self.max_iterations = max(self.max_iterations, iterations)
+        self.generic_visit(node)
+        self._multipliers.pop()
+
+    def visit_FunctionDef(self, node):
+        self._functions.append(node.name)
+        self.generic_visit(node)
+        self._functions.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+
+def _can_leave(loop):
+    """
+    Whether anything in a loop's body might end it. Only a body that certainly
+    can't is reported; anything that could leave the loop, suspend it or raise
+    an error counts, and the sandbox's time limit deals with the rest.
+    """
+    stack = list(loop.body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Break) or _may_leave(node):
+            return True
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            # A break in an inner loop only ends that loop, but everything else in it still counts
+            if any(_may_leave(child) for child in ast.walk(node)):
+                return True
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def _may_leave(node):
+    """
+    Whether `node` returns, raises (including a failing assert), suspends the
+    loop (yield, await) or may raise an error: any call but print() (input()
+    ends the program with EOFError once the test input runs out), indexing
+    and division.
+    """
+    if isinstance(node, (ast.Return, ast.Raise, ast.Assert, ast.Yield, ast.YieldFrom, ast.Await, ast.Subscript)):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+        return True
+    return isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id == 'print')
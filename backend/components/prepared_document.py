@@ -0,0 +1,21 @@
+import gzip
+import hashlib
+import json
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 256
+
+
+class PreparedDocument:
+    """
+    A JSON response body serialized once, with a gzip variant and a strong ETag.
+
+    The ETag is a hash of the body, so it only changes when the content does
+    and is identical across workers.
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        # mtime=0 keeps the compressed bytes identical across workers and restarts
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0) if len(self.body) >= GZIP_MIN_BYTES else None
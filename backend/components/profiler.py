@@ -0,0 +1,181 @@
+"""
+Opt-in execution profiling of student code.
+
+A profiled run counts how often each line of the student's program runs
+(with `sys.settrace`), measures its wall and CPU time, and records its peak
+memory (with `tracemalloc`). The result is a compact profile that goes back
+with the run's output: the total number of steps and the few hottest lines.
+The hottest lines show a kid where their program spends its time.
+
+Tracing makes code several times slower, so it only happens when a request
+asks for it. Unprofiled runs never reach this module.
+
+`ProfileStats` keeps per-test-case aggregates of profiled runs in SQLite, so
+operators can spot the problems and test inputs that cost the most and tune
+the limits to fit them.
+"""
+import sys
+import time
+import tracemalloc
+
+from .shared_db import ThreadConnections
+
+# The filename preflight.compiled gives student code; frames of other files are not traced
+STUDENT_FILENAME = '<string>'
+
+# Lines listed in a profile, and the longest line text shown for each
+HOT_LINES = 5
+HOT_LINE_TEXT_CHARS = 80
+
+
+class ExecutionProfiler:
+    """
+    Profiles one run: `run(code_object, namespace)` executes the program
+    with tracing on (or call `start()` and `stop()` around it), then
+    `summary()` describes it.
+    """
+
+    def __init__(self):
+        self.line_counts = {}
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_memory_bytes = 0
+        self._started = None
+
+    def run(self, code_object, namespace):
+        """exec() the program under the profiler; exceptions propagate as usual."""
+        self.start()
+        try:
+            exec(code_object, namespace)
+        finally:
+            self.stop()
+
+    def start(self):
+        self._started = (time.perf_counter(), time.process_time())
+        tracemalloc.start()
+        sys.settrace(self._trace_call)
+
+    def stop(self):
+        sys.settrace(None)
+        if self._started is None:
+            return
+        wall_started, cpu_started = self._started
+        self._started = None
+        self.wall_seconds = time.perf_counter() - wall_started
+        self.cpu_seconds = time.process_time() - cpu_started
+        self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def _trace_call(self, frame, event, arg):
+        # Only the student's own frames get a line tracer; library code runs at full speed
+        if frame.f_code.co_filename == STUDENT_FILENAME:
+            return self._trace_line
+        return None
+
+    def _trace_line(self, frame, event, arg):
+        if event == 'line':
+            counts = self.line_counts
+            line = frame.f_lineno
+            counts[line] = counts.get(line, 0) + 1
+        return self._trace_line
+
+    def summary(self, source=None):
+        """
+        The compact profile: `steps` (lines executed), `wall_ms`, `cpu_ms`,
+        `peak_memory_bytes` and the `hot_lines` that ran most, each with its
+        `line` number, `count` and, when `source` is given, its `text`.
+        """
+        source_lines = source.splitlines() if source else []
+        hottest = sorted(self.line_counts.items(), key=lambda item: (-item[1], item[0]))[:HOT_LINES]
+        hot_lines = []
+        for line, count in hottest:
+            hot_line = {'line': line, 'count': count}
+            if 0 < line <= len(source_lines):
+                hot_line['text'] = source_lines[line - 1].strip()[:HOT_LINE_TEXT_CHARS]
+            hot_lines.append(hot_line)
+        return {
+            'steps': sum(self.line_counts.values()),
+            'wall_ms': round(self.wall_seconds * 1000, 2),
+            'cpu_ms': round(self.cpu_seconds * 1000, 2),
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'hot_lines': hot_lines
+        }
+
+
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile_stats (
+    problem_key TEXT NOT NULL,
+    test_index INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    timeouts INTEGER NOT NULL,
+    total_steps INTEGER NOT NULL,
+    max_steps INTEGER NOT NULL,
+    total_cpu_ms REAL NOT NULL,
+    max_cpu_ms REAL NOT NULL,
+    max_peak_memory_bytes INTEGER NOT NULL,
+    PRIMARY KEY (problem_key, test_index)
+) WITHOUT ROWID;
+"""
+
+
+class ProfileStats:
+    """
+    Aggregates of profiled runs per test case, shared by all workers through
+    SQLite. Like FailureHistory, `problem_key` should include a hash of the
+    test cases, so edited cases start with fresh numbers.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connections = ThreadConnections(db_path, STATS_SCHEMA)
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use."""
+        return self._connections.get()
+
+    def record(self, problem_key, runs):
+        """
+        Fold in one profiled grading; `runs` maps each test index that ran to
+        its profile, or to None when the case timed out before it had one.
+        """
+        rows = []
+        for index, profile in runs.items():
+            if profile is None:
+                rows.append((problem_key, index, 1, 0, 0, 0.0, 0.0, 0))
+            else:
+                rows.append((problem_key, index, 0, profile['steps'], profile['steps'],
+                             profile['cpu_ms'], profile['cpu_ms'], profile['peak_memory_bytes']))
+        if not rows:
+            return
+        self.connection().executemany(
+            'INSERT INTO profile_stats (problem_key, test_index, runs, timeouts, total_steps, max_steps, '
+            'total_cpu_ms, max_cpu_ms, max_peak_memory_bytes) VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (problem_key, test_index) DO UPDATE SET '
+            'runs = runs + 1, timeouts = timeouts + excluded.timeouts, '
+            'total_steps = total_steps + excluded.total_steps, max_steps = MAX(max_steps, excluded.max_steps), '
+            'total_cpu_ms = total_cpu_ms + excluded.total_cpu_ms, max_cpu_ms = MAX(max_cpu_ms, excluded.max_cpu_ms), '
+            'max_peak_memory_bytes = MAX(max_peak_memory_bytes, excluded.max_peak_memory_bytes)',
+            rows
+        )
+
+    def cases(self, problem_key):
+        """Aggregates per test index, in index order; averages cover the runs that didn't time out."""
+        rows = self.connection().execute(
+            'SELECT test_index, runs, timeouts, total_steps, max_steps, total_cpu_ms, max_cpu_ms, '
+            'max_peak_memory_bytes FROM profile_stats WHERE problem_key = ? ORDER BY test_index',
+            (problem_key,)
+        ).fetchall()
+        cases = []
+        for index, runs, timeouts, total_steps, max_steps, total_cpu_ms, max_cpu_ms, peak in rows:
+            finished = runs - timeouts
+            cases.append({
+                'test_index': index,
+                'runs': runs,
+                'timeouts': timeouts,
+                'avg_steps': round(total_steps / finished) if finished else None,
+                'max_steps': max_steps,
+                'avg_cpu_ms': round(total_cpu_ms / finished, 2) if finished else None,
+                'max_cpu_ms': round(max_cpu_ms, 2),
+                'max_peak_memory_bytes': peak
+            })
+        return cases
@@ -0,0 +1,204 @@
+"""
+Admission control for the endpoints that run or grade student code.
+
+Each client gets a token bucket per user id and per IP address, and a
+global cap limits how many executions run at once. The buckets and the
+running executions live in SQLite, so every gunicorn worker (and the
+freecode and autograder servers, when they share a database file) enforces
+the same limits. Requests over a limit are refused straight away with a
+`retry_after`, instead of queueing behind the kid mashing "Run".
+"""
+import contextlib
+import os
+import time
+import uuid
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from . import metrics
+from .shared_db import ThreadConnections, process_alive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS execution_leases (
+    id TEXT PRIMARY KEY,
+    owner_pid INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Default (requests per minute, burst) for each kind of client key. An IP is
+# often a whole classroom behind one router, so it gets a much larger bucket.
+DEFAULT_LIMITS = {
+    'user': (30, 10),
+    'ip': (300, 60)
+}
+
+
+class RateLimited(Exception):
+    """Raised when a request is over a limit; `retry_after` is in whole seconds."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RateLimiter:
+    """
+    `admit(keys)` lets a request through if every one of its (kind, value)
+    keys has a token left and fewer than `max_concurrent` executions are
+    running; otherwise it raises RateLimited and takes nothing. A running
+    execution holds a lease that is returned when it finishes, or that
+    expires after `lease_seconds` if its process died first.
+    """
+
+    def __init__(self, db_path, limits=None, max_concurrent=8, lease_seconds=60, enabled=True):
+        self.db_path = db_path
+        # kind -> (tokens added per second, bucket size)
+        self.limits = {kind: (per_minute / 60.0, burst)
+                       for kind, (per_minute, burst) in (limits or DEFAULT_LIMITS).items()}
+        self.max_concurrent = max_concurrent
+        self.lease_seconds = lease_seconds
+        self.enabled = enabled
+        self._connections = ThreadConnections(db_path, SCHEMA)
+        self._last_cleanup = 0.0
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use."""
+        return self._connections.get()
+
+    @contextlib.contextmanager
+    def admit(self, keys, concurrent=True):
+        """
+        Hold an admission for the duration of the block. With
+        `concurrent=False` only the token buckets are checked, for requests
+        that hand the work to a queue instead of running it themselves.
+        """
+        lease_id = self.acquire(keys, concurrent)
+        try:
+            yield
+        finally:
+            self.release(lease_id)
+
+    def acquire(self, keys, concurrent=True):
+        """Take a token from each key's bucket (and a lease); returns the lease id or None."""
+        if not self.enabled:
+            return None
+        keys = [(kind, value) for kind, value in keys if value is not None and kind in self.limits]
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            buckets = []
+            for kind, value in keys:
+                rate, burst = self.limits[kind]
+                key = f'{kind}:{value}'
+                row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    metrics.inc('requests_throttled_total', reason=kind)
+                    raise RateLimited("You're sending code too quickly. Please wait a moment and try again.",
+                                      _whole_seconds((1 - tokens) / rate), kind)
+                buckets.append((key, tokens))
+
+            lease_id = None
+            if concurrent:
+                conn.execute('DELETE FROM execution_leases WHERE expires_at < ?', (now,))
+                running = conn.execute('SELECT COUNT(*) FROM execution_leases').fetchone()[0]
+                if running >= self.max_concurrent:
+                    running -= self._delete_orphaned_leases(conn)
+                if running >= self.max_concurrent:
+                    metrics.inc('requests_throttled_total', reason='concurrency')
+                    raise RateLimited("Too much code is running right now. Please try again in a moment.",
+                                      1, 'concurrency')
+                lease_id = uuid.uuid4().hex
+                conn.execute('INSERT INTO execution_leases (id, owner_pid, expires_at) VALUES (?, ?, ?)',
+                             (lease_id, os.getpid(), now + self.lease_seconds))
+
+            conn.executemany(
+                'INSERT INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                [(key, tokens - 1, now) for key, tokens in buckets]
+            )
+            if now - self._last_cleanup > 60:
+                self._last_cleanup = now
+                self._delete_full_buckets(conn, now)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return lease_id
+
+    def release(self, lease_id):
+        if lease_id is not None:
+            self.connection().execute('DELETE FROM execution_leases WHERE id = ?', (lease_id,))
+
+    def running(self):
+        """Number of executions currently holding a lease, across all processes."""
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM execution_leases WHERE expires_at >= ?', (time.time(),)
+        ).fetchone()[0]
+
+    def _delete_orphaned_leases(self, conn):
+        """Free the leases of processes that died mid-execution; returns how many."""
+        deleted = 0
+        for lease_id, owner_pid in conn.execute('SELECT id, owner_pid FROM execution_leases').fetchall():
+            if not process_alive(owner_pid):
+                conn.execute('DELETE FROM execution_leases WHERE id = ?', (lease_id,))
+                deleted += 1
+        return deleted
+
+    def _delete_full_buckets(self, conn, now):
+        # A bucket left alone long enough is full again, which is what a missing row means
+        slowest = min(rate / burst for rate, burst in self.limits.values()) if self.limits else 1
+        conn.execute('DELETE FROM rate_buckets WHERE updated_at < ?', (now - 1 / slowest,))
+
+
+def parse_limit(text):
+    """Parse a "<requests per minute>/<burst>" setting such as "30/10"."""
+    per_minute, _, burst = text.partition('/')
+    per_minute = float(per_minute)
+    return per_minute, int(burst) if burst else max(1, int(per_minute))
+
+
+def limiter_from_env(default_db_path):
+    """
+    A RateLimiter configured like the main app, from the RATE_LIMITING,
+    RATE_LIMIT_DB, RATE_LIMIT_USER, RATE_LIMIT_IP and MAX_CONCURRENT_EXECUTIONS
+    environment variables (for the standalone code runner servers).
+    """
+    return RateLimiter(
+        os.getenv('RATE_LIMIT_DB', default_db_path),
+        limits={'user': parse_limit(os.getenv('RATE_LIMIT_USER', '30/10')),
+                'ip': parse_limit(os.getenv('RATE_LIMIT_IP', '300/60'))},
+        max_concurrent=int(os.getenv('MAX_CONCURRENT_EXECUTIONS', '8')),
+        enabled=os.getenv('RATE_LIMITING', 'true').lower() in ('1', 'true', 'yes')
+    )
+
+
+def client_keys(user_id, ip_address):
+    """The rate limit keys of a request: its user id (if it sent one) and its IP address."""
+    return [('user', user_id), ('ip', ip_address)]
+
+
+def trust_proxies(wsgi_app, hops):
+    """
+    Wrap `wsgi_app` so `request.remote_addr` is the client's address from
+    X-Forwarded-For, trusting that header from `hops` reverse proxies (such
+    as nginx). Without this every request behind a proxy comes from the
+    proxy's address and all clients share one IP bucket. With 0 hops the
+    header is ignored, since a client could set it to anything.
+    """
+    if hops <= 0:
+        return wsgi_app
+    return ProxyFix(wsgi_app, x_for=hops, x_proto=hops)
+
+
+def _whole_seconds(seconds):
+    return max(1, int(seconds + 0.999))
+
@@ -0,0 +1,65 @@
+import ast
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(value):
+    """Stable hash of any JSON-serializable value (e.g. a list of test cases)."""
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def normalized_code_hash(code):
+    """
+    Hash of a submission that ignores comments, blank lines and formatting.
+    Code that does not parse falls back to a hash of its stripped source.
+    """
+    try:
+        normalized = ast.dump(ast.parse(code), include_attributes=False)
+    except (SyntaxError, ValueError):
+        normalized = '\n'.join(line.rstrip() for line in code.strip().splitlines())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with a time-to-live, shared by the request threads of a worker.
+
+    Keys should include a version hash of whatever the result depends on
+    (e.g. the test cases), so that changed content simply stops matching.
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,465 @@
+"""
+Pre-forked pool of sandboxed worker processes for running student code.
+
+The web process never calls exec() itself. Jobs are handed to long-lived
+worker processes that apply resource limits to themselves (memory, CPU,
+file size), run one job at a time and are recycled after a number of jobs.
+A worker that blows its wall-clock budget is killed and replaced, so a
+`while True:` loop or a memory hog can only ever take down its own worker.
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from .preflight import compiled
+from .profiler import STUDENT_FILENAME, ExecutionProfiler
+
+try:
+    import resource
+except ImportError:  # Windows has no rlimits; limits fall back to wall-clock only
+    resource = None
+
+DEFAULT_LIMITS = {
+    'wall_seconds': 5.0,        # killed by the parent after this long
+    'cpu_seconds': 3,           # SIGXCPU inside the worker after this much CPU time
+    'memory_bytes': 256 * 1024 * 1024,
+    'file_bytes': 1024 * 1024,  # largest file a program may write
+    'output_bytes': 64 * 1024,  # stdout/stderr captured per job
+    'max_jobs': 50              # jobs before a worker is recycled
+}
+
+
+class SandboxError(Exception):
+    """Raised in the web process when a job could not be completed."""
+
+
+class ExecutionTimeout(SandboxError):
+    """The job ran past its wall-clock budget and its worker was killed."""
+
+
+class PoolBusy(SandboxError):
+    """No worker became free in time to accept the job."""
+
+
+class CPUTimeExceeded(BaseException):
+    # BaseException so that a student's `except Exception:` cannot swallow it
+    pass
+
+
+class OutputLimitExceeded(BaseException):
+    pass
+
+
+# Appended to output that was cut off at the byte cap
+TRUNCATION_MARKER = "\n... output truncated: your program printed too much ...\n"
+
+
+# --- Inside the worker process ---
+
+_limits = dict(DEFAULT_LIMITS)
+_job_conn = None
+
+
+def current_limits():
+    """The limits of the worker process the current job is running in."""
+    return _limits
+
+
+def emit(kind, data):
+    """Send a progress event (e.g. a chunk of stdout) to the web process mid-job."""
+    _job_conn.send(('event', (kind, data)))
+
+
+def _on_sigxcpu(signum, frame):
+    raise CPUTimeExceeded()
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _apply_process_limits(limits):
+    if resource is None:
+        return
+    for name, value in ((resource.RLIMIT_AS, limits['memory_bytes']),
+                        (resource.RLIMIT_FSIZE, limits['file_bytes'])):
+        if value:
+            _, hard = resource.getrlimit(name)
+            resource.setrlimit(name, (value, hard))
+    # Oversized writes fail with an OSError instead of killing the worker
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+
+
+def arm_cpu_limit(seconds):
+    """The CPU rlimit is cumulative per process, so move it to 'now + budget' for each job."""
+    if resource is None or not seconds:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(_cpu_time()) + int(seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _disarm_cpu_limit():
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _worker_main(conn, limits):
+    global _job_conn
+    _job_conn = conn
+    _limits.update(limits)
+    _apply_process_limits(limits)
+
+    for _ in range(limits['max_jobs']):
+        try:
+            func, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        arm_cpu_limit(limits['cpu_seconds'])
+        try:
+            reply = ('ok', func(*args, **kwargs))
+        except BaseException as e:
+            reply = ('error', f"{type(e).__name__}: {e}")
+        finally:
+            _disarm_cpu_limit()
+
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            return
+    # Falling off the end recycles the worker; the parent starts a fresh one
+
+
+class CappedWriter(io.TextIOBase):
+    """
+    A text stream that keeps at most `limit` bytes (UTF-8). The write that
+    crosses the limit is cut short, followed by TRUNCATION_MARKER, and
+    stops the program by raising OutputLimitExceeded.
+    """
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.size = 0
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError(f"write() argument must be str, not {type(s).__name__}")
+        n = len(s) if s.isascii() else len(s.encode('utf-8', 'replace'))
+        if self.limit and self.size + n > self.limit:
+            kept = s.encode('utf-8', 'replace')[:self.limit - self.size].decode('utf-8', 'ignore')
+            self.size = self.limit
+            self._emit(kept + TRUNCATION_MARKER)
+            self.flush()
+            raise OutputLimitExceeded()
+        self.size += n
+        self._emit(s)
+        return len(s)
+
+    def _emit(self, s):
+        self._parts.append(s)
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+class _OutputSink:
+    """
+    Collects stdout/stderr chunks in the order they were written and forwards
+    them to the web process from a background thread every `flush_seconds`.
+
+    Only the flusher thread writes to the pipe, so a limit exception raised
+    in the program's (main) thread can never interrupt a half-sent message.
+    """
+
+    def __init__(self, flush_seconds=0.05):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pending = []  # [kind, [chunks]] in write order
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, kind, text):
+        with self._lock:
+            if self._pending and self._pending[-1][0] == kind:
+                self._pending[-1][1].append(text)
+            else:
+                self._pending.append([kind, [text]])
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for kind, chunks in pending:
+            emit(kind, ''.join(chunks))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self._flush()
+        self._flush()
+
+    def close(self):
+        """Send whatever is left and stop the flusher thread."""
+        self._stop.set()
+        self._thread.join()
+
+
+class StreamingWriter(CappedWriter):
+    """
+    A CappedWriter that hands output to an _OutputSink instead of keeping it,
+    so a long-running program's memory use stays flat.
+    """
+
+    def __init__(self, kind, limit, sink):
+        super().__init__(limit)
+        self.kind = kind
+        self.sink = sink
+
+    def _emit(self, s):
+        if s:
+            self.sink.add(self.kind, s)
+
+    def getvalue(self):
+        return ''
+
+
+def execute_code(code, stdin_text='', profile=False):
+    """
+    Job: run a program with the given stdin and capture its output.
+
+    Returns stdout, stderr (with a traceback for runtime errors) and, when the
+    program failed, the error message in `error`. With `profile` the program
+    is traced and its profile (see profiler.py) is returned in `profile`.
+    """
+    limits = current_limits()
+    stdin = io.StringIO(stdin_text)
+    stdout = CappedWriter(limits['output_bytes'])
+    stderr = CappedWriter(limits['output_bytes'])
+    profiler = ExecutionProfiler() if profile else None
+    error = _exec_captured(code, stdin, stdout, stderr, profiler)
+
+    result = {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+    if profiler is not None:
+        result['profile'] = profiler.summary(code)
+    if error is not None:
+        result['error'] = error
+        if not result['stderr']:
+            result['stderr'] = error + '\n'
+    return result
+
+
+def stream_code(code, stdin_text='', profile=False):
+    """
+    Job: like execute_code, but stdout/stderr are sent to the web process as
+    'stdout'/'stderr' events while the program runs. Returns only the error
+    (and the profile, with `profile`).
+    """
+    limits = current_limits()
+    sink = _OutputSink()
+    stdout = StreamingWriter('stdout', limits['output_bytes'], sink)
+    stderr = StreamingWriter('stderr', limits['output_bytes'], sink)
+    profiler = ExecutionProfiler() if profile else None
+    try:
+        error = _exec_captured(code, io.StringIO(stdin_text), stdout, stderr, profiler)
+    finally:
+        sink.close()
+    result = {'error': error} if error is not None else {}
+    if profiler is not None:
+        result['profile'] = profiler.summary(code)
+    return result
+
+
+def _exec_captured(code, stdin, stdout, stderr, profiler=None):
+    """
+    Run code with redirected streams; returns a kid-friendly error message or None.
+    With a `profiler` the program is run (and traced) by it.
+    """
+    try:
+        # Compiled once per worker, so "Run" pressed again on the same code skips the compiler
+        code_object = compiled(code)
+    except (SyntaxError, ValueError) as e:
+        with contextlib.suppress(OutputLimitExceeded):
+            traceback.print_exception(type(e), e, None, file=stderr)
+        return str(e)
+
+    error = None
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr), _redirect_stdin(stdin):
+            if profiler is None:
+                exec(code_object, {'__name__': '__main__'})
+            else:
+                profiler.run(code_object, {'__name__': '__main__'})
+    except CPUTimeExceeded:
+        error = "Your program used too much CPU time. Is there a loop that never stops?"
+    except OutputLimitExceeded:
+        error = "Your program printed too much output, so it was stopped."
+    except MemoryError:
+        error = "Your program used too much memory."
+    except BaseException as e:
+        # Capture traceback if any runtime error, starting at the student's code
+        error = str(e)
+        with contextlib.suppress(OutputLimitExceeded):
+            traceback.print_exception(type(e), e, _student_traceback(e.__traceback__), file=stderr)
+    return error
+
+
+def _student_traceback(tb):
+    """Skip the frames above the student's code (this module's, and the profiler's when profiling)."""
+    while tb is not None and tb.tb_frame.f_code.co_filename != STUDENT_FILENAME:
+        tb = tb.tb_next
+    return tb
+
+
+@contextlib.contextmanager
+def _redirect_stdin(stream):
+    saved = sys.stdin
+    sys.stdin = stream
+    try:
+        yield
+    finally:
+        sys.stdin = saved
+
+
+# --- Inside the web process ---
+
+class _Worker:
+    def __init__(self, ctx, limits):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, limits), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def kill(self):
+        with contextlib.suppress(Exception):
+            self.process.kill()
+            self.process.join(1)
+        with contextlib.suppress(Exception):
+            self.conn.close()
+
+
+class ExecutionPool:
+    """
+    A fixed number of pre-started worker processes shared by the request threads
+    of one web process. Its size defaults to the number of CPU cores, so
+    execution throughput scales with cores rather than with web workers.
+    """
+
+    def __init__(self, size=None, limits=None, queue_timeout=10.0):
+        self.size = size or os.cpu_count() or 2
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.queue_timeout = queue_timeout
+        self.pid = os.getpid()
+        self._ctx = _mp_context()
+        self._idle = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(_Worker(self._ctx, self.limits))
+
+    def run(self, func, *args, timeout=None, **kwargs):
+        """Run `func(*args, **kwargs)` in a worker and return its result."""
+        events = self.stream(func, *args, timeout=timeout, **kwargs)
+        try:
+            for kind, data in events:
+                if kind == 'result':
+                    return data
+        finally:
+            events.close()
+
+    def stream(self, func, *args, timeout=None, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in a worker, yielding (kind, data) for every
+        event the job emits and finally ('result', return value).
+
+        The worker stays reserved while the generator is being consumed; if the
+        consumer stops early (e.g. the browser disconnected) the worker is killed.
+        """
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise PoolBusy("All code runners are busy, please try again in a moment.")
+
+        deadline = time.monotonic() + (timeout or self.limits['wall_seconds'])
+        finished = False
+        try:
+            worker.conn.send((func, args, kwargs))
+            worker.jobs += 1
+            while True:
+                if not worker.conn.poll(max(deadline - time.monotonic(), 0)):
+                    raise ExecutionTimeout("Your program took too long to run and was stopped.")
+                status, value = worker.conn.recv()
+                if status == 'event':
+                    yield value
+                    continue
+                finished = True
+                if status == 'error':
+                    raise SandboxError(value)
+                yield ('result', value)
+                return
+        except (EOFError, OSError) as e:
+            # The worker died, e.g. it was killed by the kernel for breaking a hard limit
+            raise SandboxError(f"The code runner stopped unexpectedly: {e}")
+        finally:
+            if not finished:
+                # The job is still running (timeout, crash or abandoned stream)
+                worker.kill()
+                worker = None
+            self._release(worker)
+
+    def _release(self, worker):
+        if worker is not None and worker.jobs >= self.limits['max_jobs']:
+            # The worker exits on its own after its last job; reap it and start fresh
+            worker.process.join(1)
+            worker.kill()
+            worker = None
+        if worker is None:
+            worker = _Worker(self._ctx, self.limits)
+        self._idle.put(worker)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+def _mp_context():
+    # forkserver hands out workers forked from a clean, single-threaded process,
+    # which is safe even when the web process itself is running request threads
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """The execution pool of this process, started on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None or _default_pool.pid != os.getpid():
+            size = int(os.getenv('SANDBOX_WORKERS', '0')) or None
+            _default_pool = ExecutionPool(size=size)
+        return _default_pool
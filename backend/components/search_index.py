@@ -0,0 +1,317 @@
+"""
+Inverted full-text index over the curriculum content.
+
+Lessons, practice items, challenges, quizzes and quiz questions become
+documents. Each document points back to its module and section, so a
+result can be opened with /modules/<module_id>/<section>. Text is
+lowercased, split into words and lightly stemmed ("loops" and "looping"
+both become "loop"). Postings keep each term's BM25 score per document,
+computed when the index changes, so a query only adds up precomputed
+numbers. The last word of a query is also matched as a prefix, for
+search-as-you-type.
+
+Documents are grouped by the file they came from. When one content file
+changes, only its documents are tokenized again; the scores of all
+documents are then recomputed, since they depend on the document count
+and average length.
+"""
+import bisect
+import heapq
+import math
+import re
+
+from .result_cache import ResultCache
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Most vocabulary words a prefix is expanded to (the ones in the most documents win)
+MAX_PREFIX_TERMS = 50
+
+# How much a word counts in each field of a document
+TITLE_WEIGHT = 3
+TEXT_WEIGHT = 1
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+_VOWELS = frozenset('aeiouy')
+# Final letters that stay doubled when a suffix is removed ("called" -> "call")
+_DOUBLE_ENDINGS = frozenset('lsz')
+
+
+def words(text):
+    """The lowercased words of a text."""
+    return _WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def stem(word):
+    """
+    A light suffix stripper for English plurals and verb forms: "loops",
+    "looped" and "looping" all become "loop". Words whose stem would have no
+    vowel ("string", "thing") or fewer than three letters are left alone.
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix):
+            base = word[:-len(suffix)]
+            if len(base) < 3 or not _VOWELS.intersection(base):
+                return word
+            # "running" -> "runn" -> "run"
+            if len(base) > 3 and base[-1] == base[-2] and base[-1] not in _VOWELS | _DOUBLE_ENDINGS:
+                base = base[:-1]
+            return base
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def content_documents(filename, items):
+    """
+    The searchable documents of one content file, as (reference, fields)
+    pairs. `reference` is what a search result returns; `fields` is a list
+    of (text, weight).
+    """
+    documents = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        module_id = item.get('module_id')
+        if filename == 'learn.json':
+            text = [part.get('text') for part in item.get('content', []) if isinstance(part, dict)]
+            documents.append((
+                {'kind': 'lesson', 'module_id': module_id, 'section': 'learn', 'title': item.get('title')},
+                [(item.get('title'), TITLE_WEIGHT)] + [(t, TEXT_WEIGHT) for t in text]
+            ))
+        elif filename == 'practice.json':
+            documents.append((
+                {'kind': 'practice', 'module_id': module_id, 'section': 'practice', 'title': item.get('title')},
+                [(item.get('title'), TITLE_WEIGHT), (item.get('instructions'), TEXT_WEIGHT)]
+            ))
+        elif filename == 'challenges.json':
+            documents.append((
+                {'kind': 'challenge', 'module_id': module_id, 'section': 'challenge',
+                 'challenge_id': item.get('id'), 'title': item.get('title')},
+                [(item.get('title'), TITLE_WEIGHT), (item.get('description'), TEXT_WEIGHT)]
+            ))
+        elif filename == 'quiz.json':
+            quiz_id = item.get('quiz_id')
+            documents.append((
+                {'kind': 'quiz', 'module_id': module_id, 'section': 'quizzes', 'quiz_id': quiz_id,
+                 'title': item.get('title')},
+                [(item.get('title'), TITLE_WEIGHT)]
+            ))
+            for question in item.get('questions', []):
+                if isinstance(question, dict):
+                    documents.append((
+                        {'kind': 'question', 'module_id': module_id, 'section': 'quizzes', 'quiz_id': quiz_id,
+                         'question_id': question.get('question_id'), 'title': question.get('question')},
+                        [(question.get('question'), TEXT_WEIGHT)]
+                    ))
+    return documents
+
+
+class _Snapshot:
+    """Everything a query reads, replaced as a whole when the index changes."""
+
+    def __init__(self, version, postings, weights, references, vocabulary, word_terms):
+        self.version = version
+        self.postings = postings      # term -> [(-score, document number)], best first
+        self.weights = weights        # term -> {document number: score}
+        self.references = references  # document number -> reference
+        self.vocabulary = vocabulary  # sorted words of every document
+        self.word_terms = word_terms  # word -> term
+
+
+class SearchIndex:
+    """
+    BM25-ranked inverted index, updated one content file at a time with
+    `update_file`. Queries return the references of the best documents.
+
+    Updates swap in a new snapshot, so a query running in another thread
+    sees either the old index or the new one. Recent results are cached per
+    snapshot, since a class typing the same search repeats the same queries.
+    """
+
+    def __init__(self, cache_entries=1024):
+        self._files = {}  # filename -> [(reference, {term: weighted frequency}, length)]
+        self._words = {}  # filename -> {word: term}, for prefix matching
+        self._snapshot = _Snapshot(0, {}, {}, [], [], {})
+        self._results = ResultCache(max_entries=cache_entries)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def __len__(self):
+        return len(self._snapshot.references)
+
+    def update_file(self, filename, items):
+        """Replace the documents that came from `filename` with those of `items`."""
+        documents = []
+        word_terms = {}
+        for reference, fields in content_documents(filename, items):
+            frequencies = {}
+            length = 0
+            for text, weight in fields:
+                for word in words(text):
+                    term = word_terms.get(word)
+                    if term is None:
+                        term = word_terms[word] = stem(word)
+                    frequencies[term] = frequencies.get(term, 0) + weight
+                    length += weight
+            if frequencies:
+                documents.append((reference, frequencies, length))
+        self._files[filename] = documents
+        self._words[filename] = word_terms
+        self._rebuild()
+
+    def _rebuild(self):
+        """Recompute the postings, since N and the average length change with any file."""
+        all_documents = [document for documents in self._files.values() for document in documents]
+        count = len(all_documents)
+        average_length = sum(length for _, _, length in all_documents) / count if count else 0
+
+        document_frequency = {}
+        for _, frequencies, _ in all_documents:
+            for term in frequencies:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+        weights = {}
+        for number, (_, frequencies, length) in enumerate(all_documents):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            for term, frequency in frequencies.items():
+                weights.setdefault(term, {})[number] = idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+        # Negated scores sort best first, and ties by document number, with plain tuple order
+        postings = {term: sorted((-score, number) for number, score in scores.items())
+                    for term, scores in weights.items()}
+
+        word_terms = {}
+        for file_words in self._words.values():
+            word_terms.update(file_words)
+
+        references = [reference for reference, _, _ in all_documents]
+        self._snapshot = _Snapshot(self._snapshot.version + 1, postings, weights, references,
+                                   sorted(word_terms), word_terms)
+        self._results.clear()
+
+    def search(self, query, limit=10, prefix=True):
+        """
+        The `limit` best matches for `query`, best first, as (score,
+        reference) pairs. With `prefix`, the query's last word also matches
+        every word that starts with it (unless the query ends with a space).
+        """
+        snapshot = self._snapshot
+        postings = snapshot.postings
+        query_words = words(query)
+        if not query_words or limit <= 0:
+            return []
+
+        # One group of alternative terms per query word; a document scores the best term of each group
+        groups = [[stem(word)] for word in query_words]
+        if prefix and not query[-1:].isspace():
+            groups[-1] = _expand_prefix(snapshot, query_words[-1], groups[-1][0])
+        # Words found nowhere add nothing to any score
+        groups = [sorted(group) for group in ([term for term in group if term in postings] for group in groups)
+                  if group]
+        if not groups:
+            return []
+
+        key = (snapshot.version, tuple(map(tuple, groups)), limit)
+        results = self._results.get(key)
+        if results is None:
+            if len(groups) == 1:
+                top = _best_of_group(postings, groups[0], limit)
+            else:
+                top = _best_of_groups(postings, snapshot.weights, groups, limit)
+            results = [(round(score, 4), snapshot.references[number]) for score, number in top]
+            self._results.put(key, results)
+        return results
+
+
+def _expand_prefix(snapshot, word, term):
+    """The terms of the vocabulary words starting with `word`, plus `term` itself."""
+    postings, vocabulary, word_terms = snapshot.postings, snapshot.vocabulary, snapshot.word_terms
+    start = bisect.bisect_left(vocabulary, word)
+    end = bisect.bisect_left(vocabulary, word + '\uffff', start)
+    expanded = {term}
+    expanded.update(word_terms[vocabulary[i]] for i in range(start, end))
+    if len(expanded) > MAX_PREFIX_TERMS:
+        expanded = heapq.nlargest(MAX_PREFIX_TERMS, expanded, key=lambda t: len(postings.get(t, ())))
+    return list(expanded)
+
+
+def _best_of_group(postings, group, limit):
+    """The best (score, document) pairs of one group: its terms' lists merged, each document once."""
+    if len(group) == 1:
+        return [(-negative_score, number) for negative_score, number in postings[group[0]][:limit]]
+    top = []
+    seen = set()
+    # A document's first entry in the merged, best-first lists is its best score in the group
+    for negative_score, number in heapq.merge(*(postings[term] for term in group)):
+        if number not in seen:
+            seen.add(number)
+            top.append((-negative_score, number))
+            if len(top) == limit:
+                break
+    return top
+
+
+def _best_of_groups(postings, weights, groups, limit):
+    """
+    The best (score, document) pairs for several groups, adding up each
+    document's best score per group (MaxScore pruning). Groups are taken
+    from the highest possible score down. Each group's best-first lists are
+    only read while an entry could still lift a new document into the top
+    `limit`; candidates already found look up the rest. Candidates that can
+    no longer reach the top are dropped.
+    """
+    bounds = [-min(postings[term][0][0] for term in group) for group in groups]
+    order = sorted(range(len(groups)), key=lambda i: -bounds[i])
+    scores = {}
+    threshold = 0.0  # the limit-th best score so far; it only ever rises
+    for position, i in enumerate(order):
+        group = groups[i]
+        remaining = sum(bounds[j] for j in order[position:])
+        full = len(scores) >= limit
+        # What a document not seen yet must score in this group to still make it
+        cutoff = threshold - (remaining - bounds[i]) if full else 0.0
+
+        best = {}
+        for term in group:
+            for negative_score, number in postings[term]:
+                if -negative_score < cutoff:
+                    break
+                if -negative_score > best.get(number, 0.0):
+                    best[number] = -negative_score
+
+        tables = [weights[term] for term in group]
+        table = tables[0] if len(tables) == 1 else None
+        dropped = set()
+        for number, score in list(scores.items()):
+            if full and score + remaining < threshold:
+                del scores[number]
+                dropped.add(number)
+            elif number not in best:
+                if table is not None:
+                    found = table.get(number)
+                else:
+                    found = max(t.get(number, 0.0) for t in tables)
+                if found:
+                    scores[number] = score + found
+        for number, score in best.items():
+            if number not in dropped:
+                scores[number] = scores.get(number, 0.0) + score
+
+        if len(scores) >= limit:
+            threshold = heapq.nlargest(limit, scores.values())[-1]
+    return heapq.nlargest(limit, ((score, number) for number, score in scores.items()),
+                          key=lambda item: (item[0], -item[1]))
@@ -0,0 +1,62 @@
+"""
+Helpers for state that several worker processes share through files.
+
+The job queue, rate limiter, failure history and profile totals each keep
+a small SQLite database that every gunicorn worker reads and writes.
+`ThreadConnections` gives each thread of each process its own connection
+to one of them, and `process_alive` tells whether the process that left a
+lease, job or metrics file behind is still running.
+"""
+import os
+import sqlite3
+import threading
+
+
+def open_connection(db_path):
+    """A connection in autocommit mode, with WAL and a generous busy timeout for concurrent workers."""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+
+class ThreadConnections:
+    """
+    One connection per thread to the database at `db_path`, whose `schema`
+    script is run when each connection opens. Connections must never be
+    shared across a fork, so a forked worker opens new ones.
+    """
+
+    def __init__(self, db_path, schema):
+        self.db_path = db_path
+        self.schema = schema
+        self._local = threading.local()
+
+    def get(self):
+        """Return this thread's connection, creating the schema on first use."""
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == pid:
+            return conn
+        conn = open_connection(self.db_path)
+        conn.executescript(self.schema)
+        self._local.conn = conn
+        self._local.pid = pid
+        return conn
+
+
+def process_alive(pid):
+    """Whether a process with this id exists (it may belong to another user)."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
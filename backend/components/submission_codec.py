@@ -0,0 +1,175 @@
+"""
+Compact storage format for challenge submissions.
+
+A stored submission keeps only what is unique to it. The code lives once in
+a content-addressed blob table (keyed by its hash), the inputs and expected
+outputs of the test cases live once per challenge and test case version,
+pass/fail is a bitmask, and an actual output is only stored when it differs
+from the expected one. `expand` rebuilds the original record exactly.
+
+Fields that are already table columns (challenge_id, user_id, score,
+timestamp) or that follow from the results (passed_tests, total_tests) are
+dropped from the record and restored on read. Compact records carry these
+internal keys:
+
+    "_code": "<hash of the code>"
+    "_results": {"cases": "<test case version>", "passed": <bitmask>,
+                 "outputs": [null | "actual output", ...],
+                 "extra": {"<index>": {"missing_parts": [...]}}}
+    "_absent": ["timestamp"]   (restorable fields the original record did not have)
+
+Anything that does not fit the format (e.g. a non-string output) is kept
+in "extra", or left in the record as it is.
+"""
+import hashlib
+import zlib
+
+from .result_cache import content_hash
+
+# Keys of a test result that the compact format rebuilds from its parts
+RESULT_KEYS = ('test_case', 'input', 'expected_output', 'actual_output', 'passed')
+
+# Record fields stored in their own table columns, with the type the column returns them as
+COLUMN_FIELDS = {'challenge_id': int, 'user_id': str, 'score': float, 'timestamp': str}
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()[:32]
+
+
+def pack_code(code):
+    return zlib.compress(code.encode('utf-8'))
+
+
+def unpack_code(blob):
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def case_set_version(challenge_id, cases):
+    """Version of a challenge's test cases, given as [[input, expected output], ...]."""
+    return content_hash([challenge_id, cases])[:32]
+
+
+def compact(record):
+    """
+    Split a submission into (compact record, code or None, (version, cases) or None).
+    The code and case set are returned so the caller can store them once.
+    """
+    compact_record = dict(record)
+    code = None
+    case_set = None
+
+    if isinstance(record.get('code'), str):
+        code = compact_record.pop('code')
+        compact_record['_code'] = code_hash(code)
+
+    results = record.get('test_results')
+    packed = _pack_results(results) if isinstance(results, list) else None
+    if packed is not None:
+        cases, packed_results = packed
+        version = case_set_version(record.get('challenge_id'), cases)
+        packed_results['cases'] = version
+        del compact_record['test_results']
+        compact_record['_results'] = packed_results
+        case_set = (version, cases)
+    absent = []
+    if packed is not None:
+        # The counts follow from the results unless the record says otherwise
+        derived = {'passed_tests': bin(packed_results['passed']).count('1'), 'total_tests': len(cases)}
+        for field, value in derived.items():
+            if field not in record:
+                absent.append(field)
+            elif type(record[field]) is int and record[field] == value:
+                del compact_record[field]
+
+    # Column values are restored from the row, so only keep them when the column could not
+    for field, column_type in COLUMN_FIELDS.items():
+        if field not in record:
+            absent.append(field)
+        elif type(record[field]) is column_type:
+            del compact_record[field]
+    if absent:
+        compact_record['_absent'] = absent
+    return compact_record, code, case_set
+
+
+def _pack_results(results):
+    """Return (cases, packed results) or None if the results do not fit the format."""
+    cases, outputs, extra = [], [], {}
+    passed_mask = 0
+    for index, result in enumerate(results):
+        if not isinstance(result, dict) or any(key not in result for key in RESULT_KEYS):
+            return None
+        if not isinstance(result['input'], str) or not isinstance(result['expected_output'], str):
+            return None
+        cases.append([result['input'], result['expected_output']])
+
+        leftover = {k: v for k, v in result.items() if k not in RESULT_KEYS}
+        if result['test_case'] != index + 1:
+            leftover['test_case'] = result['test_case']
+        if result['passed'] is True:
+            passed_mask |= 1 << index
+        elif result['passed'] is not False:
+            leftover['passed'] = result['passed']
+
+        actual = result['actual_output']
+        if actual == result['expected_output']:
+            outputs.append(None)
+        elif isinstance(actual, str):
+            outputs.append(actual)
+        else:
+            outputs.append(None)
+            leftover['actual_output'] = actual
+        if leftover:
+            extra[str(index)] = leftover
+
+    packed = {'passed': passed_mask, 'outputs': outputs}
+    if extra:
+        packed['extra'] = extra
+    return cases, packed
+
+
+def expand(compact_record, columns, code=None, cases=None, fields=None):
+    """
+    Rebuild a submission from its compact record, its row's column values
+    ({field: value}), its code and its case set. With `fields`, only those
+    fields are returned (missing ones as None) and the code and cases are
+    only needed if the fields include them.
+    """
+    record = dict(compact_record)
+    record.pop('_code', None)
+    packed = record.pop('_results', None)
+    absent = record.pop('_absent', ())
+    for field, value in columns.items():
+        if field not in absent:
+            record.setdefault(field, value)
+    if packed is not None:
+        derived = {'passed_tests': bin(packed['passed']).count('1'), 'total_tests': len(packed['outputs'])}
+        for field, value in derived.items():
+            if field not in absent:
+                record.setdefault(field, value)
+    if fields is not None and 'code' not in fields:
+        code = None
+    if code is not None:
+        record['code'] = code
+    if packed is not None and (fields is None or 'test_results' in fields):
+        record['test_results'] = _unpack_results(packed, cases)
+    if fields is None:
+        return record
+    return {field: record.get(field) for field in fields}
+
+
+def _unpack_results(packed, cases):
+    extra = packed.get('extra', {})
+    results = []
+    for index, ((case_input, expected), actual) in enumerate(zip(cases, packed['outputs'])):
+        result = {
+            'test_case': index + 1,
+            'input': case_input,
+            'expected_output': expected,
+            'actual_output': expected if actual is None else actual,
+            'passed': bool(packed['passed'] >> index & 1)
+        }
+        result.update(extra.get(str(index), {}))
+        results.append(result)
+    return results
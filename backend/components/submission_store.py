@@ -0,0 +1,1005 @@
+import base64
+import binascii
+import contextlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import metrics
+from .history_archive import HistoryArchive, period_of
+from .submission_codec import COLUMN_FIELDS, compact, expand, pack_code, unpack_code
+
+# Records are appended to SQLite in WAL mode: every write is a single INSERT
+# (no whole-file rewrite) and SQLite's own file locking keeps concurrent
+# gunicorn workers from losing each other's records.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS challenge_submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    challenge_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+-- History is read per (user, challenge) in timestamp order, with the row id as tie-breaker
+CREATE INDEX IF NOT EXISTS idx_challenge_submissions_user_time
+    ON challenge_submissions (user_id, challenge_id, timestamp, id);
+
+CREATE TABLE IF NOT EXISTS quiz_progress (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    quiz_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quiz_progress_user
+    ON quiz_progress (user_id, id);
+
+-- Running per-user quiz aggregates, updated in the same transaction as each insert
+CREATE TABLE IF NOT EXISTS user_quiz_stats (
+    user_id TEXT PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    correct_sum INTEGER NOT NULL,
+    question_sum INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_quizzes_completed (
+    user_id TEXT NOT NULL,
+    quiz_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, quiz_id)
+) WITHOUT ROWID;
+
+-- Attempts plus best and latest submission per (user, challenge)
+CREATE TABLE IF NOT EXISTS user_challenge_stats (
+    user_id TEXT NOT NULL,
+    challenge_id INTEGER NOT NULL,
+    attempts INTEGER NOT NULL,
+    best_score REAL NOT NULL,
+    best_submission_id INTEGER NOT NULL,
+    latest_submission_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, challenge_id)
+) WITHOUT ROWID;
+-- Leaderboards read the top best scores of one challenge straight from this index
+CREATE INDEX IF NOT EXISTS idx_user_challenge_stats_leaderboard
+    ON user_challenge_stats (challenge_id, best_score DESC, best_submission_id);
+
+-- Class-wide totals per challenge and per quiz, for completion statistics
+CREATE TABLE IF NOT EXISTS challenge_totals (
+    challenge_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    users_attempted INTEGER NOT NULL,
+    users_completed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quiz_totals (
+    quiz_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    users_completed INTEGER NOT NULL,
+    score_sum REAL NOT NULL
+);
+
+-- Submitted code, stored once per distinct program (zlib-compressed) and keyed by its hash
+CREATE TABLE IF NOT EXISTS code_blobs (
+    hash TEXT PRIMARY KEY,
+    code BLOB NOT NULL
+) WITHOUT ROWID;
+-- Inputs and expected outputs of one version of a challenge's test cases
+CREATE TABLE IF NOT EXISTS test_case_sets (
+    version TEXT PRIMARY KEY,
+    challenge_id INTEGER,
+    cases TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- How often each test case of a case set has been run and failed, for fail-fast ordering
+CREATE TABLE IF NOT EXISTS test_case_stats (
+    cases_version TEXT NOT NULL,
+    test_index INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    PRIMARY KEY (cases_version, test_index)
+) WITHOUT ROWID;
+
+-- Compressed chunks of history moved out of the live tables, one per (user, challenge or quiz)
+-- and quarter per archive run; first/last are the (timestamp, id) of the chunk's first and last row
+CREATE TABLE IF NOT EXISTS archive_chunks (
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    byte_length INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    first_timestamp TEXT NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_timestamp TEXT NOT NULL,
+    last_id INTEGER NOT NULL,
+    PRIMARY KEY (kind, user_id, item_id, period, byte_offset)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# A challenge counts as completed once a submission passes every test case
+COMPLETION_SCORE = 100
+
+# Legacy whole-file JSON stores that are imported once into the database
+LEGACY_FILES = {
+    'challenge_submissions': 'challenge_submissions.json',
+    'quiz_progress': 'quiz_progress.json'
+}
+
+
+# Live table of each kind of archived record; rows are archived as (id, item id, user_id, score, timestamp, record)
+ARCHIVE_TABLES = {
+    'challenge': 'challenge_submissions',
+    'quiz': 'quiz_progress'
+}
+# Records that may leave the live tables: older than the cutoff, and not a user's best or latest
+# submission of a challenge or latest attempt of a quiz (the overview, leaderboards and
+# fail-fast ordering read those)
+ARCHIVE_CANDIDATES = {
+    'challenge': (
+        'SELECT id, challenge_id, user_id, score, timestamp, record FROM challenge_submissions '
+        'WHERE timestamp < ? '
+        'AND id NOT IN (SELECT best_submission_id FROM user_challenge_stats) '
+        'AND id NOT IN (SELECT latest_submission_id FROM user_challenge_stats) '
+        'ORDER BY user_id, challenge_id, timestamp, id LIMIT ?'
+    ),
+    'quiz': (
+        'SELECT id, quiz_id, user_id, score, timestamp, record FROM quiz_progress '
+        'WHERE timestamp < ? '
+        'AND id NOT IN (SELECT MAX(id) FROM quiz_progress GROUP BY user_id, quiz_id) '
+        'ORDER BY user_id, quiz_id, id LIMIT ?'
+    )
+}
+
+
+# Fields of a stored challenge submission that can be requested with `fields=`
+SUBMISSION_FIELDS = ('challenge_id', 'user_id', 'code', 'score', 'passed_tests',
+                     'total_tests', 'test_results', 'timestamp')
+# Everything except the bulky code and per-test results
+SUMMARY_FIELDS = tuple(f for f in SUBMISSION_FIELDS if f not in ('code', 'test_results'))
+
+
+def _dump(record):
+    return json.dumps(record, separators=(',', ':'))
+
+
+# Columns selected to rebuild a full submission: the column fields, then the compact record
+RECORD_COLUMNS = 'challenge_id, user_id, score, timestamp, record'
+
+
+def _chunks(values, size=500):
+    """Split values for `IN (...)` queries, staying well below SQLite's variable limit."""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _history_key(row):
+    """Sort key of a submission row (id, challenge_id, user_id, score, timestamp, record): (timestamp, id)."""
+    return row[4], row[0]
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque pagination cursor pointing just past (timestamp, row id)."""
+    raw = json.dumps([timestamp, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return timestamp, row_id
+
+
+class SubmissionStore:
+    """
+    Append-only store for challenge submissions and quiz progress.
+
+    Each thread (and each forked worker process) gets its own connection.
+    A background thread periodically checkpoints the WAL and reclaims free
+    pages so the database files stay compact as history grows.
+
+    `archive_history` moves records older than a cutoff into compressed
+    segments in `archive_dir` (default: an `archive` directory next to the
+    database). History reads return the live records and only open the
+    archive when asked for more.
+    """
+
+    def __init__(self, db_path, legacy_dir=None, compact_interval=300, archive_dir=None):
+        self.db_path = db_path
+        self.legacy_dir = legacy_dir
+        self.compact_interval = compact_interval
+        self.archive = HistoryArchive(archive_dir or os.path.join(os.path.dirname(db_path), 'archive'))
+        self._local = threading.local()
+        self._case_sets = {}  # version -> cases; versions never change once written
+        self._setup_lock = threading.Lock()
+        self._ready_pid = None
+        self._compactor_pid = None
+
+    # --- Connections ---
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        # auto_vacuum only takes effect on a new database, before it is switched to WAL
+        # (on an existing one this does nothing)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use."""
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == pid:
+            return conn
+
+        # Connections must never be shared across a fork, so open a new one per process
+        conn = self._open()
+        self._local.conn = conn
+        self._local.pid = pid
+
+        if self._ready_pid != pid:
+            with self._setup_lock:
+                if self._ready_pid != pid:
+                    self._setup(conn)
+                    self._ready_pid = pid
+                    self._start_compactor()
+        return conn
+
+    def _setup(self, conn):
+        """Create tables and import the legacy JSON files (once per database)."""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn.executescript(SCHEMA)
+        # Submissions written before the compact format are converted once (before
+        # the legacy import, so a new database only ever holds compact records)
+        with self.transaction(conn):
+            if not conn.execute("SELECT 1 FROM store_meta WHERE key = 'compact:challenge_submissions'").fetchone():
+                self._compact_existing(conn)
+        if self.legacy_dir:
+            self.migrate_legacy_files(conn)
+        # Databases created before an aggregate table existed need one backfill
+        for marker, rebuild in self._aggregate_builders():
+            with self.transaction(conn):
+                if not conn.execute('SELECT 1 FROM store_meta WHERE key = ?', (marker,)).fetchone():
+                    rebuild(conn)
+
+    def _aggregate_builders(self):
+        # Totals come last: they are derived from the per-user aggregates
+        return [
+            ('aggregates:quiz', self._rebuild_quiz_aggregates),
+            ('aggregates:challenge', self._rebuild_challenge_aggregates),
+            ('aggregates:quiz-totals', self._rebuild_quiz_totals),
+            ('aggregates:challenge-totals', self._rebuild_challenge_totals),
+            ('aggregates:test-case-stats', self._rebuild_test_case_stats)
+        ]
+
+    def migrate_legacy_files(self, conn):
+        """Import records from the old challenge_submissions.json/quiz_progress.json files."""
+        for table, filename in LEGACY_FILES.items():
+            marker = f'migrated:{filename}'
+            with self.transaction(conn):
+                # BEGIN IMMEDIATE serializes workers, so only one of them imports each file
+                if conn.execute('SELECT 1 FROM store_meta WHERE key = ?', (marker,)).fetchone():
+                    continue
+                path = os.path.join(self.legacy_dir, filename)
+                try:
+                    with metrics.timer('data_file_read_seconds', file=filename):
+                        with open(path, 'rb') as f:
+                            raw = f.read()
+                        metrics.inc('data_file_read_bytes_total', len(raw), file=filename)
+                        records = json.loads(raw)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    records = []
+                for record in records:
+                    if table == 'challenge_submissions':
+                        self._insert_challenge_submission(conn, record)
+                    else:
+                        self._insert_quiz_progress(conn, record)
+                conn.execute('INSERT INTO store_meta (key, value) VALUES (?, ?)', (marker, str(len(records))))
+
+    @contextlib.contextmanager
+    def transaction(self, conn=None):
+        """Run a write transaction that holds the database write lock."""
+        conn = conn or self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    # --- Writes ---
+
+    def _insert_challenge_submission(self, conn, record):
+        raw, compact_record = self._store_compact(conn, record)
+        cursor = conn.execute(
+            'INSERT INTO challenge_submissions (challenge_id, user_id, score, timestamp, record) VALUES (?, ?, ?, ?, ?)',
+            (record.get('challenge_id'), record.get('user_id'), record.get('score', 0),
+             record.get('timestamp', ''), raw)
+        )
+        self._apply_challenge_aggregates(conn, record, cursor.lastrowid)
+        self._apply_test_case_stats(conn, compact_record)
+        return cursor.lastrowid
+
+    def _store_compact(self, conn, record):
+        """
+        Store a submission's code and test case set if they are new, and return
+        its compact record, as JSON for the submissions table and as a dict.
+        """
+        compact_record, code, case_set = compact(record)
+        raw = _dump(compact_record)
+        written = len(raw)
+        if code is not None:
+            blob = pack_code(code)
+            if conn.execute('INSERT OR IGNORE INTO code_blobs (hash, code) VALUES (?, ?)',
+                            (compact_record['_code'], blob)).rowcount:
+                written += len(blob)
+        if case_set is not None:
+            version, cases = case_set
+            raw_cases = _dump(cases)
+            if conn.execute('INSERT OR IGNORE INTO test_case_sets (version, challenge_id, cases) VALUES (?, ?, ?)',
+                            (version, record.get('challenge_id'), raw_cases)).rowcount:
+                written += len(raw_cases)
+        metrics.inc('store_write_bytes_total', written, table='challenge_submissions')
+        return raw, compact_record
+
+    def _compact_existing(self, conn):
+        """Rewrite submissions that still embed their code or full test results."""
+        rows = conn.execute(
+            "SELECT id, record FROM challenge_submissions "
+            "WHERE json_type(record, '$.code') IS NOT NULL OR json_type(record, '$.test_results') IS NOT NULL"
+        ).fetchall()
+        for row_id, raw in rows:
+            conn.execute('UPDATE challenge_submissions SET record = ? WHERE id = ?',
+                         (self._store_compact(conn, json.loads(raw))[0], row_id))
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('compact:challenge_submissions', ?)",
+            (str(len(rows)),)
+        )
+
+    def _expand_records(self, conn, rows, fields=None):
+        """
+        Turn rows of (challenge_id, user_id, score, timestamp, record) back into
+        full submissions, fetching only the code and test cases that are needed.
+        """
+        records = [json.loads(row[4]) for row in rows]
+        codes = {}
+        if fields is None or 'code' in fields:
+            hashes = list({r['_code'] for r in records if '_code' in r})
+            for chunk in _chunks(hashes):
+                placeholders = ', '.join('?' for _ in chunk)
+                for code_hash, blob in conn.execute(
+                    f'SELECT hash, code FROM code_blobs WHERE hash IN ({placeholders})', chunk
+                ):
+                    codes[code_hash] = unpack_code(blob)
+        if fields is None or 'test_results' in fields:
+            missing = list({r['_results']['cases'] for r in records if '_results' in r} - self._case_sets.keys())
+            for chunk in _chunks(missing):
+                placeholders = ', '.join('?' for _ in chunk)
+                for version, raw_cases in conn.execute(
+                    f'SELECT version, cases FROM test_case_sets WHERE version IN ({placeholders})', chunk
+                ):
+                    self._case_sets[version] = json.loads(raw_cases)
+        return [
+            expand(record, dict(zip(COLUMN_FIELDS, row)), codes.get(record.get('_code')),
+                   self._case_sets.get(record['_results']['cases']) if '_results' in record else None,
+                   fields)
+            for row, record in zip(rows, records)
+        ]
+
+    def _apply_challenge_aggregates(self, conn, record, submission_id):
+        """Fold one submission into the per-(user, challenge) row and the challenge totals."""
+        previous = conn.execute(
+            'SELECT best_score FROM user_challenge_stats WHERE user_id = ? AND challenge_id = ?',
+            (record.get('user_id'), record.get('challenge_id'))
+        ).fetchone()
+        conn.execute(
+            """
+            INSERT INTO user_challenge_stats
+                (user_id, challenge_id, attempts, best_score, best_submission_id, latest_submission_id)
+            VALUES (?, ?, 1, ?, ?, ?)
+            ON CONFLICT (user_id, challenge_id) DO UPDATE SET
+                attempts = attempts + 1,
+                best_submission_id = CASE WHEN excluded.best_score > best_score
+                                          THEN excluded.best_submission_id ELSE best_submission_id END,
+                best_score = MAX(best_score, excluded.best_score),
+                latest_submission_id = excluded.latest_submission_id
+            """,
+            (record.get('user_id'), record.get('challenge_id'), record.get('score', 0),
+             submission_id, submission_id)
+        )
+        # Count a user once when they first try the challenge and once when they first complete it
+        completed_before = previous is not None and previous[0] >= COMPLETION_SCORE
+        completed_now = record.get('score', 0) >= COMPLETION_SCORE
+        conn.execute(
+            """
+            INSERT INTO challenge_totals (challenge_id, attempts, users_attempted, users_completed)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT (challenge_id) DO UPDATE SET
+                attempts = attempts + 1,
+                users_attempted = users_attempted + excluded.users_attempted,
+                users_completed = users_completed + excluded.users_completed
+            """,
+            (record.get('challenge_id'), int(previous is None), int(completed_now and not completed_before))
+        )
+
+    def _rebuild_challenge_aggregates(self, conn):
+        conn.execute('DELETE FROM user_challenge_stats')
+        conn.execute('DELETE FROM challenge_totals')
+        count = 0
+        rows = conn.execute('SELECT id, challenge_id, user_id, score FROM challenge_submissions').fetchall()
+        rows += [tuple(row[:4]) for row in self._all_archived_rows(conn, 'challenge')]
+        rows.sort()
+        for row_id, challenge_id, user_id, score in rows:
+            record = {'challenge_id': challenge_id, 'user_id': user_id, 'score': score}
+            self._apply_challenge_aggregates(conn, record, row_id)
+            count += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('aggregates:challenge', ?)", (str(count),)
+        )
+        return count
+
+    def _apply_test_case_stats(self, conn, compact_record):
+        """Count one run of each of a submission's test cases, and which of them failed."""
+        results = compact_record.get('_results')
+        if results is None:
+            return
+        conn.executemany(
+            'INSERT INTO test_case_stats (cases_version, test_index, runs, failures) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (cases_version, test_index) DO UPDATE SET '
+            'runs = runs + 1, failures = failures + excluded.failures',
+            [(results['cases'], index, int(not results['passed'] >> index & 1))
+             for index in range(len(results['outputs']))]
+        )
+
+    def _rebuild_test_case_stats(self, conn):
+        conn.execute('DELETE FROM test_case_stats')
+        count = 0
+        live = [raw for (raw,) in conn.execute(
+            "SELECT record FROM challenge_submissions WHERE json_type(record, '$._results') IS NOT NULL"
+        ).fetchall()]
+        archived = (row[5] for row in self._all_archived_rows(conn, 'challenge'))
+        for raw in itertools.chain(live, archived):
+            compact_record = json.loads(raw)
+            if '_results' in compact_record:
+                self._apply_test_case_stats(conn, compact_record)
+                count += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('aggregates:test-case-stats', ?)", (str(count),)
+        )
+        return count
+
+    def _insert_quiz_progress(self, conn, record):
+        raw = _dump(record)
+        cursor = conn.execute(
+            'INSERT INTO quiz_progress (quiz_id, user_id, score, timestamp, record) VALUES (?, ?, ?, ?, ?)',
+            (record.get('quiz_id'), record.get('user_id'), record.get('score', 0),
+             record.get('timestamp', ''), raw)
+        )
+        metrics.inc('store_write_bytes_total', len(raw), table='quiz_progress')
+        self._apply_quiz_aggregates(conn, record)
+        return cursor.lastrowid
+
+    def _apply_quiz_aggregates(self, conn, record):
+        """Fold one progress record into the running per-user aggregates."""
+        conn.execute(
+            """
+            INSERT INTO user_quiz_stats (user_id, attempts, score_sum, correct_sum, question_sum)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                attempts = attempts + 1,
+                score_sum = score_sum + excluded.score_sum,
+                correct_sum = correct_sum + excluded.correct_sum,
+                question_sum = question_sum + excluded.question_sum
+            """,
+            (record.get('user_id'), record.get('score', 0),
+             record.get('correct_answers', 0), record.get('total_questions', 0))
+        )
+        first_completion = conn.execute(
+            'INSERT OR IGNORE INTO user_quizzes_completed (user_id, quiz_id) VALUES (?, ?)',
+            (record.get('user_id'), record.get('quiz_id'))
+        ).rowcount
+        conn.execute(
+            """
+            INSERT INTO quiz_totals (quiz_id, attempts, users_completed, score_sum)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT (quiz_id) DO UPDATE SET
+                attempts = attempts + 1,
+                users_completed = users_completed + excluded.users_completed,
+                score_sum = score_sum + excluded.score_sum
+            """,
+            (record.get('quiz_id'), first_completion, record.get('score', 0))
+        )
+
+    def _rebuild_quiz_aggregates(self, conn):
+        conn.execute('DELETE FROM user_quiz_stats')
+        conn.execute('DELETE FROM user_quizzes_completed')
+        conn.execute('DELETE FROM quiz_totals')
+        count = 0
+        rows = conn.execute('SELECT id, record FROM quiz_progress').fetchall()
+        rows += [(row[0], row[5]) for row in self._all_archived_rows(conn, 'quiz')]
+        rows.sort()
+        for _, raw in rows:
+            self._apply_quiz_aggregates(conn, json.loads(raw))
+            count += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('aggregates:quiz', ?)", (str(count),)
+        )
+        return count
+
+    def _rebuild_challenge_totals(self, conn):
+        """Derive the challenge totals from the per-user rows (no replay of the raw log needed)."""
+        conn.execute('DELETE FROM challenge_totals')
+        conn.execute(
+            """
+            INSERT INTO challenge_totals (challenge_id, attempts, users_attempted, users_completed)
+            SELECT challenge_id, SUM(attempts), COUNT(*), SUM(best_score >= ?)
+            FROM user_challenge_stats GROUP BY challenge_id
+            """,
+            (COMPLETION_SCORE,)
+        )
+        count = conn.execute('SELECT COUNT(*) FROM user_challenge_stats').fetchone()[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('aggregates:challenge-totals', ?)", (str(count),)
+        )
+        return count
+
+    def _rebuild_quiz_totals(self, conn):
+        """Derive the quiz totals from the progress log, archived attempts included."""
+        conn.execute('DELETE FROM quiz_totals')
+        rows = conn.execute('SELECT id, quiz_id, user_id, score FROM quiz_progress').fetchall()
+        rows += [tuple(row[:4]) for row in self._all_archived_rows(conn, 'quiz')]
+        rows.sort()
+        totals = {}  # quiz_id -> [attempts, users, score_sum]
+        for _, quiz_id, user_id, score in rows:
+            total = totals.setdefault(quiz_id, [0, set(), 0])
+            total[0] += 1
+            total[1].add(user_id)
+            total[2] += score
+        conn.executemany(
+            'INSERT INTO quiz_totals (quiz_id, attempts, users_completed, score_sum) VALUES (?, ?, ?, ?)',
+            [(quiz_id, attempts, len(users), score_sum) for quiz_id, (attempts, users, score_sum) in totals.items()]
+        )
+        count = len(rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('aggregates:quiz-totals', ?)", (str(count),)
+        )
+        return count
+
+    def add_challenge_submission(self, record):
+        """Append a challenge submission and return its id."""
+        with metrics.timer('store_write_seconds', table='challenge_submissions'), self.transaction() as conn:
+            return self._insert_challenge_submission(conn, record)
+
+    def add_quiz_progress(self, record):
+        """Append a quiz progress record and return its id."""
+        with metrics.timer('store_write_seconds', table='quiz_progress'), self.transaction() as conn:
+            return self._insert_quiz_progress(conn, record)
+
+    def add_quiz_progress_batch(self, records):
+        """Append several quiz progress records in one transaction and return their ids."""
+        with metrics.timer('store_write_seconds', table='quiz_progress'), self.transaction() as conn:
+            return [self._insert_quiz_progress(conn, record) for record in records]
+
+    # --- Reads ---
+
+    @metrics.timer('store_read_seconds', query='challenge_submissions')
+    def challenge_submissions(self, challenge_id, user_id, fields=None, include_archived=False):
+        """
+        The live submissions of one user for one challenge, oldest first.
+        With `include_archived`, archived ones are read back and included.
+        """
+        conn = self.connection()
+        rows = conn.execute(
+            f'SELECT id, {RECORD_COLUMNS} FROM challenge_submissions '
+            'WHERE user_id = ? AND challenge_id = ? ORDER BY timestamp, id',
+            (user_id, challenge_id)
+        ).fetchall()
+        if include_archived:
+            chunks = self._archive_index(conn, 'challenge', user_id, challenge_id)
+            if chunks:
+                rows = sorted(rows + self._read_chunks(chunks), key=_history_key)
+        return self._expand_records(conn, [row[1:] for row in rows], fields)
+
+    @metrics.timer('store_read_seconds', query='challenge_submissions_page')
+    def challenge_submissions_page(self, challenge_id, user_id, limit, cursor=None, descending=False, fields=None):
+        """
+        One page of a user's submissions for a challenge, ordered by timestamp.
+        Returns (records, next_cursor); next_cursor is None on the last page.
+        """
+        comparison, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+        where = 'user_id = ? AND challenge_id = ?'
+        params = [user_id, challenge_id]
+        after = None
+        if cursor is not None:
+            after = decode_cursor(cursor)
+            where += f' AND (timestamp, id) {comparison} (?, ?)'
+            params.extend(after)
+
+        # Fetch one extra row to know whether another page exists
+        conn = self.connection()
+        rows = conn.execute(
+            f'SELECT id, {RECORD_COLUMNS} FROM challenge_submissions WHERE {where} '
+            f'ORDER BY timestamp {direction}, id {direction} LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+        rows = self._merge_archived_page(conn, user_id, challenge_id, rows, limit, after, descending)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
+        return self._expand_records(conn, [row[1:] for row in rows], fields), next_cursor
+
+    @metrics.timer('store_read_seconds', query='challenge_overview')
+    def challenge_overview(self, user_id, fields=SUMMARY_FIELDS):
+        """
+        Attempts, best and latest submission for every challenge a user tried.
+        Reads one aggregate row per challenge, however many attempts there were.
+        """
+        conn = self.connection()
+        stats = conn.execute(
+            'SELECT challenge_id, attempts, best_submission_id, latest_submission_id '
+            'FROM user_challenge_stats WHERE user_id = ? ORDER BY challenge_id',
+            (user_id,)
+        ).fetchall()
+        ids = {row[2] for row in stats} | {row[3] for row in stats}
+        records = {}
+        if ids:
+            placeholders = ', '.join('?' for _ in ids)
+            rows = conn.execute(
+                f'SELECT id, {RECORD_COLUMNS} FROM challenge_submissions WHERE id IN ({placeholders})', list(ids)
+            ).fetchall()
+            expanded = self._expand_records(conn, [row[1:] for row in rows], fields)
+            records = {row[0]: record for row, record in zip(rows, expanded)}
+        return [
+            {
+                'challenge_id': challenge_id,
+                'attempts': attempts,
+                'best': records.get(best_id),
+                'latest': records.get(latest_id)
+            }
+            for challenge_id, attempts, best_id, latest_id in stats
+        ]
+
+    def _merge_archived_page(self, conn, user_id, challenge_id, rows, limit, after, descending):
+        """
+        Add the archived submissions that belong on a page to its live `rows`
+        (up to limit + 1, in page order). Chunks are read nearest first, and
+        only until the page is full, another row is known to follow it and the
+        next chunk starts beyond the page's last row.
+        """
+        chunks = self._archive_index(conn, 'challenge', user_id, challenge_id, after, descending)
+        if not chunks:
+            return rows
+        # A chunk's "near" end is the one a page in this direction reaches first
+        chunks.sort(key=lambda chunk: chunk[5] if descending else chunk[4], reverse=descending)
+        for chunk in chunks:
+            if len(rows) > limit:
+                edge, near = _history_key(rows[limit - 1]), chunk[5] if descending else chunk[4]
+                if (near < edge) if descending else (near > edge):
+                    break
+            archived = self.archive.read(*chunk[:4])
+            if after is not None:
+                archived = [row for row in archived
+                            if ((_history_key(row) < after) if descending else (_history_key(row) > after))]
+            rows = sorted(list(rows) + archived, key=_history_key, reverse=descending)[:limit + 1]
+        return rows
+
+    @metrics.timer('store_read_seconds', query='quiz_progress')
+    def quiz_progress(self, user_id, include_archived=False):
+        """
+        The live quiz progress records of one user, oldest first. With
+        `include_archived`, archived ones are read back and included.
+        """
+        conn = self.connection()
+        rows = conn.execute(
+            'SELECT id, record FROM quiz_progress WHERE user_id = ? ORDER BY id', (user_id,)
+        ).fetchall()
+        if include_archived:
+            chunks = self._archive_index(conn, 'quiz', user_id)
+            if chunks:
+                rows = sorted(rows + [(row[0], row[5]) for row in self._read_chunks(chunks)])
+        return [json.loads(row[1]) for row in rows]
+
+    def archived_count(self, kind, user_id, item_id=None):
+        """How many of a user's records of `kind` ('challenge' or 'quiz') are archived."""
+        query = 'SELECT COALESCE(SUM(records), 0) FROM archive_chunks WHERE kind = ? AND user_id = ?'
+        params = [kind, user_id]
+        if item_id is not None:
+            query += ' AND item_id = ?'
+            params.append(item_id)
+        return self.connection().execute(query, params).fetchone()[0]
+
+    def _archive_index(self, conn, kind, user_id, item_id=None, after=None, descending=False):
+        """
+        (kind, period, offset, length, first, last) of a user's archived chunks,
+        where first and last are (timestamp, id). With `after`, only chunks
+        holding a row past that (timestamp, id) in the page direction.
+        """
+        query = ('SELECT period, byte_offset, byte_length, first_timestamp, first_id, last_timestamp, last_id '
+                 'FROM archive_chunks WHERE kind = ? AND user_id = ?')
+        params = [kind, user_id]
+        if item_id is not None:
+            query += ' AND item_id = ?'
+            params.append(item_id)
+        if after is not None:
+            query += ' AND (first_timestamp, first_id) < (?, ?)' if descending else \
+                ' AND (last_timestamp, last_id) > (?, ?)'
+            params.extend(after)
+        return [
+            (kind, period, offset, length, (first_timestamp, first_id), (last_timestamp, last_id))
+            for period, offset, length, first_timestamp, first_id, last_timestamp, last_id
+            in conn.execute(query, params)
+        ]
+
+    def _read_chunks(self, chunks):
+        return [tuple(row) for chunk in chunks for row in self.archive.read(*chunk[:4])]
+
+    def _all_archived_rows(self, conn, kind):
+        """Every archived row of `kind`, for rebuilding the aggregates."""
+        chunks = conn.execute(
+            'SELECT kind, period, byte_offset, byte_length FROM archive_chunks WHERE kind = ? ORDER BY period, byte_offset',
+            (kind,)
+        ).fetchall()
+        return self._read_chunks(chunks)
+
+    @metrics.timer('store_read_seconds', query='quiz_summary')
+    def quiz_summary(self, user_id):
+        """
+        Running quiz aggregates for one user, or None if they have no progress.
+        This is a primary-key lookup, independent of how much history exists.
+        """
+        conn = self.connection()
+        row = conn.execute(
+            'SELECT attempts, score_sum, correct_sum, question_sum FROM user_quiz_stats WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        completed = conn.execute(
+            'SELECT COUNT(*) FROM user_quizzes_completed WHERE user_id = ?', (user_id,)
+        ).fetchone()[0]
+        return {
+            'attempts': row[0],
+            'score_sum': row[1],
+            'correct_sum': row[2],
+            'question_sum': row[3],
+            'quizzes_completed': completed
+        }
+
+    @metrics.timer('store_read_seconds', query='roster_progress')
+    def roster_progress(self, user_ids, challenge_ids=None):
+        """
+        Quiz aggregates and per-challenge best scores for a whole class, as
+        ({user_id: quiz stats like quiz_summary()}, {user_id: {challenge_id: (attempts, best_score)}}).
+        One indexed lookup per table and chunk of users, so the cost follows the
+        roster size, not the length of anyone's history. Users without activity
+        are left out; ids are returned as strings, the way they are stored.
+        """
+        conn = self.connection()
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        quiz_stats, challenge_scores = {}, {}
+        for chunk in _chunks(user_ids):
+            placeholders = ', '.join('?' for _ in chunk)
+            for user_id, attempts, score_sum, correct_sum, question_sum in conn.execute(
+                'SELECT user_id, attempts, score_sum, correct_sum, question_sum '
+                f'FROM user_quiz_stats WHERE user_id IN ({placeholders})',
+                chunk
+            ):
+                quiz_stats[user_id] = {
+                    'attempts': attempts,
+                    'score_sum': score_sum,
+                    'correct_sum': correct_sum,
+                    'question_sum': question_sum,
+                    'quizzes_completed': 0
+                }
+            for user_id, completed in conn.execute(
+                'SELECT user_id, COUNT(*) FROM user_quizzes_completed '
+                f'WHERE user_id IN ({placeholders}) GROUP BY user_id',
+                chunk
+            ):
+                if user_id in quiz_stats:
+                    quiz_stats[user_id]['quizzes_completed'] = completed
+
+            query = ('SELECT user_id, challenge_id, attempts, best_score FROM user_challenge_stats '
+                     f'WHERE user_id IN ({placeholders})')
+            params = list(chunk)
+            if challenge_ids is not None:
+                challenge_ids = list(challenge_ids)
+                if not challenge_ids:
+                    continue
+                query += f" AND challenge_id IN ({', '.join('?' for _ in challenge_ids)})"
+                params += challenge_ids
+            for user_id, challenge_id, attempts, best_score in conn.execute(query, params):
+                challenge_scores.setdefault(user_id, {})[challenge_id] = (attempts, best_score)
+        return quiz_stats, challenge_scores
+
+    @metrics.timer('store_read_seconds', query='leaderboard')
+    def leaderboard(self, challenge_id, limit):
+        """
+        The `limit` best scores for a challenge, one per user, highest first.
+        Ties go to whoever reached the score first. Reads `limit` index entries,
+        however many submissions the challenge has.
+        """
+        rows = self.connection().execute(
+            """
+            SELECT s.user_id, s.best_score, s.attempts, s.best_submission_id, c.timestamp
+            FROM user_challenge_stats AS s
+            JOIN challenge_submissions AS c ON c.id = s.best_submission_id
+            WHERE s.challenge_id = ?
+            ORDER BY s.best_score DESC, s.best_submission_id
+            LIMIT ?
+            """,
+            (challenge_id, limit)
+        ).fetchall()
+        return [
+            {
+                'rank': rank,
+                'user_id': user_id,
+                'best_score': best_score,
+                'attempts': attempts,
+                'best_submission_id': submission_id,
+                'achieved_at': timestamp
+            }
+            for rank, (user_id, best_score, attempts, submission_id, timestamp) in enumerate(rows, start=1)
+        ]
+
+    @metrics.timer('store_read_seconds', query='failure_history')
+    def failure_history(self, challenge_id, user_id, cases_version):
+        """
+        ({test index: (runs, failures)}, indices the user's latest submission failed)
+        for one version of a challenge's test cases.
+        """
+        conn = self.connection()
+        case_stats = {
+            index: (runs, failures) for index, runs, failures in conn.execute(
+                'SELECT test_index, runs, failures FROM test_case_stats WHERE cases_version = ?', (cases_version,)
+            )
+        }
+        row = conn.execute(
+            'SELECT s.record FROM user_challenge_stats u '
+            'JOIN challenge_submissions s ON s.id = u.latest_submission_id '
+            'WHERE u.user_id = ? AND u.challenge_id = ?',
+            (user_id, challenge_id)
+        ).fetchone()
+        previously_failed = set()
+        results = json.loads(row[0]).get('_results') if row is not None else None
+        if results is not None and results['cases'] == cases_version:
+            previously_failed = {i for i in range(len(results['outputs'])) if not results['passed'] >> i & 1}
+        return case_stats, previously_failed
+
+    @metrics.timer('store_read_seconds', query='completion_totals')
+    def completion_totals(self, challenge_ids, quiz_ids):
+        """
+        Class-wide totals for the given challenges and quizzes, as
+        ({challenge_id: totals}, {quiz_id: totals}). Ids without any activity
+        are left out.
+        """
+        conn = self.connection()
+        challenges, quizzes = {}, {}
+        challenge_ids, quiz_ids = list(challenge_ids), list(quiz_ids)
+        if challenge_ids:
+            placeholders = ', '.join('?' for _ in challenge_ids)
+            for challenge_id, attempts, attempted, completed in conn.execute(
+                'SELECT challenge_id, attempts, users_attempted, users_completed '
+                f'FROM challenge_totals WHERE challenge_id IN ({placeholders})',
+                challenge_ids
+            ):
+                challenges[challenge_id] = {
+                    'attempts': attempts,
+                    'users_attempted': attempted,
+                    'users_completed': completed
+                }
+        if quiz_ids:
+            placeholders = ', '.join('?' for _ in quiz_ids)
+            for quiz_id, attempts, completed, score_sum in conn.execute(
+                'SELECT quiz_id, attempts, users_completed, score_sum '
+                f'FROM quiz_totals WHERE quiz_id IN ({placeholders})',
+                quiz_ids
+            ):
+                quizzes[quiz_id] = {
+                    'attempts': attempts,
+                    'users_completed': completed,
+                    'score_sum': score_sum
+                }
+        return challenges, quizzes
+
+    # --- Maintenance ---
+
+    def rebuild_aggregates(self):
+        """
+        Recompute every derived aggregate from the raw submission and progress logs.
+        Returns the number of records replayed per aggregate.
+        """
+        counts = {}
+        with self.transaction() as conn:
+            for marker, rebuild in self._aggregate_builders():
+                counts[marker.split(':', 1)[1]] = rebuild(conn)
+        return counts
+
+    def archive_history(self, before, batch_size=5000):
+        """
+        Move challenge submissions and quiz progress with a timestamp before
+        `before` into compressed archive segments, keeping every user's best
+        and latest submission per challenge and latest attempt per quiz live.
+        Aggregates are unchanged: they already count the archived records.
+        Returns the number of records archived per table.
+        """
+        counts = {}
+        for kind, query in ARCHIVE_CANDIDATES.items():
+            table = ARCHIVE_TABLES[kind]
+            counts[table] = 0
+            while True:
+                # One batch per transaction, so workers are only kept waiting briefly
+                with metrics.timer('store_write_seconds', table=table), self.transaction() as conn:
+                    rows = conn.execute(query, (before, batch_size)).fetchall()
+                    if rows:
+                        self._archive_rows(conn, kind, table, rows)
+                counts[table] += len(rows)
+                if len(rows) < batch_size:
+                    break
+        # Hand the freed pages back to the file system
+        self.compact()
+        return counts
+
+    def _archive_rows(self, conn, kind, table, rows):
+        """Append rows (sorted by user, item and time) to the archive, index them and delete them."""
+        groups = {}
+        for row in rows:
+            groups.setdefault((row[2], row[1], period_of(row[4])), []).append(list(row))
+        # The chunks are synced to disk before the rows they hold are deleted
+        locations = self.archive.append(kind, [(period, group) for (_, _, period), group in groups.items()])
+        conn.executemany(
+            'INSERT INTO archive_chunks (kind, user_id, item_id, period, byte_offset, byte_length, records, '
+            'first_timestamp, first_id, last_timestamp, last_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(kind, user_id, item_id, period, offset, length, len(group),
+              group[0][4], group[0][0], group[-1][4], group[-1][0])
+             for ((user_id, item_id, period), group), (offset, length) in zip(groups.items(), locations)]
+        )
+        for chunk in _chunks([row[0] for row in rows]):
+            placeholders = ', '.join('?' for _ in chunk)
+            conn.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', chunk)
+
+    def compact(self):
+        """Fold the WAL back into the main database file and release free pages."""
+        conn = self.connection()
+        # incremental_vacuum frees one page per step and execute() takes only one, so run it as a script
+        conn.executescript('PRAGMA incremental_vacuum;')
+        # Checkpoint afterwards, so the file is truncated to the pages still in use
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA optimize')
+
+    def _start_compactor(self):
+        if not self.compact_interval or self._compactor_pid == os.getpid():
+            return
+        self._compactor_pid = os.getpid()
+        thread = threading.Thread(target=self._compact_loop, name='submission-store-compactor', daemon=True)
+        thread.start()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                # Another worker holding the lock just means we try again next round
+                print(f"Warning: Submission store compaction failed: {e}")
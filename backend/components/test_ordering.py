@@ -0,0 +1,110 @@
+"""
+Ordering of test cases for fail-fast grading.
+
+Students resubmit many times and mostly keep failing the same hard case.
+A fail-fast check ("does it pass yet?") therefore runs the cases most
+likely to fail first: the ones this user failed last time, then the rest
+by how often they fail across all submissions. It stops at the first
+failure, so a typical failing check costs one case instead of all of them.
+"""
+from .shared_db import ThreadConnections
+
+
+def order_test_cases(count, case_stats=None, previously_failed=()):
+    """
+    Indices 0..count-1 in the order to try them: the user's previously
+    failed cases, then by failure rate (highest first), then file order.
+    `case_stats` maps an index to (runs, failures).
+    """
+    case_stats = case_stats or {}
+    previously_failed = set(previously_failed)
+
+    def failure_rate(index):
+        runs, failures = case_stats.get(index, (0, 0))
+        # Smoothed, so a case seen failing once out of one run doesn't outrank a well-known hard case
+        return (failures + 1) / (runs + 2)
+
+    return sorted(range(count), key=lambda i: (i not in previously_failed, -failure_rate(i), i))
+
+
+def failed_indices(mask):
+    """Indices of the set bits of a failure bitmask."""
+    return {i for i in range(mask.bit_length()) if mask >> i & 1}
+
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS case_stats (
+    problem_key TEXT NOT NULL,
+    test_index INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    PRIMARY KEY (problem_key, test_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_failures (
+    problem_key TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    failed_mask INTEGER NOT NULL,
+    PRIMARY KEY (problem_key, user_id)
+) WITHOUT ROWID;
+"""
+
+
+class FailureHistory:
+    """
+    Per-case failure counts and each user's last failures, for graders that
+    keep no submission store (the autograder). Shared by all workers through
+    SQLite. `problem_key` should include a hash of the test cases, so edited
+    cases start with a clean history.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connections = ThreadConnections(db_path, HISTORY_SCHEMA)
+
+    def connection(self):
+        """Return this thread's connection, creating the schema on first use."""
+        return self._connections.get()
+
+    def order(self, problem_key, user_id, count):
+        """The order to run `count` test cases in for this user."""
+        conn = self.connection()
+        case_stats = {
+            index: (runs, failures) for index, runs, failures in conn.execute(
+                'SELECT test_index, runs, failures FROM case_stats WHERE problem_key = ?', (problem_key,)
+            )
+        }
+        previously_failed = ()
+        if user_id is not None:
+            row = conn.execute('SELECT failed_mask FROM user_failures WHERE problem_key = ? AND user_id = ?',
+                               (problem_key, str(user_id))).fetchone()
+            if row is not None:
+                previously_failed = failed_indices(row[0])
+        return order_test_cases(count, case_stats, previously_failed)
+
+    def record(self, problem_key, user_id, outcomes):
+        """Fold in one run; `outcomes` maps each test index that ran to whether it passed."""
+        if not outcomes:
+            return
+        ran_mask = sum(1 << index for index in outcomes)
+        failed_mask = sum(1 << index for index, passed in outcomes.items() if not passed)
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO case_stats (problem_key, test_index, runs, failures) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (problem_key, test_index) DO UPDATE SET '
+                'runs = runs + 1, failures = failures + excluded.failures',
+                [(problem_key, index, int(not passed)) for index, passed in outcomes.items()]
+            )
+            if user_id is not None:
+                # Cases that didn't run this time keep what the user's earlier runs said about them
+                conn.execute(
+                    'INSERT INTO user_failures (problem_key, user_id, failed_mask) VALUES (?, ?, ?) '
+                    'ON CONFLICT (problem_key, user_id) DO UPDATE SET '
+                    'failed_mask = (failed_mask & ~?) | excluded.failed_mask',
+                    (problem_key, str(user_id), failed_mask, ran_mask)
+                )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
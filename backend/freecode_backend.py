@@ -1,40 +1,154 @@
-from flask import Flask, request, jsonify
-import io
-import sys
-import contextlib
-import traceback
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
+import os
+import time
+
+from components import metrics, preflight
+from components.rate_limiter import RateLimited, client_keys, limiter_from_env, trust_proxies
+from components.sandbox import SandboxError, execute_code, get_default_pool, stream_code
 
 app = Flask(__name__)
+# Behind nginx, set TRUSTED_PROXIES to the number of proxies so rate limits see the client's IP
+app.wsgi_app = trust_proxies(app.wsgi_app, int(os.getenv("TRUSTED_PROXIES", "0")))
+# Set METRICS_DIR when running several workers so /metrics covers all of them
+metrics.configure(os.getenv("METRICS_DIR"))
+
+# Directory of the SQLite files shared by this server's workers (the main app's data directory)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "data"))
+
+# Per-user/per-IP rate limits and a cap on concurrent runs, shared by all workers through SQLite
+# (the autograder uses the same default file, so the cap covers both servers)
+LIMITER = limiter_from_env(os.path.join(DATA_DIR, "execution-limits.sqlite3"))
+
+
+def too_many_requests(error):
+    """429 response telling the client when to try again."""
+    response = jsonify({"error": str(error)})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
+def wants_profile():
+    """Whether the request asked for ?profile=true."""
+    return request.args.get("profile", "").lower() in ("1", "true", "yes")
+
+
+def time_budget(analysis, pool, profile):
+    """Seconds a run may take; tracing makes code many times slower, so profiled runs get the full budget."""
+    if profile:
+        return pool.limits["wall_seconds"]
+    return analysis.time_budget(pool.limits["wall_seconds"])
+
 
 @app.route("/api/run_code", methods=["POST"])
 def run_code():
-    """Execute arbitrary Python code safely and return stdout/stderr."""
+    """
+    Execute arbitrary Python code safely and return stdout/stderr.
+    With ?profile=true the response also has a `profile`: steps, wall/CPU
+    time, peak memory and the lines that ran most.
+    """
     data = request.get_json()
     code = data.get("code", "")
 
     if not code.strip():
         return jsonify({"error": "No code provided"}), 400
 
-    # Capture stdout and stderr
-    stdout = io.StringIO()
-    stderr = io.StringIO()
+    # Syntax errors, forbidden imports and endless loops are answered here, without taking a runner
+    analysis = preflight.analyze(code)
+    if not analysis.ok:
+        return jsonify({"stdout": "", "stderr": analysis.message() + "\n", "problems": analysis.problems})
 
     try:
-        with contextlib.redirect_stdout(stdout):
-            with contextlib.redirect_stderr(stderr):
-                # Execute user code in an isolated namespace
-                exec(code, {}, {})
-    except Exception:
-        # Capture traceback if any runtime error
-        traceback.print_exc(file=stderr)
-
-    output = stdout.getvalue()
-    errors = stderr.getvalue()
-
-    return jsonify({
-        "stdout": output,
-        "stderr": errors
+        # Execute user code in a sandboxed worker process, never in this web worker
+        pool = get_default_pool()
+        profile = wants_profile()
+        with LIMITER.admit(client_keys(data.get("user_id"), request.remote_addr)), \
+                metrics.timer("code_execution_seconds", mode="run"):
+            result = pool.run(execute_code, code, "", profile, timeout=time_budget(analysis, pool, profile))
+    except RateLimited as e:
+        return too_many_requests(e)
+    except SandboxError as e:
+        # Timeouts and crashed runners are reported like any other program error
+        result = {"stdout": "", "stderr": f"{e}\n"}
+
+    metrics.get_registry().maybe_flush()
+    response = {
+        "stdout": result["stdout"],
+        "stderr": result["stderr"]
+    }
+    if "profile" in result:
+        response["profile"] = result["profile"]
+    return jsonify(response)
+
+
+def _sse(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/run_code/stream", methods=["POST"])
+def run_code_stream():
+    """
+    Execute Python code and stream its output as Server-Sent Events.
+
+    Sends 'stdout' and 'stderr' events with text chunks while the program
+    runs, then one 'done' event with {"error": message or null}. Output is
+    capped; past the cap a truncation notice is sent and the program stops.
+    With ?profile=true the 'done' event also carries the run's `profile`.
+    """
+    data = request.get_json()
+    code = data.get("code", "")
+
+    if not code.strip():
+        return jsonify({"error": "No code provided"}), 400
+
+    analysis = preflight.analyze(code)
+    if not analysis.ok:
+        message = analysis.message()
+        body = _sse("stderr", message + "\n") + _sse("done", {"error": message, "problems": analysis.problems})
+        return Response(body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    try:
+        lease_id = LIMITER.acquire(client_keys(data.get("user_id"), request.remote_addr))
+    except RateLimited as e:
+        return too_many_requests(e)
+
+    profile = wants_profile()
+
+    def generate():
+        error = None
+        done = {}
+        started = time.perf_counter()
+        try:
+            pool = get_default_pool()
+            timeout = time_budget(analysis, pool, profile)
+            for kind, chunk in pool.stream(stream_code, code, "", profile, timeout=timeout):
+                if kind == "result":
+                    error = chunk.get("error")
+                    if "profile" in chunk:
+                        done["profile"] = chunk["profile"]
+                else:
+                    yield _sse(kind, chunk)
+        except SandboxError as e:
+            error = str(e)
+        metrics.observe("code_execution_seconds", time.perf_counter() - started, mode="stream")
+        metrics.get_registry().maybe_flush()
+        yield _sse("done", {"error": error, **done})
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Ask nginx not to buffer the stream so output reaches the editor right away
+        "X-Accel-Buffering": "no"
     })
+    # The run counts against the concurrency cap until the stream is closed, even if the client leaves early
+    response.call_on_close(lambda: LIMITER.release(lease_id))
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Code execution timings in the Prometheus text format."""
+    return Response(metrics.get_registry().render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":